@@ -0,0 +1,195 @@
+"""
+On-disk cache of parsed question banks.
+
+Each parsed bank is stored once per content hash as a small pickle of columns
+(texts, marks, CO, RBT, paragraph numbers). A path index remembers the size, mtime
+and hash last seen for every bank file, so an unchanged bank is found without
+re-hashing it.
+Near-duplicate clusters (see duplicates.py) are cached the same way, keyed by a hash
+of the clustered texts and the similarity threshold, so a warm start does not
+compute MinHash signatures again.
+Entries are evicted least-recently-used first once the cache outgrows max_bytes.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from array import array
+
+from duplicates import DEFAULT_THRESHOLD, find_duplicate_clusters
+
+CACHE_MAGIC = b"QGENBANK\x02"
+CLUSTERS_MAGIC = b"QGENDUPS\x01"
+INDEX_FILE = "index.pickle"
+ENTRY_SUFFIX = ".bank"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def default_cache_dir():
+    """Cache directory, overridable with the QGEN_CACHE_DIR environment variable"""
+    return os.environ.get("QGEN_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "qgen")
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _atomic_write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+
+def _write_index(cache_dir, index):
+    _atomic_write(os.path.join(cache_dir, INDEX_FILE), pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+
+def _entry_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest + ENTRY_SUFFIX)
+
+def _encode_questions(questions):
+    columns = (
+        [q["question"] for q in questions],
+        [q["marks"] for q in questions],
+        [q["co"] for q in questions],
+        [q["rbt"] for q in questions],
+        [q.get("paragraph") for q in questions],
+    )
+    return CACHE_MAGIC + pickle.dumps(columns, pickle.HIGHEST_PROTOCOL)
+
+def _decode_questions(data):
+    if not data.startswith(CACHE_MAGIC):
+        raise ValueError("not a question bank cache entry")
+    texts, marks, cos, rbts, paragraphs = pickle.loads(data[len(CACHE_MAGIC):])
+    return [{"question": text, "marks": m, "co": co, "rbt": rbt, "paragraph": paragraph}
+            for text, m, co, rbt, paragraph in zip(texts, marks, cos, rbts, paragraphs)]
+
+def _read_entry(cache_dir, digest):
+    """Return the cached questions for digest, or None on a miss"""
+    path = _entry_path(cache_dir, digest)
+    try:
+        with open(path, "rb") as f:
+            questions = _decode_questions(f.read())
+        # The entry's mtime records its last use for LRU eviction
+        os.utime(path)
+        return questions
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        return None
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES, index=None):
+    """Delete least-recently-used entries until the cache fits in max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(ENTRY_SUFFIX):
+            st = os.stat(os.path.join(cache_dir, name))
+            entries.append((st.st_mtime_ns, st.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    removed = set()
+    for _, size, name in entries:
+        if total <= max_bytes:
+            break
+        os.unlink(os.path.join(cache_dir, name))
+        removed.add(name[:-len(ENTRY_SUFFIX)])
+        total -= size
+    if removed and index is not None:
+        for path in [p for p, record in index.items() if record[2] in removed]:
+            del index[path]
+    return removed
+
+def _encode_clusters(clusters):
+    return CLUSTERS_MAGIC + array("i", clusters).tobytes()
+
+def _decode_clusters(data):
+    if not data.startswith(CLUSTERS_MAGIC):
+        raise ValueError("not a near-duplicate cache entry")
+    clusters = array("i")
+    clusters.frombytes(data[len(CLUSTERS_MAGIC):])
+    return clusters.tolist()
+
+def clusters_digest(texts, threshold):
+    """Cache key of the near-duplicate clusters of texts at a threshold"""
+    digest = hashlib.sha256(f"clusters {threshold!r}".encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0" + text.encode("utf-8"))
+    return digest.hexdigest()
+
+def load_cached_clusters(texts, threshold=DEFAULT_THRESHOLD, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    find_duplicate_clusters(texts, threshold), served from the cache when the same
+    texts were clustered at the same threshold before. Like load_cached, cache
+    failures only cost the computation.
+    """
+    texts = list(texts)
+    cache_dir = cache_dir or default_cache_dir()
+    digest = clusters_digest(texts, threshold)
+    path = _entry_path(cache_dir, digest)
+    try:
+        with open(path, "rb") as f:
+            clusters = _decode_clusters(f.read())
+        if len(clusters) == len(texts):
+            os.utime(path)
+            return clusters
+    except (OSError, ValueError):
+        pass
+    clusters = find_duplicate_clusters(texts, threshold)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _atomic_write(path, _encode_clusters(clusters))
+        index = _read_index(cache_dir)
+        if evict(cache_dir, max_bytes, index):
+            _write_index(cache_dir, index)
+    except OSError:
+        pass
+    return clusters
+
+def load_cached(path, loader, cache_dir=None, rebuild=False, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Return loader(path), served from the cache when the bank has been parsed before.
+    With rebuild=True the bank is always re-parsed and its cache entry replaced.
+    Cache failures never prevent loading; they only cost a re-parse.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    abs_path = os.path.abspath(path)
+    st = os.stat(abs_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return loader(path)
+
+    index = _read_index(cache_dir)
+    record = index.get(abs_path)
+    if not rebuild and record and record[:2] == (st.st_size, st.st_mtime_ns):
+        questions = _read_entry(cache_dir, record[2])
+        if questions is not None:
+            return questions
+
+    # Size or mtime changed (or the entry is gone): the content hash decides
+    digest = file_digest(abs_path)
+    questions = None if rebuild else _read_entry(cache_dir, digest)
+    if questions is None:
+        questions = loader(path)
+        try:
+            _atomic_write(_entry_path(cache_dir, digest), _encode_questions(questions))
+        except OSError:
+            return questions
+
+    index[abs_path] = (st.st_size, st.st_mtime_ns, digest)
+    try:
+        evict(cache_dir, max_bytes, index)
+        _write_index(cache_dir, index)
+    except OSError:
+        pass
+    return questions
@@ -0,0 +1,340 @@
+"""
+Columnar, memory-mapped store of parsed question banks.
+
+    python bank_store.py export banks/ --output university.qbank
+    python bank_store.py info university.qbank
+    python qgen.py --store university.qbank --co CO-1,CO-2 --marks 2-10
+
+Loading a .docx bank builds a dict and a Question for every question in it. A large
+repository can instead be exported once into a store file that keeps each field as
+a column:
+
+- marks, CO, RBT and source bank as codes (one byte; two for the source) into
+  short tables of their distinct values; source banks are stored relative to the
+  store file, so the store and its banks can be moved or opened from anywhere together
+- paragraph numbers, text hashes (history.question_hash) and near-duplicate
+  clusters as typed arrays
+- the question texts as one UTF-8 blob, with an array of offsets into it
+
+The file is memory-mapped and opening it reads only the metadata footer. Filtering
+by marks, CO and RBT translates a whole code column into a 0/1 mask with
+bytes.translate and combines the masks as big integers, so no Python code runs for
+questions that do not match. A question's text is decoded when it is first read
+(shown, searched or put into a paper). Near-duplicate clusters are found at export
+time and the stored hashes let the usage history be checked without any text.
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter
+
+from browser import _label_key
+from duplicates import DEFAULT_THRESHOLD, find_duplicate_clusters
+from history import question_hash
+from questions import Question, QuestionBank
+
+STORE_MAGIC = b"QGENCOL\x01"
+STORE_VERSION = 2
+STORE_EXTENSION = ".qbank"
+# Metadata length and magic at the very end of the file
+_FOOTER = struct.Struct("<Q8s")
+_ALIGN = 8
+# Dictionary-coded columns and the array type of their codes
+_CODED = {"marks": "B", "co": "B", "rbt": "B", "source": "H"}
+_SET_BYTE = re.compile(b"\x01")
+
+
+def _write_column(f, columns, name, data):
+    """Write an array at the next aligned offset and record where it went"""
+    f.write(b"\0" * (-f.tell() % _ALIGN))
+    columns[name] = [f.tell(), data.typecode, len(data)]
+    f.write(data)
+
+
+def _relative_source(source, directory):
+    """A source bank path relative to the store's directory (absolute if it is on another drive)"""
+    if source is None:
+        return None
+    source = os.path.abspath(source)
+    try:
+        return os.path.relpath(source, directory)
+    except ValueError:
+        return source
+
+
+def export_store(questions, path, threshold=DEFAULT_THRESHOLD):
+    """
+    Write questions (dicts as load_question_banks() returns them) to a store file.
+    Near-duplicate clusters are found at threshold and stored with them, unless
+    threshold is None. The store's directory is created if needed. Returns the number
+    of questions written; raises ValueError if a column has more distinct values than
+    its codes can number (256 for marks, CO and RBT, 65536 banks).
+    """
+    questions = list(questions)
+    directory = os.path.dirname(os.path.abspath(path))
+    values = {name: [] for name in _CODED}
+    codes = {name: array(typecode) for name, typecode in _CODED.items()}
+    lookup = {name: {} for name in _CODED}
+    paragraphs = array("i")
+    hashes = array("q")
+    for q in questions:
+        for name, column in codes.items():
+            value = q.get(name)
+            code = lookup[name].get(value)
+            if code is None:
+                code = lookup[name][value] = len(values[name])
+                # Codes 0 to 2 ** bits - 1 fit the column; this is the first that does not
+                if code >> (8 * column.itemsize):
+                    raise ValueError(f"More than {code} different {name} values; a store can hold {code} at most")
+                values[name].append(_relative_source(value, directory) if name == "source" else value)
+            column.append(code)
+        paragraphs.append(q.get("paragraph") or 0)
+        hashes.append(question_hash(q["question"]))
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(STORE_MAGIC)
+            columns = {}
+            for name, column in codes.items():
+                _write_column(f, columns, name, column)
+            _write_column(f, columns, "paragraph", paragraphs)
+            _write_column(f, columns, "hash", hashes)
+            if threshold is not None:
+                clusters = find_duplicate_clusters((q["question"] for q in questions), threshold)
+                _write_column(f, columns, "cluster", array("i", clusters))
+            # Texts go straight to the file; their offsets follow them
+            offsets = array("Q", [0])
+            start = f.tell()
+            for q in questions:
+                data = q["question"].encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+            columns["text"] = [start, "B", offsets[-1]]
+            _write_column(f, columns, "offsets", offsets)
+            metadata = json.dumps({"version": STORE_VERSION, "count": len(questions), "byteorder": sys.byteorder,
+                                   "similarity": threshold, "values": values, "columns": columns}).encode("utf-8")
+            f.write(metadata)
+            f.write(_FOOTER.pack(len(metadata), STORE_MAGIC))
+        # mkstemp creates the file private; a store is meant to be shared like a bank
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(questions)
+
+
+class BankStore:
+    """
+    A store file opened read-only through mmap; use as a context manager or call close().
+    Rows are numbered 0 to len(store) - 1 in export order. values holds the distinct
+    marks, CO, RBT and source values (source banks as paths resolved against the
+    store's directory); similarity is the threshold the stored near-duplicate
+    clusters were found at (None when there are none).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._columns = {}
+        try:
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self):
+        size = len(self._map)
+        if size < len(STORE_MAGIC) + _FOOTER.size or self._map[:len(STORE_MAGIC)] != STORE_MAGIC:
+            raise ValueError(f"{self.path} is not a question bank store")
+        metadata_length, magic = _FOOTER.unpack(self._map[size - _FOOTER.size:])
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{self.path} is not a complete question bank store")
+        end = size - _FOOTER.size
+        metadata = json.loads(self._map[end - metadata_length:end])
+        if metadata["version"] != STORE_VERSION:
+            raise ValueError(f"{self.path} is a version {metadata['version']} store; export it again")
+        if metadata["byteorder"] != sys.byteorder:
+            raise ValueError(f"{self.path} was exported on a {metadata['byteorder']}-endian machine; export it again")
+        self.count = metadata["count"]
+        self.values = metadata["values"]
+        # Source banks are stored relative to the store file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        self.values["source"] = [None if source is None else os.path.normpath(os.path.join(directory, source))
+                                 for source in self.values["source"]]
+        self.similarity = metadata["similarity"]
+        view = memoryview(self._map)
+        for name, (offset, typecode, length) in metadata["columns"].items():
+            itemsize = array(typecode).itemsize
+            self._columns[name] = view[offset:offset + length * itemsize].cast(typecode)
+        view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        # The mmap cannot close while column views of it are alive
+        for column in self._columns.values():
+            column.release()
+        self._columns = {}
+        self._map.close()
+
+    def __len__(self):
+        return self.count
+
+    def fields(self, row):
+        """(marks, CO, RBT, source, paragraph) of a row"""
+        columns, values = self._columns, self.values
+        return (values["marks"][columns["marks"][row]], values["co"][columns["co"][row]],
+                values["rbt"][columns["rbt"][row]], values["source"][columns["source"][row]],
+                columns["paragraph"][row] or None)
+
+    def text(self, row):
+        """Decode a row's question text"""
+        offsets = self._columns["offsets"]
+        return str(self._columns["text"][offsets[row]:offsets[row + 1]], "utf-8")
+
+    def text_hash(self, row):
+        return self._columns["hash"][row]
+
+    def select(self, marks=None, co=None, rbt=None):
+        """
+        Rows whose marks, CO and RBT are among the given values (None: any), in order.
+        CO and RBT match like the question browser's filters ("co1" finds "CO-1").
+        """
+        keys = {"marks": lambda value: value, "co": lambda value: _label_key(str(value)),
+                "rbt": lambda value: _label_key(str(value))}
+        mask = None
+        for name, accepted in (("marks", marks), ("co", co), ("rbt", rbt)):
+            if accepted is None:
+                continue
+            key = keys[name]
+            accepted = {key(value) for value in accepted}
+            table = bytes(key(value) in accepted for value in self.values[name]).ljust(256, b"\0")
+            column_mask = self._columns[name].tobytes().translate(table)
+            if mask is None:
+                mask = column_mask
+            else:
+                mask = (int.from_bytes(mask, "little") & int.from_bytes(column_mask, "little")).to_bytes(
+                    self.count, "little")
+        if mask is None:
+            return range(self.count)
+        return [match.start() for match in _SET_BYTE.finditer(mask)]
+
+    def counts(self, name):
+        """{value: number of rows} for a coded column (marks, co, rbt or source)"""
+        column = self._columns[name]
+        if column.itemsize == 1:
+            data = column.tobytes()
+            return {value: data.count(code) for code, value in enumerate(self.values[name])}
+        counts = Counter(column)
+        return {value: counts[code] for code, value in enumerate(self.values[name])}
+
+    def clusters(self, rows):
+        """
+        The stored near-duplicate clusters of rows (ascending), as positions in rows
+        for QuestionBank.set_clusters(); None if the store has no clusters
+        """
+        column = self._columns.get("cluster")
+        if column is None:
+            return None
+        first = {}
+        return [first.setdefault(column[row], position) for position, row in enumerate(rows)]
+
+    def question_bank(self, rows=None):
+        """
+        A QuestionBank of the given rows (default: all), numbered from 0 in row order.
+        Every row becomes a StoredQuestion holding its marks, CO and RBT (only texts are
+        left on disk), so on a large store pass the rows from select() rather than all.
+        """
+        bank = QuestionBank()
+        for row in range(self.count) if rows is None else rows:
+            bank.append(StoredQuestion(len(bank), self, row))
+        return bank
+
+
+class StoredQuestion(Question):
+    """A Question from a BankStore whose text is decoded the first time it is read"""
+    __slots__ = ("_store", "_row", "_text")
+
+    def __init__(self, id, store, row):
+        self._store = store
+        self._row = row
+        Question.__init__(self, id, None, *store.fields(row))
+
+    @property
+    def question(self):
+        if self._text is None:
+            self._text = self._store.text(self._row)
+        return self._text
+
+    @question.setter
+    def question(self, text):
+        self._text = text
+
+    @property
+    def text_hash(self):
+        """history.question_hash() of the text, read from the store"""
+        return self._store.text_hash(self._row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export question banks to a columnar store, or describe a store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="parse question banks and write them to a store file")
+    export_parser.add_argument("banks", nargs="+", help=".docx banks, directories or glob patterns")
+    export_parser.add_argument("--output", required=True, help=f"store file to write, e.g. university{STORE_EXTENSION}")
+    export_parser.add_argument("--similarity", type=float, default=DEFAULT_THRESHOLD,
+                               help=f"text similarity at which questions count as near-duplicates "
+                                    f"(default: {DEFAULT_THRESHOLD})")
+    export_parser.add_argument("--no-duplicates", action="store_true",
+                               help="do not look for near-duplicates (qgen.py then compares the texts itself)")
+    export_parser.add_argument("--workers", type=int, default=None,
+                               help="processes used to parse the banks (default: number of CPU cores)")
+    export_parser.add_argument("--no-cache", action="store_true", help="parse the banks without the bank cache")
+    info_parser = commands.add_parser("info", help="show how many questions a store holds per marks, CO and RBT")
+    info_parser.add_argument("store")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        # Imported here: qgen builds on this module
+        from qgen import expand_bank_paths, load_question_banks
+
+        paths = [path for pattern in args.banks for path in expand_bank_paths(pattern)]
+        if not paths:
+            print("No .docx question banks found.")
+            return 1
+        questions = load_question_banks(paths, args.workers, use_cache=not args.no_cache)
+        try:
+            count = export_store(questions, args.output, None if args.no_duplicates else args.similarity)
+        except (OSError, ValueError) as e:
+            print(f"Could not write {args.output}: {e}")
+            return 1
+        print(f"Wrote {count} questions from {len(paths)} bank(s) to {args.output}")
+        return 0
+
+    with BankStore(args.store) as store:
+        print(f"{args.store}: {len(store)} questions from {len(store.values['source'])} bank(s), "
+              f"{os.path.getsize(args.store)} bytes")
+        if store.similarity is not None:
+            print(f"Near-duplicates found at similarity {store.similarity}")
+        for name, title in (("marks", "Marks"), ("co", "CO"), ("rbt", "RBT")):
+            counts = store.counts(name)
+            print(f"{title}: " + ", ".join(f"{value} ({counts[value]})" for value in sorted(counts)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Headless batch mode: generate many question papers from a manifest file.
+
+The manifest is JSON (or YAML, when PyYAML is installed):
+
+    {
+      "defaults": {"template": "template.docx", "rules": {"target": 25}},
+      "papers": [
+        {"bank": "cloud_computing.docx", "output": "out/cloud.docx", "seed": 1},
+        {"bank": "networks.docx", "output": "out/networks.docx",
+         "rules": {"blocks": [{"target": 25, "required_cos": ["CO-1", "CO-2"]},
+                              {"target": 25, "required_cos": ["CO-1", "CO-2"]},
+                              {"target": 25, "required_cos": ["CO-3"]},
+                              {"target": 25, "required_cos": ["CO-3"]}]}}
+      ]
+    }
+
+Relative paths are resolved against the manifest's directory. "rules" holds either
+one "target" for all four questions or a "blocks" list of BlockSpec fields. A paper
+with "variants": N (and optionally "max_overlap") is written as N equivalent sets,
+out/cloud_set_A.docx, out/cloud_set_B.docx, ... "duplicates" ("flag", "collapse" or
+"off") and "similarity" control near-duplicate detection as in qgen.py. A "bank" may
+also be a directory or glob of banks, which are merged. "plain_text": true writes the
+questions as plain text instead of copying their formatting from the bank, and
+"companions": true also writes out/cloud_scheme.docx (marking scheme) and
+out/cloud_summary.docx (CO/RBT summary) next to each paper.
+Papers are generated on a process pool; each worker loads a bank or template once
+and reuses it for every paper it is given.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from companions import PaperSummary, companion_filenames, render_marking_scheme, render_summary
+from duplicates import DEFAULT_THRESHOLD
+from qgen import PAPER_LAYOUT, expand_bank_paths, fill_paper_table, load_question_banks, variant_filename
+from questions import QuestionBank
+from render import CompiledTemplate
+from selection import BlockSpec, select_paper, select_variants
+from transplant import FormattedQuestions
+
+QUESTION_COUNT = 4
+
+def load_manifest(manifest_path):
+    """Read a JSON or YAML manifest and return its list of resolved paper jobs"""
+    with open(manifest_path, encoding="utf-8") as f:
+        if manifest_path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Reading YAML manifests requires PyYAML (pip install pyyaml)")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for number, paper in enumerate(manifest.get("papers", []), start=1):
+        job = dict(defaults)
+        job.update(paper)
+        for key in ("bank", "template", "output"):
+            if not job.get(key):
+                raise ValueError(f"Paper {number} has no '{key}'")
+            job[key] = os.path.join(base_dir, job[key])
+        if not job["output"].endswith(".docx"):
+            job["output"] += ".docx"
+        job.setdefault("name", os.path.basename(job["output"]))
+        job.setdefault("rules", {})
+        jobs.append(job)
+    return jobs
+
+def block_specs(rules):
+    """Build the BlockSpecs for Q1-Q4 from a paper's selection rules"""
+    if "blocks" in rules:
+        if len(rules["blocks"]) != QUESTION_COUNT:
+            raise ValueError(f"Selection rules must list {QUESTION_COUNT} blocks")
+        return [BlockSpec.from_dict(block) for block in rules["blocks"]]
+    return [BlockSpec(rules.get("target", 25)) for _ in range(QUESTION_COUNT)]
+
+# Per-worker caches, so a worker parses each bank and template only once
+_worker_banks = {}
+_worker_templates = {}
+_worker_paragraphs = {}
+_worker_options = {"use_cache": True}
+
+def _init_worker(use_cache):
+    _worker_options["use_cache"] = use_cache
+
+def _worker_bank(path, duplicates="flag", similarity=DEFAULT_THRESHOLD):
+    key = (path, duplicates, similarity)
+    bank = _worker_banks.get(key)
+    if bank is None:
+        # The batch already runs one process per core, so a worker loads its banks serially
+        bank = QuestionBank(load_question_banks(expand_bank_paths(path), workers=1,
+                                                use_cache=_worker_options["use_cache"]))
+        if duplicates != "off":
+            bank.mark_duplicates(similarity, _worker_options["use_cache"])
+            if duplicates == "collapse":
+                bank = bank.without_duplicates()
+        _worker_banks[key] = bank
+    else:
+        bank.reset()
+    return bank
+
+def _worker_template(path):
+    compiled = _worker_templates.get(path)
+    if compiled is None:
+        compiled = CompiledTemplate(path)
+        _worker_templates[path] = compiled
+    return compiled
+
+def generate_paper(job):
+    """Generate one paper; returns a result dict instead of raising"""
+    start = time.perf_counter()
+    result = {"name": job["name"], "output": job["output"], "ok": False}
+    try:
+        bank = _worker_bank(job["bank"], job.get("duplicates", "flag"),
+                            job.get("similarity", DEFAULT_THRESHOLD))
+        specs = block_specs(job["rules"])
+        variants = job.get("variants", 1)
+        if variants > 1:
+            papers = select_variants(bank, specs, variants, seed=job.get("seed"),
+                                     max_overlap=job.get("max_overlap", 0))
+            outputs = [variant_filename(job["output"], i) for i in range(variants)]
+        else:
+            papers = [select_paper(bank, specs, seed=job.get("seed"))]
+            outputs = [job["output"]]
+        template = _worker_template(job["template"])
+        formatted = None
+        if not job.get("plain_text"):
+            formatted = FormattedQuestions((q for blocks in papers for block in blocks for q in block),
+                                           _worker_paragraphs)
+        output_dir = os.path.dirname(job["output"])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        paragraphs = formatted and formatted.paragraphs
+        for blocks, output in zip(papers, outputs):
+            template_doc, table = template.new_paper()
+            fill_paper_table(table, blocks, template.renderer(table, paragraphs))
+            additions = formatted and formatted.package(q for block in blocks for q in block)
+            documents = [(template_doc, output, additions)]
+            if job.get("companions"):
+                summary = PaperSummary(blocks, PAPER_LAYOUT)
+                scheme_output, summary_output = companion_filenames(output)
+                documents += [(render_marking_scheme(template, summary, paragraphs), scheme_output, additions),
+                              (render_summary(template, summary), summary_output, None)]
+            template.save_many(documents)
+        result["ok"] = True
+        result["totals"] = [sum(q.marks for q in block) for block in papers[0]]
+        if variants > 1:
+            result["output"] = f"{len(outputs)} sets, {outputs[0]} ..."
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def run_batch(jobs, workers=None, use_cache=True):
+    """Generate every job on a process pool and return the results in manifest order"""
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    # Neighbouring jobs share a template and bank, so chunks land on one warm worker
+    order = sorted(range(len(jobs)), key=lambda i: (jobs[i]["template"], jobs[i]["bank"]))
+    chunksize = max(1, len(jobs) // (workers * 4))
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(use_cache,)) as executor:
+        for i, result in zip(order, executor.map(generate_paper, [jobs[i] for i in order],
+                                                 chunksize=chunksize)):
+            results[i] = result
+    return results
+
+def print_summary(results):
+    print(f"\n{'PAPER':30} {'STATUS':8} {'TIME':>8}  DETAILS")
+    for result in results:
+        if result["ok"]:
+            status = "OK"
+            details = f"marks {'/'.join(map(str, result['totals']))} -> {result['output']}"
+        else:
+            status = "FAILED"
+            details = result["error"]
+        print(f"{result['name'][:30]:30} {status:8} {result['seconds']:7.2f}s  {details}")
+    failed = sum(1 for result in results if not result["ok"])
+    print(f"\n{len(results) - failed} of {len(results)} papers generated, {failed} failed.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate question papers from a JSON/YAML manifest.")
+    parser.add_argument("manifest", help="manifest file listing the papers to generate")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse question banks without using the bank cache")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except Exception as e:
+        print(f"Error reading manifest: {e}")
+        return 2
+    if not jobs:
+        print("The manifest does not list any papers.")
+        return 2
+
+    start = time.perf_counter()
+    results = run_batch(jobs, args.workers, use_cache=not args.no_cache)
+    print_summary(results)
+    print(f"Total time: {time.perf_counter() - start:.2f}s")
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
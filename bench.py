@@ -0,0 +1,213 @@
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from io import BytesIO
+
+from docx import Document
+
+from docx_writer import save_document
+from duplicates import DEFAULT_THRESHOLD, find_duplicate_clusters, jaccard, shingles
+from qgen import add_question_rows, add_section_header, extract_question_info, open_template, parse_questions
+from questions import QuestionBank
+from render import CompiledTemplate, TableRenderer
+from selection import BlockSpec, select_paper
+
+# The original three-search implementation, kept here as the reference for comparisons
+def legacy_extract_question_info(question_text):
+    marks_match = re.search(r'\(Marks\s*:\s*(\d+)\)', question_text)
+    marks = int(marks_match.group(1)) if marks_match else 0
+
+    co_match = re.search(r'\(CO\s*:\s*([^)]+)\)', question_text)
+    co = co_match.group(1) if co_match else ""
+
+    rbt_match = re.search(r'\(RBT\s*:\s*([^)]+)\)', question_text)
+    rbt = rbt_match.group(1) if rbt_match else ""
+
+    clean_question = question_text
+    if marks_match:
+        clean_question = clean_question.replace(marks_match.group(0), "")
+    if co_match:
+        clean_question = clean_question.replace(co_match.group(0), "")
+    if rbt_match:
+        clean_question = clean_question.replace(rbt_match.group(0), "")
+
+    return {
+        "question": clean_question.strip(),
+        "marks": marks,
+        "co": co,
+        "rbt": rbt
+    }
+
+WORDS = ("explain", "describe", "compare", "cloud", "virtualization", "model", "service",
+         "security", "storage", "network", "deployment", "elasticity", "latency", "data")
+
+def synthetic_question_texts(count, seed=0):
+    """Generate question texts with Marks/CO/RBT tags in random order"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 25))).capitalize() + "?"
+        tags = [f"(Marks: {rng.randint(2, 10)})", f"(CO: CO-{rng.randint(1, 5)})", f"(RBT: L{rng.randint(1, 6)})"]
+        rng.shuffle(tags)
+        # Leave some questions without one of the tags, like real banks do
+        if rng.random() < 0.1:
+            tags.pop()
+        texts.append(f"{body} {' '.join(tags)}")
+    return texts
+
+def time_call(func, repeat=5):
+    """Return the best wall time of `repeat` calls to func"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_parse(count=50000):
+    texts = synthetic_question_texts(count)
+
+    # Both parsers must agree before their speed means anything
+    expected = [legacy_extract_question_info(t) for t in texts]
+    if parse_questions(texts) != expected:
+        raise AssertionError("parse_questions output differs from the legacy parser")
+
+    legacy = time_call(lambda: [legacy_extract_question_info(t) for t in texts])
+    single = time_call(lambda: [extract_question_info(t) for t in texts])
+    batch = time_call(lambda: parse_questions(texts))
+
+    print(f"Parsing {count} questions:")
+    for name, seconds in (("legacy extract_question_info", legacy),
+                          ("extract_question_info", single),
+                          ("parse_questions", batch)):
+        print(f"  {name:30} {seconds * 1000:9.1f} ms  {count / seconds:12,.0f} q/s  x{legacy / seconds:.2f}")
+
+def bench_select(sizes=(100, 1000, 5000, 20000)):
+    specs = [BlockSpec(25, required_cos=["CO-1", "CO-2"], max_parts=5) for _ in range(2)] + \
+            [BlockSpec(25, required_cos=["CO-3"], allowed_rbts=["L3", "L4", "L5"], max_parts=5) for _ in range(2)]
+    print("Selecting Q1-Q4 (25 marks each, CO/RBT constraints):")
+    for count in sizes:
+        questions = parse_questions(synthetic_question_texts(count))
+        banks = []
+        def run():
+            bank = QuestionBank(q for q in questions if q["marks"] > 0)
+            banks.append((bank, select_paper(bank, specs)))
+        seconds = time_call(run)
+        totals = [sum(q.marks for q in block) for block in banks[-1][1]]
+        print(f"  {count:8} questions {seconds * 1000:9.1f} ms  totals {totals}")
+
+def bench_render(template_path="template.docx", sizes=(10, 100, 1000)):
+    print("Rendering question rows (add_row + cell.text vs cloned row XML):")
+    for count in sizes:
+        questions = list(QuestionBank(parse_questions(synthetic_question_texts(count))))
+
+        def python_docx_rows():
+            _, table = open_template(template_path)
+            add_section_header(table, "PART A")
+            add_question_rows(table, 1, questions)
+
+        def cloned_rows():
+            _, table = open_template(template_path)
+            renderer = TableRenderer(table)
+            renderer.add_section_header("PART A")
+            renderer.add_question_rows(1, questions)
+
+        repeat = 3 if count >= 1000 else 5
+        slow = time_call(python_docx_rows, repeat)
+        fast = time_call(cloned_rows, repeat)
+        print(f"  {count:6} rows  add_row {slow * 1000:9.1f} ms  cloned {fast * 1000:8.1f} ms  x{slow / fast:.1f}")
+
+def bench_template(template_path="template.docx", papers=200):
+    compiled = CompiledTemplate(template_path)
+    reopen = time_call(lambda: [open_template(template_path) for _ in range(papers)], 3)
+    copies = time_call(lambda: [compiled.new_paper() for _ in range(papers)], 3)
+    print(f"Preparing {papers} cleared templates:")
+    print(f"  open_template {reopen * 1000:9.1f} ms  CompiledTemplate.new_paper {copies * 1000:8.1f} ms  x{reopen / copies:.1f}")
+
+def noise_png(width, height, seed=0):
+    """An incompressible RGB PNG, standing in for a scanned logo or letterhead"""
+    rng = random.Random(seed)
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+
+def media_template(template_path, directory, images=4, size=600):
+    """Copy of the template with header images embedded, saved in directory"""
+    document = Document(template_path)
+    for i in range(images):
+        document.paragraphs[0].add_run().add_picture(BytesIO(noise_png(size, size, i)))
+    path = os.path.join(directory, f"template_{images}_images.docx")
+    document.save(path)
+    return path
+
+def time_cpu(func, repeat=5):
+    """Return the best (wall, cpu) time of `repeat` calls to func"""
+    best = (float("inf"), float("inf"))
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        func()
+        best = min(best, (time.perf_counter() - wall, time.process_time() - cpu))
+    return best
+
+def bench_save(template_path="template.docx", image_counts=(0, 4)):
+    print("Saving a paper (Document.save vs verbatim member copy):")
+    questions = list(QuestionBank(parse_questions(synthetic_question_texts(40))))
+    with tempfile.TemporaryDirectory() as directory:
+        for images in image_counts:
+            path = media_template(template_path, directory, images) if images else template_path
+            compiled = CompiledTemplate(path)
+            document, table = compiled.new_paper()
+            compiled.renderer(table).add_question_rows(1, questions)
+            output = os.path.join(directory, "paper.docx")
+            slow = time_cpu(lambda: document.save(output))
+            fast = time_cpu(lambda: compiled.save(document, output))
+            uncached = time_cpu(lambda: save_document(document, path, output))
+            size = os.path.getsize(path) / 1024
+            print(f"  template {size:8.0f} KiB  save() {slow[0] * 1000:7.1f} ms wall {slow[1] * 1000:7.1f} ms cpu"
+                  f"  | copy {fast[0] * 1000:6.1f} ms wall {fast[1] * 1000:6.1f} ms cpu"
+                  f"  | copy from path {uncached[0] * 1000:6.1f} ms wall")
+
+def reworded(text, rng):
+    """A copy of a question as another teacher might phrase it: one word changed, new punctuation"""
+    words = text.split()
+    words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words).capitalize() + rng.choice(("?", ".", " with examples."))
+
+def bench_duplicates(sizes=(1000, 10000, 100000)):
+    print("Near-duplicate clustering (MinHash/LSH):")
+    rng = random.Random(1)
+    vocabulary = ["".join(rng.choice("etaoinshrdlucmfwypvbgk") for _ in range(rng.randint(3, 10)))
+                  for _ in range(2000)]
+    for count in sizes:
+        texts = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 18))) for _ in range(count)]
+        # Every 40th question is a reworded copy of a random other one
+        planted = {}
+        for i in range(0, count, 40):
+            original = rng.randrange(count)
+            if original % 40:
+                texts[i] = reworded(texts[original], rng)
+                planted[i] = original
+        start = time.perf_counter()
+        clusters = find_duplicate_clusters(texts)
+        seconds = time.perf_counter() - start
+        # Copies that the rewording pushed below the threshold are not duplicates
+        similar = [(i, j) for i, j in planted.items()
+                   if jaccard(shingles(texts[i]), shingles(texts[j])) >= DEFAULT_THRESHOLD]
+        found = sum(clusters[i] == clusters[j] for i, j in similar)
+        print(f"  {count:8} questions {seconds * 1000:9.1f} ms  found {found}/{len(similar)} reworded copies"
+              f" above the threshold")
+
+if __name__ == "__main__":
+    bench_parse(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
+    bench_select()
+    bench_render()
+    bench_template()
+    bench_save()
+    bench_duplicates()
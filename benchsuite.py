@@ -0,0 +1,282 @@
+"""
+Stage-by-stage benchmark suite with a machine-readable result file.
+
+    python benchsuite.py --output results.json                  # run and record
+    python benchsuite.py --compare baseline.json                # run and compare
+    python benchsuite.py --results results.json --compare baseline.json --threshold 0.2
+
+Synthetic question banks from 100 to 1,000,000 paragraphs (questions with
+Marks/CO/RBT tags in random order, split across runs, between unit headings and
+blank lines) are written straight as .docx files and kept in --data-dir, so later
+runs reuse them. Every bank is timed through the stages of qgen.py:
+
+    load    streaming the paragraphs out of the .docx
+    parse   extract_question_info over the paragraph texts
+    select  building the QuestionBank and picking Q1-Q4
+
+and every template (the plain one, one with header images, and a long one with
+instructions and a second table) through:
+
+    template  CompiledTemplate (reading and clearing the template)
+    render    filling the paper table with a selected paper
+    save      writing the .docx
+
+Each stage reports the best wall time of a few repeats. Compare mode matches
+stages by case and name and exits with status 1 when any is slower than the
+baseline by more than --threshold (stages faster than --min-time are ignored as
+noise).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from docx import Document
+
+from bench import WORDS, media_template
+from qgen import fill_paper_table, iter_bank_paragraphs, parse_questions
+from questions import QuestionBank
+from render import CompiledTemplate
+from selection import BlockSpec, select_paper
+
+RESULTS_VERSION = 1
+DEFAULT_SIZES = (100, 1000, 10000, 100000, 1000000)
+DEFAULT_THRESHOLD = 0.20
+DEFAULT_MIN_TIME = 0.002
+# Questions in the bank the template cases render from
+RENDER_BANK_SIZE = 1000
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>')
+_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>')
+_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+_DOCUMENT_END = '<w:sectPr/></w:body></w:document>'
+
+
+def _run(text, bold=False):
+    props = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f'<w:r>{props}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+def synthetic_bank_paragraphs(count, seed=0):
+    """Yield the <w:p> XML of a question bank with `count` paragraphs"""
+    rng = random.Random(seed)
+    for i in range(count):
+        if i % 50 == 0:
+            yield f"<w:p>{_run(f'UNIT {i // 50 + 1}', bold=True)}</w:p>"
+        elif rng.random() < 0.05:
+            yield "<w:p/>"
+        else:
+            body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 25))).capitalize() + "?"
+            tags = [f"(Marks: {rng.randint(2, 10)})", f"(CO: CO-{rng.randint(1, 5)})",
+                    f"(RBT: L{rng.randint(1, 6)})"]
+            rng.shuffle(tags)
+            # Word often splits a paragraph into several runs; put the tags in their own
+            yield f"<w:p>{_run(body + ' ')}{''.join(_run(tag + ' ') for tag in tags)}</w:p>"
+
+def write_synthetic_bank(path, count, seed=0):
+    """Write a question bank .docx with `count` paragraphs, streaming document.xml"""
+    with zipfile.ZipFile(path + ".tmp", "w", zipfile.ZIP_DEFLATED) as docx_zip:
+        docx_zip.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        docx_zip.writestr("_rels/.rels", _PACKAGE_RELS)
+        with docx_zip.open("word/document.xml", "w", force_zip64=True) as part:
+            part.write(_DOCUMENT_START.encode("utf-8"))
+            chunk = []
+            for paragraph in synthetic_bank_paragraphs(count, seed):
+                chunk.append(paragraph)
+                if len(chunk) == 10000:
+                    part.write("".join(chunk).encode("utf-8"))
+                    chunk = []
+            part.write(("".join(chunk) + _DOCUMENT_END).encode("utf-8"))
+    os.replace(path + ".tmp", path)
+
+def synthetic_bank(data_dir, count):
+    """Path of the synthetic bank with `count` paragraphs, generated on first use"""
+    path = os.path.join(data_dir, f"bank_{count}.docx")
+    if not os.path.exists(path):
+        print(f"  generating {count:,}-paragraph bank ...")
+        write_synthetic_bank(path, count)
+    return path
+
+def long_template(template_path, directory, paragraphs=300):
+    """Copy of the template with a page of instructions and a second (marks summary) table"""
+    path = os.path.join(directory, "template_long.docx")
+    if not os.path.exists(path):
+        document = Document(template_path)
+        rng = random.Random(0)
+        for i in range(paragraphs):
+            document.add_paragraph(f"{i + 1}. " + " ".join(rng.choice(WORDS) for _ in range(15)))
+        summary = document.add_table(rows=1, cols=4)
+        for cell, text in zip(summary.rows[0].cells, ("Question", "Marks", "CO", "RBT")):
+            cell.text = text
+        for q in range(1, 9):
+            for cell, text in zip(summary.add_row().cells, (str(q), "", "", "")):
+                cell.text = text
+        document.save(path)
+    return path
+
+def synthetic_templates(template_path, data_dir):
+    """{case name: path} for templates of increasing complexity"""
+    images_path = os.path.join(data_dir, "template_4_images.docx")
+    if not os.path.exists(images_path):
+        images_path = media_template(template_path, data_dir, images=4)
+    return {"plain": template_path, "images": images_path,
+            "long": long_template(template_path, data_dir)}
+
+def repeats_for(count):
+    """Fewer repeats for the big banks, which take seconds per run"""
+    return max(1, min(5, 100000 // count))
+
+PAPER_SPECS = [BlockSpec(25) for _ in range(4)]
+
+def best_time(func, repeat=5):
+    """Return (best wall time, result of the last call) over `repeat` calls to func"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_bank(path, count):
+    """Time one bank through load, parse and select; returns (record, selected paper)"""
+    repeat = repeats_for(count)
+    load, texts = best_time(lambda: list(iter_bank_paragraphs(path)), repeat)
+    parse, questions = best_time(lambda: [q for q in parse_questions(texts) if q["marks"] > 0], repeat)
+    select, blocks = best_time(lambda: select_paper(QuestionBank(questions), PAPER_SPECS, seed=1), repeat)
+    return {"case": f"bank-{count}", "paragraphs": count, "questions": len(questions),
+            "bytes": os.path.getsize(path),
+            "stages": {"load": load, "parse": parse, "select": select}}, blocks
+
+def bench_template(name, path, blocks, data_dir):
+    """Time one template through compiling, rendering a paper and saving it"""
+    output = os.path.join(data_dir, f"paper_{name}.docx")
+    template, compiled = best_time(lambda: CompiledTemplate(path))
+    def render_paper():
+        document, table = compiled.new_paper()
+        fill_paper_table(table, blocks, compiled.renderer(table))
+        return document
+    render, document = best_time(render_paper)
+    # A paper must be saved before the next new_paper() call, so save the last one
+    save, _ = best_time(lambda: compiled.save(document, output))
+    return {"case": f"template-{name}", "bytes": os.path.getsize(path),
+            "stages": {"template": template, "render": render, "save": save}}
+
+def run_suite(sizes, template_path, data_dir):
+    results = []
+    render_blocks = None
+    print("Question banks:")
+    for count in sizes:
+        record, blocks = bench_bank(synthetic_bank(data_dir, count), count)
+        results.append(record)
+        print_record(record)
+        if render_blocks is None or count <= RENDER_BANK_SIZE:
+            render_blocks = blocks
+    if render_blocks is None:
+        _, render_blocks = bench_bank(synthetic_bank(data_dir, RENDER_BANK_SIZE), RENDER_BANK_SIZE)
+    print("Templates:")
+    for name, path in synthetic_templates(template_path, data_dir).items():
+        record = bench_template(name, path, render_blocks, data_dir)
+        results.append(record)
+        print_record(record)
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+def print_record(record):
+    stages = "  ".join(f"{name} {seconds * 1000:10.1f} ms" for name, seconds in record["stages"].items())
+    print(f"  {record['case']:18} {stages}")
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_time=DEFAULT_MIN_TIME):
+    """
+    Compare stage timings with a baseline; returns the regressions as
+    (case, stage, baseline seconds, seconds) tuples and prints a table.
+    """
+    base = {(r["case"], stage): seconds
+            for r in baseline["results"] for stage, seconds in r["stages"].items()}
+    regressions = []
+    print(f"\nCompared with the baseline from {baseline.get('created', '?')} (threshold +{threshold:.0%}):")
+    for record in results["results"]:
+        for stage, seconds in record["stages"].items():
+            before = base.get((record["case"], stage))
+            if before is None:
+                continue
+            change = seconds / before - 1 if before else 0.0
+            flag = ""
+            if change > threshold and max(seconds, before) >= min_time:
+                flag = "  REGRESSION"
+                regressions.append((record["case"], stage, before, seconds))
+            print(f"  {record['case']:18} {stage:9} {before * 1000:10.1f} ms -> {seconds * 1000:10.1f} ms"
+                  f"  {change:+7.1%}{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) regressed by more than {threshold:.0%}.")
+    else:
+        print("\nNo regressions.")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the question paper generator stage by stage.")
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")], default=list(DEFAULT_SIZES),
+                        help="comma-separated bank sizes in paragraphs (default: 100 to 1,000,000)")
+    parser.add_argument("--template", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.docx"),
+                        help="base template (default: the template.docx next to this script)")
+    parser.add_argument("--data-dir", help="where synthetic banks and templates are kept "
+                                           "(default: a benchsuite directory in the system temp dir)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--results", help="compare an existing results file instead of running the suite")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline results file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"slowdown that counts as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                        help=f"ignore stages faster than this many seconds (default: {DEFAULT_MIN_TIME})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.results:
+        with open(args.results, encoding="utf-8") as f:
+            results = json.load(f)
+    else:
+        data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "benchsuite")
+        os.makedirs(data_dir, exist_ok=True)
+        results = run_suite(args.sizes, args.template, data_dir)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("version") != RESULTS_VERSION:
+            print(f"Baseline {args.compare} has an unsupported format version.")
+            return 2
+        return 1 if compare(results, baseline, args.threshold, args.min_time) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Paged, searchable question browser for the interactive selection prompts.
+
+Instead of printing every remaining question before each prompt, the browser shows
+one page of the questions that match the current filters and reads either question
+numbers (the selection) or one of the commands in HELP.
+
+Keyword filters use an inverted index (word -> question ids) over the normalized
+question text, built on the first search and extended when the bank grows. Marks,
+CO and RBT filters use the bank's own indexes; the smallest candidate list is
+checked against the others, so a filter costs about as much as its matches.
+Only the visible page is formatted and printed.
+"""
+import re
+from bisect import bisect_left
+from itertools import islice
+
+from duplicates import normalize
+
+DEFAULT_PAGE_SIZE = 20
+HELP = """\
+  Enter / n / p        next / previous page        page N     go to page N
+  / cloud storage      show questions containing every word; a word also matches
+                       longer words it starts, so "virt" finds "virtualization"
+  marks 5, marks 2-5   filter by marks             co CO-1    filter by CO
+  rbt L2               filter by RBT               clear      drop all filters
+  all                  list every matching question
+  1,4,7                select those questions      q          stop"""
+_MARKS_RANGE = re.compile(r"^(\d+)(?:\s*-\s*(\d+))?$")
+
+
+def _label_key(label):
+    """'CO-1', 'co1' and 'CO 1' all match"""
+    return re.sub(r"[\W_]+", "", label).lower()
+
+
+class QuestionIndex:
+    """Inverted index from normalized words to the ids of the questions containing them"""
+
+    def __init__(self, bank):
+        self.bank = bank
+        self.postings = {}
+        self._indexed = 0
+        self._words = []
+
+    def update(self):
+        """Index questions added to the bank since the last update"""
+        questions = self.bank.questions
+        if self._indexed == len(questions):
+            return
+        postings = self.postings
+        for q in questions[self._indexed:]:
+            for word in set(normalize(q.question).split()):
+                ids = postings.get(word)
+                if ids is None:
+                    postings[word] = [q.id]
+                else:
+                    ids.append(q.id)
+        self._indexed = len(questions)
+        self._words = sorted(postings)
+
+    def matching(self, word):
+        """Ids of the questions with a word starting with `word`, as a list or set"""
+        self.update()
+        start = bisect_left(self._words, word)
+        end = bisect_left(self._words, word + "\uffff", start)
+        if end - start <= 1:
+            return self.postings[self._words[start]] if end > start else []
+        matches = set()
+        for w in self._words[start:end]:
+            matches.update(self.postings[w])
+        return matches
+
+    def search(self, text):
+        """Ids of the questions matching every word of text, or None if text has no words"""
+        words = normalize(text).split()
+        if not words:
+            return None
+        return _intersect([self.matching(word) for word in words])
+
+
+def _intersect(candidates):
+    """Ids present in every candidate collection, sorted"""
+    candidates = sorted(candidates, key=len)
+    if not candidates[0]:
+        return []
+    others = [c if isinstance(c, set) else set(c) for c in candidates[1:]]
+    return sorted(qid for qid in candidates[0] if all(qid in other for other in others))
+
+
+class QuestionBrowser:
+    """Pages through the available questions of a bank under keyword, marks, CO and RBT filters"""
+
+    def __init__(self, bank, page_size=DEFAULT_PAGE_SIZE, refresh=None, show=None):
+        self.bank = bank
+        self.page_size = page_size
+        # Called before every page, e.g. to pick up bank edits (see watch.py)
+        self.refresh = refresh
+        # Prints a list of questions; qgen passes print_questions
+        self.show = show
+        self.index = QuestionIndex(bank)
+        self.keywords = ""
+        self.marks = None
+        self.co = None
+        self.rbt = None
+        self.page = 0
+
+    def filters_text(self):
+        filters = []
+        if self.keywords:
+            filters.append(f"words '{self.keywords}'")
+        if self.marks is not None:
+            low, high = self.marks
+            filters.append(f"marks {low}" if low == high else f"marks {low}-{high}")
+        if self.co is not None:
+            filters.append(f"CO {self.co}")
+        if self.rbt is not None:
+            filters.append(f"RBT {self.rbt}")
+        return ", ".join(filters)
+
+    def _label_ids(self, index, label):
+        key = _label_key(label)
+        ids = []
+        for value, value_ids in index.items():
+            if _label_key(str(value)) == key:
+                ids.extend(value_ids)
+        return ids
+
+    def matching_ids(self):
+        """Sorted ids of the available questions matching the filters, or None if there are no filters"""
+        candidates = []
+        if self.keywords:
+            ids = self.index.search(self.keywords)
+            if ids is not None:
+                candidates.append(ids)
+        if self.marks is not None:
+            low, high = self.marks
+            ids = []
+            for marks, marks_ids in self.bank.by_marks.items():
+                if low <= marks <= high:
+                    ids.extend(marks_ids)
+            candidates.append(ids)
+        if self.co is not None:
+            candidates.append(self._label_ids(self.bank.by_co, self.co))
+        if self.rbt is not None:
+            candidates.append(self._label_ids(self.bank.by_rbt, self.rbt))
+        if not candidates:
+            return None
+        is_available = self.bank.is_available
+        return [qid for qid in _intersect(candidates) if is_available(qid)]
+
+    def page_questions(self):
+        """(questions on the current page, number of matches); clamps the page number"""
+        ids = self.matching_ids()
+        total = self.bank.available_count() if ids is None else len(ids)
+        pages = max(1, -(-total // self.page_size))
+        self.page = min(max(self.page, 0), pages - 1)
+        start = self.page * self.page_size
+        if ids is None:
+            # No filters: walk the availability bitset only as far as this page
+            questions = list(islice(self.bank.available(), start, start + self.page_size))
+        else:
+            questions = [self.bank[qid] for qid in ids[start:start + self.page_size]]
+        return questions, total
+
+    def print_page(self):
+        if self.refresh is not None:
+            self.refresh()
+        questions, total = self.page_questions()
+        pages = max(1, -(-total // self.page_size))
+        filters = self.filters_text()
+        print()
+        if total:
+            first = self.page * self.page_size + 1
+            print(f"Questions {first}-{first + len(questions) - 1} of {total} (page {self.page + 1}/{pages})"
+                  + (f", filtered by {filters}" if filters else ""))
+            self.show(questions)
+        else:
+            print("No available questions match " + (filters or "the bank") + ".")
+        print("(Enter/n/p: page, / WORDS: search, marks N[-M], co X, rbt X, clear, all, h: help, q: stop)")
+
+    def print_help(self):
+        print(HELP)
+
+    def command(self, line):
+        """Apply a browser command; returns False if line is not a command"""
+        word, _, rest = line.strip().partition(" ")
+        word = word.lower()
+        rest = rest.strip()
+        if line.strip().startswith("/"):
+            self.keywords = line.strip()[1:].strip()
+        elif word in ("", "n", "next"):
+            self.page += 1
+            return True
+        elif word in ("p", "prev", "previous"):
+            self.page -= 1
+            return True
+        elif word in ("page", "g") and rest.isdigit():
+            self.page = int(rest) - 1
+            return True
+        elif word in ("find", "search"):
+            self.keywords = rest
+        elif word == "marks":
+            match = _MARKS_RANGE.match(rest)
+            if rest and not match:
+                print("Use marks N or marks N-M.")
+                return True
+            self.marks = (int(match.group(1)), int(match.group(2) or match.group(1))) if match else None
+        elif word == "co":
+            self.co = rest or None
+        elif word == "rbt":
+            self.rbt = rest or None
+        elif word == "clear":
+            self.keywords, self.marks, self.co, self.rbt = "", None, None, None
+        elif word == "all":
+            ids = self.matching_ids()
+            self.show(self.bank.available() if ids is None else (self.bank[qid] for qid in ids))
+            return True
+        elif word in ("h", "help", "?"):
+            self.print_help()
+            return True
+        else:
+            return False
+        # A new filter starts from its first page
+        self.page = 0
+        return True
+
+    def prompt(self, message):
+        """
+        Show pages until the user enters question numbers; returns that input, or None
+        if the user typed q. Filters stay in place for the next prompt.
+        """
+        self.page = 0
+        show_page = True
+        while True:
+            if show_page:
+                self.print_page()
+            line = input(message)
+            stripped = line.strip().lower()
+            if stripped in ("q", "quit"):
+                return None
+            if stripped and re.fullmatch(r"[\d\s,]+", stripped):
+                return line
+            if not self.command(line):
+                print(f"Unknown command: {line.strip()} (h for help)")
+                show_page = False
+                continue
+            show_page = not stripped.startswith(("all", "h", "?"))
@@ -0,0 +1,219 @@
+"""
+Companion documents written alongside a paper: a marking scheme and a CO/RBT summary.
+
+Both are built from the paper's blocks of questions in memory and from the paper's
+own CompiledTemplate, so the template is read once for the whole set and nothing is
+read back from the saved paper. The template's heading is kept, but the paper table
+is replaced by bordered tables with their own columns (the template's table may have
+any number of columns, which the summary's would not fit), whose rows are cloned by
+a TableRenderer like the paper's own. CompiledTemplate.save_many() then writes a paper
+and its companions together.
+
+The bank holds no model answers, so the marking scheme gives each subpart's marks,
+CO and RBT with the totals per question and per part for the examiner to mark against.
+"""
+import re
+from copy import deepcopy
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+
+from history import paper_rows
+from render import TableRenderer
+
+W_P = qn("w:p")
+W_R = qn("w:r")
+W_RPR = qn("w:rPr")
+W_TBLW = qn("w:tblW")
+
+SCHEME_TITLE = "MARKING SCHEME"
+SUMMARY_TITLE = "CO / RBT SUMMARY"
+# (header, relative width) of each column of the companion tables
+SCHEME_COLUMNS = (("Q.No", 1), ("QUESTION", 8), ("MARKS", 1.3), ("CO", 1.3), ("RBT", 1.3))
+SUMMARY_COLUMNS = (("Q.No", 1), ("PARTS", 1.5), ("MARKS", 1.3), ("CO", 3), ("RBT", 3))
+_BORDERS = ("top", "left", "bottom", "right", "insideH", "insideV")
+# File name endings of the marking scheme and the summary
+COMPANION_SUFFIXES = ("_scheme.docx", "_summary.docx")
+
+
+def companion_filenames(output_filename):
+    """'paper.docx' -> ('paper_scheme.docx', 'paper_summary.docx')"""
+    stem = output_filename[:-len(".docx")]
+    return tuple(stem + suffix for suffix in COMPANION_SUFFIXES)
+
+
+def is_companion(path):
+    """Whether path names a marking scheme or summary rather than a paper"""
+    return path.endswith(COMPANION_SUFFIXES)
+
+
+def _natural_key(text):
+    """Sort key putting CO-2 before CO-10"""
+    return [int(piece) if piece.isdigit() else piece for piece in re.split(r"(\d+)", text)]
+
+
+def _percent(value):
+    return f"{round(value, 1):g}%"
+
+
+def _join(values):
+    return ", ".join(sorted({value or "-" for value in values}, key=_natural_key))
+
+
+class PaperSummary:
+    """
+    Marks of one paper per question, per part, per CO and per RBT level.
+    blocks are the paper's questions for Q1, Q2, ... and layout its (section header,
+    question count) pairs, as in qgen.PAPER_LAYOUT.
+    """
+
+    def __init__(self, blocks, layout):
+        self.blocks = [list(block) for block in blocks]
+        self.rows = paper_rows(self.blocks)
+        self.question_marks = [sum(q.marks for q in block) for block in self.blocks]
+        # (header, question numbers, marks set, marks to answer) per part;
+        # students answer one question of each part
+        self.parts = []
+        number = 1
+        for header, count in layout:
+            numbers = list(range(number, number + count))
+            marks = [self.question_marks[n - 1] for n in numbers]
+            self.parts.append((header, numbers, sum(marks), max(marks, default=0)))
+            number += count
+        self.total = sum(self.question_marks)
+        self.maximum = sum(part[3] for part in self.parts)
+
+    def _coverage(self, key, other):
+        groups = {}
+        for label, _, marks, co, rbt in self.rows:
+            values = {"co": co, "rbt": rbt}
+            group = groups.setdefault(values[key] or "-", [0, [], []])
+            group[0] += marks
+            group[1].append(label)
+            group[2].append(values[other])
+        return [(name, marks, 100 * marks / self.total if self.total else 0, labels, others)
+                for name, (marks, labels, others) in sorted(groups.items(), key=lambda item: _natural_key(item[0]))]
+
+    def co_coverage(self):
+        """(CO, marks, % of the marks set, question labels, RBT levels) per CO"""
+        return self._coverage("co", "rbt")
+
+    def rbt_coverage(self):
+        """(RBT level, marks, % of the marks set, question labels, COs) per RBT level"""
+        return self._coverage("rbt", "co")
+
+
+def _coverage_columns(name, other):
+    return ((name, 1.5), ("QUESTIONS", 4), ("MARKS", 1.3), ("% OF MARKS", 1.7), (other, 2.5))
+
+
+def _add_caption(document, tbl, text, source=None):
+    """
+    Insert a bold paragraph holding text before tbl, formatted like source (by default
+    the paragraph above tbl); returns the paragraph element
+    """
+    source = tbl.getprevious() if source is None else source
+    p = deepcopy(source) if source is not None and source.tag == W_P else OxmlElement("w:p")
+    first_run = p.find(W_R)
+    rpr = first_run.find(W_RPR) if first_run is not None else None
+    paragraph = Paragraph(p, document._body)
+    paragraph.text = text
+    run = paragraph.runs[0]
+    if rpr is not None:
+        run._r.insert(0, rpr)
+    run.bold = True
+    tbl.addprevious(p)
+    return p
+
+
+def _add_table(document, anchor, columns, paragraphs=None):
+    """
+    A bordered table placed right after anchor (a body element), with a bold header
+    row for columns, (header, relative width) pairs sharing the page width. Returns
+    (table, TableRenderer appending its rows); paragraphs are as for TableRenderer.
+    """
+    section = document.sections[-1]
+    width = section.page_width - section.left_margin - section.right_margin
+    total = sum(weight for _, weight in columns)
+    table = document.add_table(rows=0, cols=len(columns))
+    borders = OxmlElement("w:tblBorders")
+    for edge in _BORDERS:
+        border = OxmlElement(f"w:{edge}")
+        for name, value in (("val", "single"), ("sz", "4"), ("space", "0"), ("color", "000000")):
+            border.set(qn(f"w:{name}"), value)
+        borders.append(border)
+    table._tbl.tblPr.find(W_TBLW).addnext(borders)
+    for column, (_, weight) in zip(table.columns, columns):
+        column.width = int(width * weight / total)
+    # Rows are cloned from the renderer's skeletons, built once for this table's columns
+    renderer = TableRenderer(table, paragraphs=paragraphs)
+    _bold(renderer.add_row([header for header, _ in columns]))
+    anchor.addnext(table._tbl)
+    return table, renderer
+
+
+def _bold(tr):
+    """Make all text of a table row bold"""
+    for r in tr.iter(W_R):
+        Run(r, None).bold = True
+
+
+def _replace_paper_table(document, table, columns, caption, paragraphs=None):
+    """
+    Put a companion table with columns and a caption in place of the template's paper
+    table; returns (table, TableRenderer) as _add_table does
+    """
+    companion, renderer = _add_table(document, table._tbl, columns, paragraphs)
+    table._tbl.getparent().remove(table._tbl)
+    _add_caption(document, companion._tbl, caption)
+    return companion, renderer
+
+
+def render_marking_scheme(template, summary, paragraphs=None):
+    """
+    A marking scheme document on a fresh copy of template (a CompiledTemplate): every
+    question row as in the paper, followed by its question's total, and each part's totals.
+    paragraphs are prepared bank paragraphs, as for the paper itself.
+    """
+    document, table = template.new_paper()
+    _, rows = _replace_paper_table(document, table, SCHEME_COLUMNS, SCHEME_TITLE, paragraphs)
+    for header, numbers, marks_set, to_answer in summary.parts:
+        _bold(rows.add_section_header(header))
+        for number in numbers:
+            rows.add_question_rows(number, summary.blocks[number - 1])
+            rows.add_row(("", f"Total for Q{number}", str(summary.question_marks[number - 1]), "", ""))
+        choice = " or ".join(f"Q{number}" for number in numbers)
+        _bold(rows.add_section_header(f"{header}: answer {choice} - {to_answer} marks ({marks_set} marks set)"))
+    _bold(rows.add_section_header(f"Maximum marks: {summary.maximum}"))
+    return document
+
+
+def render_summary(template, summary):
+    """
+    A CO/RBT summary document on a fresh copy of template: marks, COs and RBT levels
+    per question and per part, then the share of the marks set for each CO and RBT level.
+    """
+    document, table = template.new_paper()
+    table, rows = _replace_paper_table(document, table, SUMMARY_COLUMNS, SUMMARY_TITLE)
+    title = table._tbl.getprevious()
+    for header, numbers, marks_set, to_answer in summary.parts:
+        _bold(rows.add_section_header(f"{header}: {marks_set} marks set, {to_answer} to answer"))
+        for number in numbers:
+            block = summary.blocks[number - 1]
+            parts = f"{len(block)} part" + ("s" if len(block) > 1 else "")
+            rows.add_row((str(number), parts, str(summary.question_marks[number - 1]),
+                          _join(q.co for q in block), _join(q.rbt for q in block)))
+    _bold(rows.add_section_header(f"Total: {summary.total} marks set, maximum marks {summary.maximum}"))
+
+    anchor = table._tbl
+    for caption, name, other, coverage in (("CO coverage", "CO", "RBT", summary.co_coverage()),
+                                           ("RBT levels", "RBT", "CO", summary.rbt_coverage())):
+        coverage_table, rows = _add_table(document, anchor, _coverage_columns(name, other))
+        # Word joins tables that touch, so the caption paragraph also keeps them apart
+        _add_caption(document, coverage_table._tbl, caption, title)
+        for value, marks, percent, labels, others in coverage:
+            rows.add_row((value, ", ".join(labels), str(marks), _percent(percent), _join(others)))
+        anchor = coverage_table._tbl
+    return document
@@ -0,0 +1,268 @@
+"""
+Write a generated paper by copying the template's zip members verbatim.
+
+Document.save() re-serializes and re-deflates every part of the package, although
+only the main document part changes when a paper is rendered. write_docx() copies
+the compressed bytes of every unchanged member straight from the template file and
+only deflates the replaced parts, so styles, fonts, themes and header images cost a
+plain byte copy.
+
+Parts added by rendering (e.g. images of questions copied with their formatting,
+see transplant.py) are passed as PackageAdditions; their relationships and content
+types are merged into the copied package when it is written.
+"""
+import io
+import posixpath
+import struct
+import zipfile
+import zlib
+
+from docx.opc.oxml import serialize_part_xml
+from lxml import etree
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+END_RECORD_SIGNATURE = 0x06054b50
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+ZIP_LIMIT = 0xFFFFFFFF
+MEMBER_LIMIT = 0xFFFF
+PKG_RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+CT_NS = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+CONTENT_TYPES = "[Content_Types].xml"
+
+
+class UnsupportedTemplateError(Exception):
+    """Raised for zip features this writer does not copy (zip64, encryption)"""
+
+
+class PackageAdditions:
+    """
+    Parts to add to a document's package when it is saved.
+
+    relationships: (Id, type, target, external) of new relationships of the main
+    document part; internal targets are zip member names
+    parts: {member name: bytes}
+    defaults / overrides: content types by extension / by part name ("/word/...")
+    """
+
+    def __init__(self):
+        self.relationships = []
+        self.parts = {}
+        self.defaults = {}
+        self.overrides = {}
+
+    def __bool__(self):
+        return bool(self.relationships or self.parts)
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _raw_member_data(src, info):
+    """Compressed bytes of a member, read without decompressing"""
+    src.seek(info.header_offset)
+    header = src.read(LOCAL_HEADER.size)
+    fields = LOCAL_HEADER.unpack(header)
+    if fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_length, extra_length = fields[9], fields[10]
+    src.seek(info.header_offset + LOCAL_HEADER.size + name_length + extra_length)
+    return src.read(info.compress_size)
+
+
+def _deflate(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _ZipStreamWriter:
+    """Minimal zip writer that takes members as already-compressed data"""
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._offset = 0
+        self._central = []
+
+    def add(self, name, data, crc, uncompressed_size, compress_type, date_time,
+            flag_bits=0, external_attr=0, extract_version=20):
+        encoded_name = name.encode("utf-8")
+        flag_bits &= ~FLAG_DATA_DESCRIPTOR
+        if not name.isascii():
+            flag_bits |= FLAG_UTF8
+        dos_time, dos_date = _dos_datetime(date_time)
+        if self._offset > ZIP_LIMIT or len(data) > ZIP_LIMIT or uncompressed_size > ZIP_LIMIT:
+            raise UnsupportedTemplateError("Zip64 output is not supported")
+
+        self._fp.write(LOCAL_HEADER.pack(
+            LOCAL_HEADER_SIGNATURE, extract_version, flag_bits, compress_type, dos_time, dos_date,
+            crc, len(data), uncompressed_size, len(encoded_name), 0))
+        self._fp.write(encoded_name)
+        self._fp.write(data)
+        self._central.append(CENTRAL_HEADER.pack(
+            CENTRAL_HEADER_SIGNATURE, 20, extract_version, flag_bits, compress_type, dos_time, dos_date,
+            crc, len(data), uncompressed_size, len(encoded_name), 0, 0, 0, 0, external_attr,
+            self._offset) + encoded_name)
+        self._offset += LOCAL_HEADER.size + len(encoded_name) + len(data)
+
+    def close(self):
+        if len(self._central) > MEMBER_LIMIT:
+            raise UnsupportedTemplateError("Too many zip members")
+        directory = b"".join(self._central)
+        self._fp.write(directory)
+        self._fp.write(END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, len(self._central),
+                                       len(self._central), len(directory), self._offset, 0))
+
+
+def read_template_members(template_path):
+    """
+    Return [(ZipInfo, compressed bytes)] for every member of a template (a path or
+    binary file object), in zip order.
+    Keeping this list lets write_docx() produce many papers without re-reading the file.
+    """
+    members = []
+    src = open(template_path, "rb") if isinstance(template_path, str) else template_path
+    with src, zipfile.ZipFile(src) as template_zip:
+        for info in template_zip.infolist():
+            if info.flag_bits & 0x1:
+                raise UnsupportedTemplateError(f"Encrypted member {info.filename}")
+            if info.file_size > ZIP_LIMIT or info.compress_size > ZIP_LIMIT or info.header_offset > ZIP_LIMIT:
+                raise UnsupportedTemplateError("Zip64 templates are not supported")
+            members.append((info, _raw_member_data(src, info)))
+    return members
+
+
+def write_docx(template, output, replacements):
+    """
+    Write output as a copy of the template zip with some members replaced.
+    template is a path or the result of read_template_members(). replacements maps
+    member names (e.g. "word/document.xml") to their new uncompressed bytes; members
+    not in the template are appended at the end. output may be a path or a binary
+    file object.
+    """
+    members = read_template_members(template) if isinstance(template, str) else template
+    replacements = dict(replacements)
+    fp = open(output, "wb") if isinstance(output, str) else output
+    try:
+        writer = _ZipStreamWriter(fp)
+        for info, raw in members:
+            data = replacements.pop(info.filename, None)
+            if data is None:
+                writer.add(info.filename, raw, info.CRC, info.file_size, info.compress_type,
+                           info.date_time, info.flag_bits, info.external_attr, info.extract_version)
+            else:
+                writer.add(info.filename, _deflate(data), zlib.crc32(data), len(data),
+                           zipfile.ZIP_DEFLATED, info.date_time, external_attr=info.external_attr)
+        for name, data in replacements.items():
+            writer.add(name, _deflate(data), zlib.crc32(data), len(data),
+                       zipfile.ZIP_DEFLATED, (1980, 1, 1, 0, 0, 0))
+        writer.close()
+    finally:
+        if fp is not output:
+            fp.close()
+
+
+def document_part_name(document):
+    """Zip member name of a python-docx document's main part"""
+    return document.part.partname.lstrip("/")
+
+
+def _member_data(members, name):
+    """Uncompressed bytes of a member of a read_template_members() list, or None"""
+    for info, raw in members:
+        if info.filename == name:
+            return zlib.decompress(raw, -15) if info.compress_type == zipfile.ZIP_DEFLATED else raw
+    return None
+
+
+def _rels_name(part_name):
+    directory, name = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", name + ".rels")
+
+
+def package_replacements(members, part_name, additions):
+    """
+    write_docx() replacements adding PackageAdditions to a package: the new parts,
+    and the relationships of part_name and [Content_Types].xml with the additions merged in
+    """
+    replacements = dict(additions.parts)
+    rels_name = _rels_name(part_name)
+    rels_xml = _member_data(members, rels_name)
+    rels = (etree.fromstring(rels_xml) if rels_xml is not None
+            else etree.Element(PKG_RELS_NS + "Relationships", nsmap={None: PKG_RELS_NS[1:-1]}))
+    directory = posixpath.dirname(part_name)
+    for rel_id, rel_type, target, external in additions.relationships:
+        rel = etree.SubElement(rels, PKG_RELS_NS + "Relationship", Id=rel_id, Type=rel_type,
+                               Target=target if external else posixpath.relpath(target, directory))
+        if external:
+            rel.set("TargetMode", "External")
+    replacements[rels_name] = etree.tostring(rels, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+    types = etree.fromstring(_member_data(members, CONTENT_TYPES))
+    extensions = {default.get("Extension").lower() for default in types.iter(CT_NS + "Default")}
+    for extension, content_type in sorted(additions.defaults.items()):
+        if extension not in extensions:
+            # Defaults must come before the overrides
+            types.insert(0, etree.Element(CT_NS + "Default", Extension=extension, ContentType=content_type))
+    for name, content_type in sorted(additions.overrides.items()):
+        etree.SubElement(types, CT_NS + "Override", PartName=name, ContentType=content_type)
+    replacements[CONTENT_TYPES] = etree.tostring(types, xml_declaration=True, encoding="UTF-8", standalone=True)
+    return replacements
+
+
+def relationship_keys(rels_xml):
+    """(Id, Type, Target) of every relationship in a .rels part"""
+    return {(rel.get("Id"), rel.get("Type"), rel.get("Target"))
+            for rel in etree.fromstring(rels_xml).iter(PKG_RELS_NS + "Relationship")}
+
+
+def _template_relationship_keys(members, part):
+    data = _member_data(members, part.partname.rels_uri.lstrip("/"))
+    return relationship_keys(data) if data is not None else set()
+
+
+def _save_with_python_docx(document, output, additions):
+    if not additions:
+        document.save(output)
+        return
+    # Let python-docx write the package, then add the new parts to its output
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    members = read_template_members(buffer)
+    write_docx(members, output, package_replacements(members, document_part_name(document), additions))
+
+
+def save_document(document, template, output, template_rels=None, additions=None):
+    """
+    Save a document rendered from template (a path or read_template_members() list),
+    re-writing only its main part, plus anything in additions (PackageAdditions).
+    template_rels may carry the template's relationship_keys() for the document part
+    to skip re-reading them.
+    Falls back to document.save() if rendering changed the document's relationships
+    through python-docx (new images or hyperlinks need their parts written too) or
+    the template uses zip features the fast writer does not copy.
+    """
+    part = document.part
+    try:
+        members = read_template_members(template) if isinstance(template, str) else template
+    except UnsupportedTemplateError:
+        _save_with_python_docx(document, output, additions)
+        return
+    if template_rels is None:
+        template_rels = _template_relationship_keys(members, part)
+    current = {(rId, rel.reltype, rel.target_ref) for rId, rel in part.rels.items()}
+    if current != template_rels:
+        _save_with_python_docx(document, output, additions)
+        return
+    part_name = document_part_name(document)
+    replacements = {part_name: serialize_part_xml(document.element)}
+    if additions:
+        replacements.update(package_replacements(members, part_name, additions))
+    write_docx(members, output, replacements)
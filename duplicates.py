@@ -0,0 +1,271 @@
+"""
+Near-duplicate detection for question texts with MinHash and LSH.
+
+Each question is normalized (lowercase, punctuation dropped). Two questions are
+near-duplicates when the Jaccard similarity of their character shingle sets reaches
+the threshold; only candidate pairs found by LSH have that checked.
+
+Candidates come from MinHash signatures over a sample of each question's shingles:
+those starting with one of the bank's most common characters, which make up about
+half of its text. The sample is taken by one regular expression and, being decided
+by the shingles themselves, estimates the similarity of the full sets. Every
+distinct shingle is hashed once into all signature slots by a single multiplication,
+with the slots packed side by side in one integer, and a question's signature is the
+slot-wise minimum over its sample, computed for all slots at once with a few integer
+operations per shingle. No Python code runs per slot.
+
+Signatures are cut into bands. Questions that share a band are candidates; before
+their shingles are compared, the share of equal slots must come within
+SKETCH_MARGIN of the threshold, which rules out most unrelated pairs in a couple of
+integer operations. A bucket with more than SMALL_BUCKET questions is split by the
+following band's keys, again and again, and a bucket still crowded after the last
+band is compared with its first question only. This is a deliberate approximation:
+near-duplicates usually share several bands, so few are missed, while a bank with a
+small vocabulary does not turn into comparing all pairs. Questions whose similarity
+reaches the threshold are merged into a cluster, represented by its lowest index;
+identical normalized texts are merged without any of this.
+"""
+import random
+import re
+import zlib
+from array import array
+from collections import Counter
+from functools import reduce
+from itertools import combinations, compress
+
+DEFAULT_THRESHOLD = 0.7
+SHINGLE_SIZE = 5
+# 20 bands of 3 slots: reworded copies (similarity 0.6 and up) share a band more than
+# 99% of the time, unrelated questions (0.1) about 2% of the time
+BANDS = 20
+ROWS = 3
+# Buckets up to this size have every pair compared; larger ones are split
+SMALL_BUCKET = 8
+# Candidates whose signatures agree on less than threshold minus this are not compared
+SKETCH_MARGIN = 0.2
+# Share of a bank's characters that start a sampled shingle
+SAMPLE_SHARE = 0.5
+# Questions with fewer sampled shingles than this use all of them
+MIN_SAMPLE = 8
+
+_SLOTS = BANDS * ROWS
+# Each slot is a 20-bit hash in a 21-bit lane; the top bit is a guard for the
+# slot-wise minimum
+_LANE = 21
+_VALUE_MASK = sum(((1 << (_LANE - 1)) - 1) << (_LANE * i) for i in range(_SLOTS))
+_GUARDS = sum(1 << (_LANE * i + _LANE - 1) for i in range(_SLOTS))
+_ONES = sum(1 << (_LANE * i) for i in range(_SLOTS))
+_BAND_BITS = _LANE * ROWS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+# Odd multiplier whose product with a 32-bit hash fills every lane with well-mixed
+# bits; the lowest 32 bits of the product are dropped
+_MIX = random.Random(0x51A7E).getrandbits(32 + _LANE * _SLOTS + 32) | 1
+# int.bit_count() is new in Python 3.10
+_popcount = getattr(int, "bit_count", None) or (lambda n: bin(n).count("1"))
+_NON_WORD = re.compile(r"[\W_]+")
+# normalize() for many texts at once; NUL cannot occur in a question from a .docx
+_NON_WORD_KEEP_NUL = re.compile(r"(?:[^\w\x00]|_)+")
+
+
+def normalize(text):
+    """Lowercase text with punctuation and runs of whitespace collapsed to single spaces"""
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def normalize_all(texts):
+    """normalize() of every text, with one regular expression pass over all of them"""
+    parts = _NON_WORD_KEEP_NUL.sub(" ", "\x00".join(texts).lower()).split("\x00")
+    if len(parts) != len(texts):
+        return list(map(normalize, texts))
+    return list(map(str.strip, parts))
+
+
+def shingles(text):
+    """Set of character shingles of a question's normalized text"""
+    return _shingles(normalize(text))
+
+
+def _shingles(norm):
+    if len(norm) <= SHINGLE_SIZE:
+        return {norm}
+    return {norm[i:i + SHINGLE_SIZE] for i in range(len(norm) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two shingle sets"""
+    if not a and not b:
+        return 1.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+def _feature_hashes(feature):
+    """All slots' hashes of one shingle, packed into lanes"""
+    return ((zlib.crc32(feature.encode("utf-8")) * _MIX) >> 32) & _VALUE_MASK
+
+
+def _lane_min(a, b):
+    """Slot-wise minimum of two packed signatures"""
+    # A lane keeps its guard bit after the subtraction exactly when a >= b there
+    guards = ((a | _GUARDS) - b) & _GUARDS
+    return a ^ ((a ^ b) & (guards - (guards >> (_LANE - 1))))
+
+
+def sample_pattern(norms):
+    """
+    Regular expression finding the sampled shingles of normalized texts: those that
+    start with one of their most common characters, SAMPLE_SHARE of them in all
+    """
+    # Every few texts are enough to rank the characters
+    counts = Counter("".join(norms[::max(1, len(norms) // 2000)]).replace(" ", ""))
+    wanted = SAMPLE_SHARE * sum(counts.values())
+    chosen = []
+    seen = 0
+    for char, count in counts.most_common():
+        if seen >= wanted:
+            break
+        chosen.append(char)
+        seen += count
+    if not chosen:
+        return None
+    return re.compile("(?=([%s].{%d}))" % (re.escape("".join(chosen)), SHINGLE_SIZE - 1))
+
+
+def signature(norm, cache=None, sample=None):
+    """
+    MinHash signature of a normalized text, packed into one int: over the shingles
+    found by sample (from sample_pattern()), or over all of them without one
+    """
+    if cache is None:
+        cache = {}
+    features = sample.findall(norm) if sample is not None else []
+    if len(features) < MIN_SAMPLE:
+        features = list(_shingles(norm))
+    hashes = list(map(cache.get, features))
+    if None in hashes:
+        for n, feature in enumerate(features):
+            if hashes[n] is None:
+                hashes[n] = cache[feature] = _feature_hashes(feature)
+    return reduce(_lane_min, hashes)
+
+
+def agreement(a, b):
+    """Number of slots in which two packed signatures are equal"""
+    differ = (((a ^ b) | _GUARDS) - _ONES) & _GUARDS
+    return _SLOTS - _popcount(differ)
+
+
+def band_keys(sig):
+    """One int key per LSH band of a packed signature"""
+    return [(sig >> shift) & _BAND_MASK for shift in range(0, _BAND_BITS * BANDS, _BAND_BITS)]
+
+
+class _Clusters:
+    """Union-find over question indexes; the lowest index represents its cluster"""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            if j < i:
+                i, j = j, i
+            self.parent[j] = i
+
+
+def _buckets(ids, keys):
+    """Groups of more than one of ids that share a key"""
+    groups = {}
+    for i in ids:
+        groups.setdefault(keys[i], []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _candidate_pairs(bands):
+    """
+    Pairs of indexes m < n that share a band, each as m * len(texts) + n, with
+    crowded buckets split by the following bands
+    """
+    size = len(bands[0]) if bands else 0
+    pairs = set()
+    for band, keys in enumerate(bands):
+        shared = {key for key, count in Counter(keys).items() if count > 1}
+        if not shared:
+            continue
+        members = compress(range(size), map(shared.__contains__, keys))
+        pending = [(bucket, band + 1) for bucket in _buckets(members, keys)]
+        while pending:
+            bucket, next_band = pending.pop()
+            if len(bucket) <= SMALL_BUCKET:
+                pairs.update([m * size + n for m, n in combinations(bucket, 2)])
+            elif next_band == len(bands):
+                m = bucket[0]
+                pairs.update([m * size + n for n in bucket[1:]])
+            else:
+                pending.extend((piece, next_band + 1) for piece in _buckets(bucket, bands[next_band]))
+    return pairs
+
+
+def find_duplicate_clusters(texts, threshold=DEFAULT_THRESHOLD):
+    """
+    Cluster near-duplicate texts. Returns, for every text, the index of the first
+    text of its cluster (its own index when it has no near-duplicates).
+    """
+    norms = normalize_all(list(texts))
+    clusters = _Clusters(len(norms))
+    # Identical texts need no signatures
+    first = {}
+    unique = []
+    for i, norm in enumerate(norms):
+        j = first.setdefault(norm, i)
+        if j == i:
+            unique.append(i)
+        else:
+            clusters.union(j, i)
+
+    cache = {}
+    sample = sample_pattern([norms[i] for i in unique])
+    signatures = [signature(norms[i], cache, sample) for i in unique]
+    cache.clear()
+    # One key array per band, filled in one pass over the signatures
+    bands = [array("q") for _ in range(BANDS)]
+    for sig in signatures:
+        for keys, key in zip(bands, band_keys(sig)):
+            keys.append(key)
+
+    size = len(unique)
+    min_agreement = (threshold - SKETCH_MARGIN) * _SLOTS
+    close = sorted(pair for pair in _candidate_pairs(bands)
+                   if agreement(signatures[pair // size], signatures[pair % size]) >= min_agreement)
+    shingle_sets = {}
+    def shingle_set(n):
+        s = shingle_sets.get(n)
+        if s is None:
+            s = shingle_sets[n] = _shingles(norms[unique[n]])
+        return s
+
+    for pair in close:
+        m, n = divmod(pair, size)
+        i, j = unique[m], unique[n]
+        if clusters.find(i) != clusters.find(j) and \
+                jaccard(shingle_set(m), shingle_set(n)) >= threshold:
+            clusters.union(i, j)
+    return [clusters.find(i) for i in range(len(norms))]
+
+
+def duplicate_groups(clusters):
+    """Lists of indexes for every cluster with more than one member"""
+    members = {}
+    for i, root in enumerate(clusters):
+        members.setdefault(root, []).append(i)
+    return [ids for ids in members.values() if len(ids) > 1]
@@ -0,0 +1,269 @@
+"""
+Usage history of questions placed in generated papers, kept in SQLite.
+
+    python history.py import generatedqp.docx qp1.docx --course cloud_computing
+    python history.py recent --course cloud_computing --days 365
+
+Every question of a saved paper is recorded with a hash of its normalized text (see
+duplicates.normalize, so case, punctuation and spacing do not matter), the course,
+the date and the paper it went into. Lookups go through indexes on (course, date,
+hash) and (hash, date), so checking a bank against past papers reads only the rows
+of the period asked for and never opens the old documents again.
+
+Existing papers can be imported: the paper table is read back row by row, using its
+header row to find the question, marks, CO and RBT columns and skipping section
+header rows. A recorded paper is identified by its path and date: recording it again
+on the same date replaces its rows, while papers saved to the same path on earlier
+days keep theirs. Importing a paper that is already recorded keeps its recorded date.
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+from hashlib import blake2b
+
+from docx import Document
+
+from duplicates import normalize
+
+SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    text_hash INTEGER NOT NULL,
+    course TEXT NOT NULL,
+    used_on TEXT NOT NULL,
+    paper TEXT NOT NULL,
+    number TEXT NOT NULL,
+    question TEXT NOT NULL,
+    marks INTEGER,
+    co TEXT,
+    rbt TEXT
+);
+CREATE INDEX IF NOT EXISTS usage_course_date ON usage (course, used_on, text_hash);
+CREATE INDEX IF NOT EXISTS usage_hash ON usage (text_hash, used_on);
+CREATE INDEX IF NOT EXISTS usage_paper ON usage (paper);
+"""
+
+
+def default_history_path():
+    """History database, overridable with the QGEN_HISTORY environment variable"""
+    return os.environ.get("QGEN_HISTORY") or os.path.join(
+        os.path.expanduser("~"), ".local", "share", "qgen", "history.sqlite3")
+
+
+def question_hash(text):
+    """64-bit hash of a question's normalized text, as a signed SQLite integer"""
+    digest = blake2b(normalize(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def course_name(path):
+    """Default course for a bank file, bank store, directory or glob: its name without .docx/.qbank"""
+    name = os.path.basename(os.path.normpath(path.split("*")[0]))
+    return os.path.splitext(name)[0] if name.endswith((".docx", ".qbank")) else name or "default"
+
+
+def paper_rows(blocks):
+    """(number, question, marks, CO, RBT) rows of a paper, labelled 1, 1b, ... as in the paper table"""
+    rows = []
+    for number, block in enumerate(blocks, start=1):
+        for idx, q in enumerate(block):
+            label = str(number) if idx == 0 else f"{number}{chr(97 + idx)}"
+            rows.append((label, q.question, q.marks, q.co, q.rbt))
+    return rows
+
+
+class UsageHistory:
+    """The usage database; use as a context manager or call close()"""
+
+    def __init__(self, path=None):
+        self.path = path or default_history_path()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    def record_paper(self, paper, course, used_on, rows):
+        """
+        Record the questions of one paper, replacing anything recorded for the same
+        paper on the same date. paper is its path, used_on a date and rows (number,
+        question, marks, CO, RBT) tuples; returns the number of questions recorded.
+        """
+        paper = os.path.abspath(paper)
+        used_on = used_on.isoformat()
+        with self.connection:
+            self.connection.execute("DELETE FROM usage WHERE paper = ? AND used_on = ?", (paper, used_on))
+            self.connection.executemany(
+                "INSERT INTO usage (text_hash, course, used_on, paper, number, question, marks, co, rbt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(question_hash(question), course, used_on, paper, str(number), question, marks, co, rbt)
+                 for number, question, marks, co, rbt in rows])
+        return len(rows)
+
+    def recorded_on(self, paper):
+        """Date the paper at this path was last recorded, or None"""
+        row = self.connection.execute("SELECT MAX(used_on) FROM usage WHERE paper = ?",
+                                      (os.path.abspath(paper),)).fetchone()
+        return datetime.date.fromisoformat(row[0]) if row[0] else None
+
+    def last_used(self, course, since=None):
+        """{text hash: date last used} for the course's questions used on or after since"""
+        since = since.isoformat() if since is not None else ""
+        rows = self.connection.execute(
+            "SELECT text_hash, MAX(used_on) FROM usage WHERE course = ? AND used_on >= ? GROUP BY text_hash",
+            (course, since))
+        return {text_hash: datetime.date.fromisoformat(used_on) for text_hash, used_on in rows}
+
+    def uses(self, question):
+        """(date, course, paper, number) of every recorded use of a question, newest first"""
+        return self.connection.execute(
+            "SELECT used_on, course, paper, number FROM usage WHERE text_hash = ? ORDER BY used_on DESC",
+            (question_hash(question),)).fetchall()
+
+    def recent(self, course, since=None):
+        """(date, paper, number, question, marks) rows of the course used on or after since, newest first"""
+        since = since.isoformat() if since is not None else ""
+        return self.connection.execute(
+            "SELECT used_on, paper, number, question, marks FROM usage WHERE course = ? AND used_on >= ? "
+            "ORDER BY used_on DESC, paper, rowid", (course, since)).fetchall()
+
+    def recently_used(self, bank, course, since=None):
+        """{question id: date last used} for the bank's questions that appear in the history"""
+        used = self.last_used(course, since)
+        if not used:
+            return {}
+        found = {}
+        for q in bank:
+            if bank.is_removed(q.id):
+                continue
+            # Questions from a bank store carry their hash, so their text is not decoded
+            text_hash = getattr(q, "text_hash", None)
+            when = used.get(question_hash(q.question) if text_hash is None else text_hash)
+            if when is not None:
+                found[q.id] = when
+        return found
+
+
+def _column(header, *names):
+    for i, text in enumerate(header):
+        if any(name in text for name in names):
+            return i
+    return None
+
+
+def read_paper(path):
+    """
+    Read the (number, question, marks, CO, RBT) rows of a generated paper's table.
+    Raises ValueError if the document has no table with a question column. The date
+    printed on a paper is not read: it usually comes from the template unchanged.
+    Rows without a question number, such as a marking scheme's totals, are skipped.
+    """
+    # Imported here: qgen builds on this module
+    from qgen import extract_question_info
+
+    document = Document(path)
+    for table in document.tables:
+        table_rows = [[cell.text.strip() for cell in row.cells] for row in table.rows]
+        if not table_rows:
+            continue
+        header = [text.lower() for text in table_rows[0]]
+        question_col = _column(header, "question")
+        if question_col is None:
+            continue
+        marks_col = _column(header, "mark")
+        co_col = next((i for i, text in enumerate(header) if text in ("co", "cos", "course outcome")), None)
+        rbt_col = _column(header, "rbt", "bloom")
+        number_col = 0 if question_col else None
+        rows = []
+        for cells in table_rows[1:]:
+            # Section headers ("PART A") are one cell merged across the row
+            if len(set(cells)) == 1 or not cells[question_col]:
+                continue
+            if number_col is not None and not cells[number_col]:
+                continue
+            # Older papers kept the bank's (Marks: ..) (CO: ..) (RBT: ..) tags in the question
+            q = extract_question_info(cells[question_col])
+            marks = cells[marks_col] if marks_col is not None else ""
+            rows.append((cells[number_col] if number_col is not None else str(len(rows) + 1),
+                         q["question"],
+                         int(marks) if marks.isdigit() else q["marks"] or None,
+                         cells[co_col] if co_col is not None else q["co"],
+                         cells[rbt_col] if rbt_col is not None else q["rbt"]))
+        return rows
+    raise ValueError("no table with a question column")
+
+
+def import_papers(history, paths, course, used_on=None):
+    """
+    Record existing papers in the history, used on used_on if given; otherwise a
+    paper already recorded keeps its recorded date and a new one gets its file's
+    modification date. Yields (path, question count, date) per paper; raises like
+    read_paper. Marking schemes and summaries written with a paper are skipped,
+    with a count and date of None: the paper itself holds their questions.
+    """
+    # Imported here: companions builds on this module
+    from companions import is_companion
+
+    for path in paths:
+        if is_companion(path):
+            yield path, None, None
+            continue
+        rows = read_paper(path)
+        date = (used_on or history.recorded_on(path)
+                or datetime.date.fromtimestamp(os.path.getmtime(path)))
+        yield path, history.record_paper(path, course, date, rows), date
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record and list the questions used in past papers.")
+    parser.add_argument("--history", default=None,
+                        help="history database (default: $QGEN_HISTORY or ~/.local/share/qgen/history.sqlite3)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="record the questions of existing papers")
+    import_parser.add_argument("papers", nargs="+", help="generated paper .docx files")
+    import_parser.add_argument("--course", required=True,
+                               help="course the papers belong to (qgen.py uses the bank's file name)")
+    import_parser.add_argument("--date", type=datetime.date.fromisoformat, default=None,
+                               help="date the papers were used, YYYY-MM-DD (default: the date already "
+                                    "recorded for a paper, else its file's modification date)")
+    recent_parser = commands.add_parser("recent", help="list the questions a course used recently")
+    recent_parser.add_argument("--course", required=True)
+    recent_parser.add_argument("--days", type=int, default=365, help="how far back to look (default: 365)")
+    args = parser.parse_args(argv)
+
+    with UsageHistory(args.history) as history:
+        if args.command == "import":
+            failed = 0
+            for path in args.papers:
+                try:
+                    for _, count, date in import_papers(history, [path], args.course, args.date):
+                        if count is None:
+                            print(f"{path}: skipped (a marking scheme or summary, not a paper)")
+                        else:
+                            print(f"{path}: {count} question(s) used on {date}")
+                except Exception as e:
+                    print(f"{path}: not imported ({e})")
+                    failed += 1
+            return 1 if failed else 0
+        since = datetime.date.today() - datetime.timedelta(days=args.days)
+        rows = history.recent(args.course, since)
+        for used_on, paper, number, question, marks in rows:
+            print(f"{used_on}  {os.path.basename(paper)} Q{number}: {question} [{marks} marks]")
+        print(f"{len(rows)} question(s) used by {args.course} since {since}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
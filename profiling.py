@@ -0,0 +1,162 @@
+"""
+Opt-in per-stage timing and memory profiling.
+
+    profiler = Profiler(enabled=True)
+    with profiler.stage("load", "bank.docx"):
+        ...
+    profiler.print_summary()
+    profiler.write("profile.json")                  # or write(path, "chrome")
+
+Every stage records its wall time, CPU time and the tracemalloc peak reached while
+it ran. Stages may nest; the summary reports self time (a stage's time minus that of
+the stages inside it), so totals add up. A disabled profiler hands out one shared
+no-op context manager, so instrumented code costs a method call per stage when
+profiling is off, and tracemalloc is only started when it is on.
+Records made by other processes, such as pool workers with their own Profiler, are
+merged with add_records(); their stages overlap in time, and a Chrome trace shows
+each process on its own row.
+The "chrome" format is the Trace Event format read by chrome://tracing and Perfetto.
+"""
+import json
+import os
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+_NO_STAGE = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("profiler", "record")
+
+    def __init__(self, profiler, record):
+        self.profiler = profiler
+        self.record = record
+
+    def __enter__(self):
+        profiler = self.profiler
+        record = self.record
+        if profiler.trace_memory:
+            # The peak is measured from here; a parent's peak so far is kept by _stack
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent["_peak"] = max(parent["_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            record["_base"] = tracemalloc.get_traced_memory()[0]
+            record["_peak"] = 0
+        profiler._stack.append(record)
+        record["start"] = time.perf_counter()
+        record["_cpu"] = time.process_time()
+        return record
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.process_time()
+        profiler = self.profiler
+        record = self.record
+        record["wall"] = end - record["start"]
+        record["cpu"] = cpu - record.pop("_cpu")
+        profiler._stack.pop()
+        if profiler.trace_memory:
+            peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+            record["peak_bytes"] = max(0, peak - record.pop("_base"))
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent["_peak"] = max(parent["_peak"], peak)
+        if profiler._stack:
+            parent = profiler._stack[-1]
+            parent["child_wall"] += record["wall"]
+            parent["child_cpu"] += record["cpu"]
+        profiler.records.append(record)
+        return False
+
+
+class Profiler:
+    """Collects per-stage timings when enabled; does nothing otherwise"""
+
+    def __init__(self, enabled=False, trace_memory=True):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.records = []
+        self._stack = []
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name, detail=None):
+        """Context manager timing one stage; detail (e.g. a file name) is kept with the record"""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, {"name": name, "detail": detail, "pid": self._pid, "child_wall": 0.0, "child_cpu": 0.0})
+
+    def add_records(self, records):
+        """
+        Add stage records made by another process's Profiler, e.g. a worker's;
+        perf_counter() is system-wide, so their start times line up with this one's
+        """
+        self.records.extend(records)
+
+    def stop(self):
+        """Stop tracemalloc if this profiler started it"""
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def summary(self):
+        """Per stage name, in order of first use: count, self wall/CPU seconds and the highest peak"""
+        totals = {}
+        for record in sorted(self.records, key=lambda r: r["start"]):
+            total = totals.setdefault(record["name"], {"count": 0, "wall": 0.0, "cpu": 0.0, "peak_bytes": None})
+            total["count"] += 1
+            total["wall"] += record["wall"] - record["child_wall"]
+            total["cpu"] += record["cpu"] - record["child_cpu"]
+            if "peak_bytes" in record:
+                total["peak_bytes"] = max(total["peak_bytes"] or 0, record["peak_bytes"])
+        return totals
+
+    def print_summary(self):
+        totals = self.summary()
+        if not totals:
+            return
+        wall_total = sum(t["wall"] for t in totals.values()) or 1.0
+        print(f"\n{'Stage':<10} {'Calls':>5} {'Wall ms':>10} {'CPU ms':>10} {'Wall %':>7} {'Peak MiB':>9}")
+        for name, t in totals.items():
+            peak = f"{t['peak_bytes'] / 1048576:9.1f}" if t["peak_bytes"] is not None else f"{'-':>9}"
+            print(f"{name:<10} {t['count']:>5} {t['wall'] * 1000:>10.1f} {t['cpu'] * 1000:>10.1f}"
+                  f" {t['wall'] / wall_total:>7.1%} {peak}")
+        print("Wall time of interactive stages includes time spent waiting for input.")
+
+    def to_dict(self):
+        stages = []
+        for record in sorted(self.records, key=lambda r: r["start"]):
+            stage = {"name": record["name"], "detail": record["detail"],
+                     "start": record["start"] - self._origin, "wall": record["wall"], "cpu": record["cpu"],
+                     "self_wall": record["wall"] - record["child_wall"],
+                     "self_cpu": record["cpu"] - record["child_cpu"]}
+            if "peak_bytes" in record:
+                stage["peak_bytes"] = record["peak_bytes"]
+            stages.append(stage)
+        return {"stages": stages, "summary": self.summary()}
+
+    def chrome_trace(self):
+        """The records as Trace Event format complete ("X") events, in microseconds"""
+        events = []
+        for record in sorted(self.records, key=lambda r: r["start"]):
+            args = {"cpu_ms": round(record["cpu"] * 1000, 3)}
+            if record["detail"] is not None:
+                args["detail"] = str(record["detail"])
+            if "peak_bytes" in record:
+                args["peak_bytes"] = record["peak_bytes"]
+            events.append({"name": record["name"], "cat": "qgen", "ph": "X", "pid": record["pid"], "tid": 0,
+                           "ts": round((record["start"] - self._origin) * 1e6, 1),
+                           "dur": round(record["wall"] * 1e6, 1), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path, format="json"):
+        """Write the records to path as plain JSON ("json") or a Chrome trace ("chrome")"""
+        data = self.chrome_trace() if format == "chrome" else self.to_dict()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+NO_PROFILER = Profiler(enabled=False)
@@ -1,41 +1,258 @@
 import re
 import os
 import sys
+import argparse
+import datetime
+import glob
+import sqlite3
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from docx import Document
+from lxml import etree
+
+import bank_cache
+from bank_store import BankStore
+from browser import DEFAULT_PAGE_SIZE, QuestionBrowser
+from companions import PaperSummary, companion_filenames, render_marking_scheme, render_summary
+from duplicates import DEFAULT_THRESHOLD
+from history import UsageHistory, course_name, paper_rows
+from profiling import NO_PROFILER, Profiler
+from questions import QuestionBank
+from render import CompiledTemplate, TableRenderer, clear_table
+from selection import BlockSpec, SelectionError, select_paper, select_variants
+
+# One precompiled pattern for all three metadata tags, so a paragraph is scanned once.
+# Exactly one of the groups is set per match, which also tells us the tag kind.
+QUESTION_TAG_PATTERN = re.compile(
+    r'\((?:Marks\s*:\s*(?P<marks>\d+)|CO\s*:\s*(?P<co>[^)]+)|RBT\s*:\s*(?P<rbt>[^)]+))\)'
+)
 
 # Function to extract information from question text
-def extract_question_info(question_text):
-    # Extract marks
-    marks_match = re.search(r'\(Marks\s*:\s*(\d+)\)', question_text)
-    marks = int(marks_match.group(1)) if marks_match else 0
-    
-    # Extract CO
-    co_match = re.search(r'\(CO\s*:\s*([^)]+)\)', question_text)
-    co = co_match.group(1) if co_match else ""
-    
-    # Extract RBT
-    rbt_match = re.search(r'\(RBT\s*:\s*([^)]+)\)', question_text)
-    rbt = rbt_match.group(1) if rbt_match else ""
-    
-    # Clean question text by removing the marks, CO, and RBT information
-    clean_question = question_text
-    if marks_match:
-        clean_question = clean_question.replace(marks_match.group(0), "")
-    if co_match:
-        clean_question = clean_question.replace(co_match.group(0), "")
-    if rbt_match:
-        clean_question = clean_question.replace(rbt_match.group(0), "")
-    
-    # Trim any extra spaces
-    clean_question = clean_question.strip()
-    
+def extract_question_info(question_text, _split=QUESTION_TAG_PATTERN.split):
+    """Extract marks, CO, RBT and the cleaned text from one question in a single scan"""
+    # split() returns [text, marks, co, rbt, text, marks, co, rbt, ..., text]
+    parts = _split(question_text)
+    if len(parts) == 1:
+        return {"question": question_text.strip(), "marks": 0, "co": "", "rbt": ""}
+    
+    if len(parts) == 13:
+        # Common case: three tags in any order, one of each kind
+        marks = parts[1] or parts[5] or parts[9]
+        co = parts[2] or parts[6] or parts[10]
+        rbt = parts[3] or parts[7] or parts[11]
+        if marks and co and rbt:
+            return {
+                "question": (parts[0] + parts[4] + parts[8] + parts[12]).strip(),
+                "marks": int(marks),
+                "co": co,
+                "rbt": rbt
+            }
+    
+    return _parse_question_tags(question_text)
+
+def _parse_question_tags(question_text):
+    """General case of extract_question_info for missing or repeated tags"""
+    found = {}
+    pieces = []
+    last_end = 0
+    for match in QUESTION_TAG_PATTERN.finditer(question_text):
+        kind = match.lastgroup
+        tag = match.group(0)
+        first = found.get(kind)
+        if first is None:
+            found[kind] = (match.group(kind), tag)
+        elif first[1] != tag:
+            # Only the first tag of each kind is used; a different repeat stays in the text
+            continue
+        pieces.append(question_text[last_end:match.start()])
+        last_end = match.end()
+    pieces.append(question_text[last_end:])
+    
+    marks = found.get("marks")
+    co = found.get("co")
+    rbt = found.get("rbt")
     return {
-        "question": clean_question,
-        "marks": marks,
-        "co": co,
-        "rbt": rbt
+        "question": "".join(pieces).strip(),
+        "marks": int(marks[0]) if marks else 0,
+        "co": co[0] if co else "",
+        "rbt": rbt[0] if rbt else ""
     }
 
+def parse_questions(question_texts):
+    """Parse an iterable of question texts, returning a list of question dicts"""
+    return [extract_question_info(text) for text in question_texts]
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_BODY = W_NS + "body"
+W_P = W_NS + "p"
+W_R = W_NS + "r"
+W_T = W_NS + "t"
+W_TBL = W_NS + "tbl"
+W_SDT = W_NS + "sdt"
+W_HYPERLINK = W_NS + "hyperlink"
+W_TYPE = W_NS + "type"
+RT_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+PKG_RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Text equivalents of run children, matching python-docx's Run.text
+_RUN_CHILD_TEXT = {
+    W_NS + "tab": "\t",
+    W_NS + "ptab": "\t",
+    W_NS + "cr": "\n",
+    W_NS + "noBreakHyphen": "-",
+}
+
+def _main_document_part(docx_zip):
+    """Return the zip member name of the main document part"""
+    try:
+        rels = etree.fromstring(docx_zip.read("_rels/.rels"))
+    except KeyError:
+        return "word/document.xml"
+    for rel in rels.iter(PKG_RELS_NS + "Relationship"):
+        if rel.get("Type") == RT_OFFICE_DOCUMENT:
+            return rel.get("Target").lstrip("/")
+    return "word/document.xml"
+
+def _run_text(run):
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or "")
+        elif tag == W_NS + "br":
+            # Page and column breaks have no text equivalent
+            if child.get(W_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        else:
+            text = _RUN_CHILD_TEXT.get(tag)
+            if text:
+                parts.append(text)
+    return "".join(parts)
+
+def _paragraph_text(paragraph):
+    """Text of a <w:p> element, computed the same way as python-docx's Paragraph.text"""
+    parts = []
+    for child in paragraph:
+        if child.tag == W_R:
+            parts.append(_run_text(child))
+        elif child.tag == W_HYPERLINK:
+            parts.extend(_run_text(run) for run in child if run.tag == W_R)
+    return "".join(parts)
+
+def iter_numbered_paragraphs(question_bank_path):
+    """
+    Stream (paragraph number, text) for the non-empty body paragraphs of a .docx file,
+    with the text stripped. Numbers are 1-based positions in Document(path).paragraphs,
+    so empty paragraphs are counted but not yielded.
+    Builds no document and frees each element once it has been read, so memory stays flat.
+    """
+    number = 0
+    with zipfile.ZipFile(question_bank_path) as docx_zip:
+        with docx_zip.open(_main_document_part(docx_zip)) as part:
+            # Body-level tables and content controls are only collected to be freed;
+            # paragraphs nested inside them are not document paragraphs.
+            for _, elem in etree.iterparse(part, events=("end",), tag=(W_P, W_TBL, W_SDT),
+                                           remove_blank_text=True, resolve_entities=False):
+                parent = elem.getparent()
+                if parent is None or parent.tag != W_BODY:
+                    continue
+                text = ""
+                if elem.tag == W_P:
+                    number += 1
+                    text = _paragraph_text(elem).strip()
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del parent[0]
+                if text:
+                    yield number, text
+
+def iter_bank_paragraphs(question_bank_path):
+    """Stream the non-empty body paragraph texts of a .docx file, stripped"""
+    for _, text in iter_numbered_paragraphs(question_bank_path):
+        yield text
+
+def iter_bank_questions(question_bank_path):
+    """Stream parsed questions that carry marks from a question bank .docx file"""
+    for number, text in iter_numbered_paragraphs(question_bank_path):
+        question = extract_question_info(text)
+        if question["marks"] > 0:
+            question["paragraph"] = number
+            yield question
+
+def parse_question_bank(question_bank_path):
+    """Parse the questions with marks from a question bank .docx file"""
+    return list(iter_bank_questions(question_bank_path))
+
+def load_question_bank(question_bank_path, use_cache=True, rebuild_cache=False, cache_dir=None,
+                       profiler=NO_PROFILER):
+    """Load a question bank, reusing the parsed-bank cache unless use_cache is False"""
+    loader = parse_question_bank
+    if profiler.enabled:
+        # The streaming parse reads, extracts and filters in one pass, so it is one stage
+        def loader(path):
+            with profiler.stage("parse", path):
+                return parse_question_bank(path)
+    if not use_cache:
+        return loader(question_bank_path)
+    # A cache hit shows as a load stage of its own; a miss also holds the parse stages
+    with profiler.stage("load", question_bank_path):
+        return bank_cache.load_cached(question_bank_path, loader,
+                                      cache_dir=cache_dir, rebuild=rebuild_cache)
+
+def expand_bank_paths(pattern):
+    """
+    The .docx files a --banks argument names: every .docx in a directory, the
+    matches of a glob pattern, or a single file. Sorted, skipping Word's ~$ lock files.
+    """
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, f) for f in os.listdir(pattern)]
+    elif glob.has_magic(pattern):
+        paths = glob.glob(pattern)
+    else:
+        return [pattern]
+    return sorted(p for p in paths if p.endswith('.docx') and not os.path.basename(p).startswith('~$')
+                  and os.path.isfile(p))
+
+def _load_bank_for_merge(args):
+    """Load one bank in a worker; returns (questions, the worker's stage records or None)"""
+    path, use_cache, rebuild_cache, cache_dir, profile = args
+    if not profile:
+        return load_question_bank(path, use_cache, rebuild_cache, cache_dir), None
+    profiler = Profiler(enabled=True)
+    try:
+        return load_question_bank(path, use_cache, rebuild_cache, cache_dir, profiler), profiler.records
+    finally:
+        profiler.stop()
+
+def load_question_banks(paths, workers=None, use_cache=True, rebuild_cache=False, cache_dir=None,
+                        profiler=NO_PROFILER):
+    """
+    Load several question banks in parallel and merge them, in the order given.
+    Every question dict gets a "source" (its bank's path) next to its "paragraph" number.
+    Banks are parsed on a process pool of `workers` processes (default: one per core).
+    While profiling, each worker profiles its own banks and its stage records are
+    merged into profiler's.
+    """
+    paths = list(paths)
+    jobs = [(path, use_cache, rebuild_cache, cache_dir, profiler.enabled) for path in paths]
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_load_bank_for_merge, jobs))
+        banks = [questions for questions, _ in results]
+        for _, records in results:
+            if records:
+                profiler.add_records(records)
+    else:
+        banks = [load_question_bank(*job[:4], profiler=profiler) for job in jobs]
+    
+    merged = []
+    for path, questions in zip(paths, banks):
+        for q in questions:
+            q["source"] = path
+            merged.append(q)
+    return merged
+
 def list_files(directory, extension='.docx'):
     """List all files with the given extension in the directory"""
     files = [f for f in os.listdir(directory) if f.endswith(extension)]
@@ -63,34 +280,379 @@ def select_file(prompt, directory='.', extension='.docx'):
         except ValueError:
             print("Please enter a number.")
 
-def assign_question_parts(questions, target_marks=25):
+def assign_question_parts(questions, target_marks=25, groups=4, seed=None):
+    """
+    Split questions into disjoint groups (one per question number) whose marks hit
+    target_marks exactly, or as close as the questions allow.
+    Accepts question dicts or Question objects and returns groups of the same items.
+    """
+    questions = list(questions)
+    bank = QuestionBank(q if isinstance(q, dict) else q.to_dict() for q in questions)
+    blocks = select_paper(bank, [BlockSpec(target_marks) for _ in range(groups)], seed=seed)
+    return [[questions[q.id] for q in block] for block in blocks]
+
+def print_questions(questions, bank=None, last_used=None):
+    """
+    Print questions numbered by their stable id, which is what the user types to select them.
+    With a bank, near-duplicates are marked with the number of their cluster's first question,
+    and questions merged from several banks with their bank and paragraph.
+    last_used ({question id: date}) marks questions used in recent papers.
+    """
+    clusters = bank.clusters if bank is not None else None
+    # Questions merged from several banks also show where they came from
+    show_source = bank is not None and len(bank.by_source) > 1
+    for q in questions:
+        note = ""
+        if show_source:
+            note += f" ({os.path.basename(q.source)}, paragraph {q.paragraph})"
+        if clusters is not None and clusters[q.id] != q.id:
+            note += f" (near-duplicate of {clusters[q.id] + 1})"
+        if last_used and q.id in last_used:
+            note += f" (used {last_used[q.id].isoformat()})"
+        print(f"{q.id + 1}. {q.question} [{q.marks} marks]{note}")
+
+def check_duplicates(bank, mode="flag", threshold=DEFAULT_THRESHOLD, clusters=None, use_cache=True, cache_dir=None):
+    """
+    Find near-duplicate questions in a freshly loaded bank. "flag" keeps them but
+    lets only one per cluster into the paper, "collapse" drops all but the first of
+    each cluster, "off" skips the check. clusters, if given, are clusters found
+    beforehand and used instead of comparing the texts; otherwise clusters found
+    for the same texts on an earlier run come from the bank cache unless use_cache
+    is False. Returns the bank to use.
+    """
+    if mode == "off":
+        return bank
+    if clusters is None:
+        groups = bank.mark_duplicates(threshold, use_cache, cache_dir)
+    else:
+        groups = bank.set_clusters(clusters)
+    if not groups:
+        return bank
+    extra = sum(len(ids) - 1 for ids in groups)
+    if mode == "collapse":
+        print(f"\nDropped {extra} near-duplicate question(s) from {len(groups)} group(s), keeping the first of each.")
+        return bank.without_duplicates()
+    print(f"\nFound {len(groups)} group(s) of near-duplicate questions ({extra} extra copies);"
+          " at most one question from each group can go into the paper.")
+    return bank
+
+def load_store_bank(store, marks=None, co=None, rbt=None, duplicates="flag", threshold=DEFAULT_THRESHOLD,
+                    use_cache=True, cache_dir=None):
+    """
+    Build the bank from the questions of a bank store (see bank_store.py) with the given
+    marks, COs and RBT levels (None: any). Near-duplicates come from the clusters stored
+    at export if they were found at the same threshold; otherwise the texts are compared.
+    """
+    rows = store.select(marks, co, rbt)
+    bank = store.question_bank(rows)
+    clusters = store.clusters(rows) if duplicates != "off" and store.similarity == threshold else None
+    return check_duplicates(bank, duplicates, threshold, clusters, use_cache, cache_dir)
+
+def refresh_banks(watchers):
+    """Apply the edits saved to watched bank files since the last check (see watch.py)"""
+    for watcher in watchers:
+        change = watcher.refresh()
+        if change:
+            print(f"\n{os.path.basename(watcher.path)} changed: {len(change['added'])} question(s) added, "
+                  f"{len(change['removed'])} removed ({change['seconds'] * 1000:.0f} ms). "
+                  "Other questions keep their numbers.")
+
+def show_remaining(bank, title, watchers=(), browser=None, last_used=None):
+    """List the questions left to choose from; with a browser they are paged at the prompt instead"""
+    refresh_banks(watchers)
+    if browser is None:
+        print(f"\n{title}:")
+        print_questions(bank.available(), bank, last_used)
+
+def select_questions(bank, number, part, target_marks=25, browser=None):
     """
-    Group questions into parts (a, b, c, etc.) aiming for a target total marks
-    Returns a list of question groups, each with total marks close to target_marks
+    Prompt for the questions of one question number and take them from the bank.
+    With a QuestionBrowser, the prompt also pages and filters the remaining questions.
+    Returns the selected questions, or None if the user chose to stop.
     """
-    question_groups = []
-    current_group = []
-    current_marks = 0
+    print("\n" + "=" * 50)
+    print(f"PART {part} - Question {number} Selection")
+    print("=" * 50)
+    message = f"Enter question numbers for Q{number} (comma separated, total ~{target_marks} marks): "
+    if browser is None:
+        selected = input(message)
+    else:
+        selected = browser.prompt(message)
+        if selected is None:
+            return None
+    
+    # Convert input to question ids (0-indexed)
+    try:
+        selected_ids = [int(x.strip()) - 1 for x in selected.split(',') if x.strip().isdigit()]
+        
+        # Check that every question exists, is still available and is only chosen once
+        seen = set()
+        invalid_numbers = []
+        for qid in selected_ids:
+            if qid in seen or not bank.is_available(qid):
+                invalid_numbers.append(qid + 1)
+            seen.add(qid)
+        if invalid_numbers:
+            print(f"Invalid question numbers: {', '.join(map(str, invalid_numbers))}")
+            input("Press Enter to exit...")
+            return None
+        
+        # Near-duplicates of each other cannot go into the same paper
+        first_in_cluster = {}
+        for qid in selected_ids:
+            other = first_in_cluster.setdefault(bank.clusters[qid], qid)
+            if other != qid:
+                print(f"Questions {other + 1} and {qid + 1} are near-duplicates; choose only one of them.")
+                input("Press Enter to exit...")
+                return None
+        
+        selected_questions = [bank[qid] for qid in selected_ids]
+        total_marks = sum(q.marks for q in selected_questions)
+        
+        print(f"\nSelected {len(selected_questions)} questions for Q{number}, total marks: {total_marks}")
+        if abs(total_marks - target_marks) > 5:
+            print(f"WARNING: Total marks for Q{number} ({total_marks}) is not close to {target_marks}.")
+            proceed = input("Do you want to continue anyway? (y/n): ")
+            if proceed.lower() != 'y':
+                return None
+    except Exception as e:
+        print(f"Error processing question selection: {e}")
+        input("Press Enter to exit...")
+        return None
     
-    for question in questions:
-        if current_marks + question["marks"] > target_marks and current_group:
-            # If adding this question exceeds the target and we already have questions,
-            # save the current group and start a new one
-            question_groups.append(current_group)
-            current_group = [question]
-            current_marks = question["marks"]
+    # Remove the selected questions from the available pool
+    bank.take(selected_ids)
+    return selected_questions
+
+# Section headers and how many question numbers each part holds
+PAPER_LAYOUT = (("PART A", 2), ("PART B", 2))
+
+def open_template(template_path):
+    """Load a template and clear its first table down to the header row; returns (document, table)"""
+    template_doc = Document(template_path)
+    if not template_doc.tables:
+        raise ValueError("Template file does not contain a table.")
+    
+    table = template_doc.tables[0]
+    clear_table(table)
+    return template_doc, table
+
+def add_section_header(table, header_text):
+    """Add a merged header row to the table"""
+    row = table.add_row()
+    merged_cell = row.cells[0]
+    # Merge all cells in the row to create a section header
+    for cell in row.cells[1:]:
+        merged_cell = merged_cell.merge(cell)
+    merged_cell.text = header_text
+
+def add_question_rows(table, number, questions):
+    """Add one question number with its subparts (1, 1b, 1c, ...)"""
+    label = str(number)
+    for idx, q in enumerate(questions):
+        row_cells = table.add_row().cells
+        if idx == 0:
+            # First row of the question
+            row_cells[0].text = label
         else:
-            # Add the question to the current group
-            current_group.append(question)
-            current_marks += question["marks"]
+            # Subparts of the question
+            row_cells[0].text = f"{label}{chr(97+idx)}"
+        
+        row_cells[1].text = q.question
+        row_cells[2].text = str(q.marks)
+        row_cells[3].text = q.co
+        row_cells[4].text = q.rbt
+
+def fill_paper_table(table, blocks, renderer=None):
+    """Fill the paper table with the section headers and one block of questions per question number"""
+    # Rows are cloned from prebuilt row XML; add_section_header/add_question_rows
+    # above give the same result through python-docx, much more slowly
+    renderer = renderer or TableRenderer(table)
+    blocks = iter(blocks)
+    number = 1
+    for header_text, question_count in PAPER_LAYOUT:
+        renderer.add_section_header(header_text)
+        for _ in range(question_count):
+            renderer.add_question_rows(number, next(blocks))
+            number += 1
+
+def load_recent_usage(history_path, course, days, bank):
+    """
+    {question id: date last used} for the bank's questions that went into the course's
+    papers in the last `days` days, according to the usage history (see history.py)
+    """
+    since = datetime.date.today() - datetime.timedelta(days=days)
+    with UsageHistory(history_path) as history:
+        return history.recently_used(bank, course, since)
+
+def exclude_recent(bank, last_used):
+    """Take recently used questions (and their near-duplicates) out of the selection; returns how many"""
+    excluded = 0
+    for qid in last_used:
+        if bank.is_available(qid):
+            bank.take([qid])
+            excluded += 1
+    return excluded
+
+def record_usage(history_path, course, output_filename, blocks):
+    """Record the questions of a saved paper in the usage history"""
+    with UsageHistory(history_path) as history:
+        return history.record_paper(output_filename, course, datetime.date.today(), paper_rows(blocks))
+
+def auto_select_questions(bank, target_marks=25, seed=None, last_used=None):
+    """
+    Pick all four questions automatically; returns the four blocks, or None on failure.
+    Questions in last_used ({question id: date}) are only used where others cannot
+    hit the marks, the longest unused first.
+    """
+    penalties = {qid: date.toordinal() for qid, date in last_used.items()} if last_used else None
+    try:
+        blocks = select_paper(bank, [BlockSpec(target_marks) for _ in range(4)], seed=seed,
+                              penalties=penalties)
+    except SelectionError as e:
+        print(f"Error selecting questions automatically: {e}")
+        input("Press Enter to exit...")
+        return None
     
-    # Add any remaining questions
-    if current_group:
-        question_groups.append(current_group)
+    for number, block in enumerate(blocks, start=1):
+        total_marks = sum(q.marks for q in block)
+        print(f"\nQ{number} ({total_marks} marks):")
+        print_questions(block, bank, last_used)
+        if total_marks != target_marks:
+            print(f"WARNING: Total marks for Q{number} ({total_marks}) is not {target_marks}.")
+    return blocks
+
+def auto_select_variants(bank, count, target_marks=25, seed=None, max_overlap=0, last_used=None):
+    """
+    Pick `count` equivalent papers automatically; returns one list of blocks per paper, or None.
+    Questions in last_used are picked last, the longest unused first.
+    """
+    penalties = {qid: date.toordinal() for qid, date in last_used.items()} if last_used else None
+    try:
+        papers = select_variants(bank, [BlockSpec(target_marks) for _ in range(4)], count,
+                                 seed=seed, max_overlap=max_overlap, penalties=penalties)
+    except SelectionError as e:
+        print(f"Error selecting questions automatically: {e}")
+        input("Press Enter to exit...")
+        return None
     
-    return question_groups
+    for i, blocks in enumerate(papers):
+        print(f"\nSET {variant_label(i)}: " + ", ".join(
+            f"Q{number} {'/'.join(str(q.id + 1) for q in block)} ({sum(q.marks for q in block)} marks)"
+            for number, block in enumerate(blocks, start=1)))
+    return papers
+
+def variant_label(index):
+    """Set name for the index-th variant: A, B, ..., Z, then 27, 28, ..."""
+    return chr(ord('A') + index) if index < 26 else str(index + 1)
+
+def variant_filename(output_filename, index):
+    """'paper.docx' -> 'paper_set_A.docx' for the first variant, and so on"""
+    return f"{output_filename[:-len('.docx')]}_set_{variant_label(index)}.docx"
 
-def main():
+def marks_list(text):
+    """--marks value: '5,10' -> [5, 10], '2-5' -> [2, 3, 4, 5]"""
+    marks = []
+    for part in text.split(","):
+        low, _, high = part.partition("-")
+        marks.extend(range(int(low), int(high or low) + 1))
+    return marks
+
+def label_list(text):
+    """--co / --rbt value: 'CO-1, CO-2' -> ['CO-1', 'CO-2']"""
+    return [label.strip() for label in text.split(",") if label.strip()]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a question paper from a question bank.")
+    parser.add_argument("--auto", action="store_true",
+                        help="pick questions for Q1-Q4 automatically so each adds up to 25 marks")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed for --auto, to vary the paper reproducibly")
+    parser.add_argument("--variants", type=int, default=1,
+                        help="with --auto, generate this many equivalent papers (sets A, B, ...)")
+    parser.add_argument("--max-overlap", type=int, default=0,
+                        help="with --variants, the most questions any two sets may share (default: 0)")
+    parser.add_argument("--duplicates", choices=("flag", "collapse", "off"), default="flag",
+                        help="near-duplicate questions: allow one per paper (flag, default), keep only "
+                             "the first of each group (collapse), or skip the check (off)")
+    parser.add_argument("--similarity", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"text similarity (0-1) at which questions count as near-duplicates "
+                             f"(default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--banks", default=None, metavar="DIR_OR_GLOB",
+                        help="load and merge every .docx bank in a directory or matching a glob "
+                             "(e.g. 'banks/unit*.docx') instead of choosing one bank")
+    parser.add_argument("--store", default=None, metavar="FILE",
+                        help="read the questions from a bank store made with 'bank_store.py export' "
+                             "instead of choosing a bank")
+    parser.add_argument("--marks", type=marks_list, default=None,
+                        help="with --store, only load questions with these marks, e.g. 5,10 or 2-5")
+    parser.add_argument("--co", type=label_list, default=None,
+                        help="with --store, only load questions with these COs, e.g. CO-1,CO-2")
+    parser.add_argument("--rbt", type=label_list, default=None,
+                        help="with --store, only load questions with these RBT levels, e.g. L1,L2")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to load --banks in parallel (default: number of CPU cores)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the question bank without reading or writing the bank cache")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="re-parse the question bank and replace its cache entry")
+    parser.add_argument("--cache-dir", default=None,
+                        help="bank cache directory (default: $QGEN_CACHE_DIR or ~/.cache/qgen)")
+    parser.add_argument("--history", default=None, metavar="FILE",
+                        help="usage history of past papers (default: $QGEN_HISTORY or "
+                             "~/.local/share/qgen/history.sqlite3)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="neither check nor record which questions went into papers")
+    parser.add_argument("--course", default=None,
+                        help="course the paper is for in the usage history (default: the bank's file name)")
+    parser.add_argument("--recent", type=int, default=365, metavar="DAYS",
+                        help="questions used in the course's papers within this many days count as "
+                             "recently used (default: 365)")
+    parser.add_argument("--reuse", choices=("avoid", "exclude", "allow"), default="avoid",
+                        help="recently used questions: pick them only when needed and mark them in the "
+                             "list (avoid, default), leave them out (exclude), or ignore the history (allow)")
+    parser.add_argument("--plain-text", action="store_true",
+                        help="write questions into the paper as plain text instead of copying their "
+                             "formatting (bold, subscripts, equations, images) from the bank")
+    parser.add_argument("--companions", action="store_true",
+                        help="also write a marking scheme (NAME_scheme.docx) and a CO/RBT summary "
+                             "(NAME_summary.docx) for every paper")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"questions per page when choosing questions (default: {DEFAULT_PAGE_SIZE})")
+    parser.add_argument("--full-list", action="store_true",
+                        help="print every remaining question before each prompt instead of paging")
+    parser.add_argument("--watch", action="store_true",
+                        help="pick up edits saved to the question bank while you are choosing questions")
+    parser.add_argument("--profile", action="store_true",
+                        help="time the load, parse, filter, select, render and save stages and print a summary")
+    parser.add_argument("--profile-output", default=None, metavar="FILE",
+                        help="with profiling, also write the stage records to FILE (implies --profile)")
+    parser.add_argument("--profile-format", choices=("json", "chrome"), default="json",
+                        help="--profile-output format: plain JSON (default) or a Chrome/Perfetto trace")
+    args = parser.parse_args(argv)
+    if args.variants > 1 and not args.auto:
+        parser.error("--variants requires --auto")
+    if args.store and (args.banks or args.watch):
+        parser.error("--store cannot be combined with --banks or --watch")
+    if not args.store and (args.marks or args.co or args.rbt):
+        parser.error("--marks, --co and --rbt filter the questions of a --store")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = Profiler(enabled=args.profile or args.profile_output is not None)
+    try:
+        run(args, profiler)
+    finally:
+        if profiler.enabled:
+            profiler.print_summary()
+            if args.profile_output:
+                profiler.write(args.profile_output, args.profile_format)
+                print(f"Profile written to {args.profile_output}")
+            profiler.stop()
+
+def run(args, profiler=NO_PROFILER):
+    """The interactive generator; profiler times its stages"""
     print("=" * 50)
     print("QUESTION PAPER GENERATOR")
     print("=" * 50)
@@ -100,185 +662,128 @@ def main():
     print("- Students choose between Q1 or Q2, and between Q3 or Q4")
     print("=" * 50)
     
-    # Get the question bank file
-    question_bank_path = select_file("Select a question bank file:")
-    if not question_bank_path:
-        print("No question bank file selected. Exiting.")
-        return
+    # Get the question bank file(s)
+    if args.store:
+        question_bank_paths = []
+    elif args.banks:
+        question_bank_paths = expand_bank_paths(args.banks)
+        if not question_bank_paths:
+            print(f"No .docx question banks found for '{args.banks}'. Exiting.")
+            return
+    else:
+        question_bank_path = select_file("Select a question bank file:")
+        if not question_bank_path:
+            print("No question bank file selected. Exiting.")
+            return
+        question_bank_paths = [question_bank_path]
     
-    # Load the question bank document
+    # Load the question bank documents
     try:
-        question_bank_doc = Document(question_bank_path)
-        raw_questions = [para.text.strip() for para in question_bank_doc.paragraphs if para.text.strip()]
-        
-        # Process questions to extract marks, CO, and RBT
-        all_questions = [extract_question_info(q) for q in raw_questions]
-        
-        # Filter out questions with no marks
-        all_questions = [q for q in all_questions if q["marks"] > 0]
+        if args.store:
+            # Map the store and build the bank from the matching rows only
+            with profiler.stage("load", args.store):
+                store = BankStore(args.store)
+            with profiler.stage("filter"):
+                bank = load_store_bank(store, args.marks, args.co, args.rbt, args.duplicates, args.similarity,
+                                       use_cache=not args.no_cache, cache_dir=args.cache_dir)
+            print(f"\nLoaded {len(bank)} of {len(store)} questions from {args.store}.")
+        else:
+            # Stream paragraphs, extract marks, CO, and RBT, and drop questions with no marks
+            questions = load_question_banks(question_bank_paths, args.workers, use_cache=not args.no_cache,
+                                            rebuild_cache=args.rebuild_cache, cache_dir=args.cache_dir,
+                                            profiler=profiler)
+            if len(question_bank_paths) > 1:
+                print(f"\nLoaded {len(questions)} questions from {len(question_bank_paths)} question banks.")
+            with profiler.stage("filter"):
+                bank = check_duplicates(QuestionBank(questions), args.duplicates, args.similarity,
+                                        use_cache=not args.no_cache, cache_dir=args.cache_dir)
         
     except Exception as e:
         print(f"Error loading question bank: {e}")
         input("Press Enter to exit...")
         return
     
-    # Display questions with marks
-    print("\nQuestion Bank:")
-    for idx, q in enumerate(all_questions, start=1):
-        print(f"{idx}. {q['question']} [{q['marks']} marks]")
-    
-    # Let the user choose questions for PART A (Q1)
-    print("\n" + "=" * 50)
-    print("PART A - Question 1 Selection")
-    print("=" * 50)
-    selected_A1 = input("Enter question numbers for Q1 (comma separated, total ~25 marks): ")
-    
-    # Convert input to indices (0-indexed)
-    try:
-        selected_A1_idx = [int(x.strip()) - 1 for x in selected_A1.split(',') if x.strip().isdigit()]
-        
-        # Check if indices are valid
-        invalid_indices = [i + 1 for i in selected_A1_idx if i < 0 or i >= len(all_questions)]
-        if invalid_indices:
-            print(f"Invalid question numbers: {', '.join(map(str, invalid_indices))}")
-            input("Press Enter to exit...")
+    # Questions used in the course's recent papers
+    course = args.course or course_name(args.store or args.banks or question_bank_paths[0])
+    last_used = {}
+    if not args.no_history and args.reuse != "allow":
+        try:
+            with profiler.stage("history"):
+                last_used = load_recent_usage(args.history, course, args.recent, bank)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not read the usage history ({e}); recently used questions are not checked.")
+        if last_used and args.reuse == "exclude":
+            excluded = exclude_recent(bank, last_used)
+            print(f"\nLeft out {excluded} question(s) used in {course} papers in the last {args.recent} days.")
+        elif last_used:
+            print(f"\n{len(last_used)} question(s) were used in {course} papers in the last {args.recent} days;"
+                  " they are marked (used DATE).")
+    
+    if args.auto:
+        with profiler.stage("select"):
+            if args.variants > 1:
+                papers = auto_select_variants(bank, args.variants, seed=args.seed, max_overlap=args.max_overlap,
+                                              last_used=last_used)
+            else:
+                blocks = auto_select_questions(bank, seed=args.seed, last_used=last_used)
+                papers = [blocks] if blocks is not None else None
+        if papers is None:
+            return
+        proceed = input("\nUse these questions? (y/n): ")
+        if proceed.lower() != 'y':
             return
-            
-        # Get selected questions for Part A - Q1
-        selected_A1_questions = [all_questions[i] for i in selected_A1_idx]
-        total_marks_A1 = sum(q["marks"] for q in selected_A1_questions)
+    else:
+        watchers = []
+        if args.watch:
+            # Imported here: watch.py builds on this module
+            from watch import BankWatcher
+            try:
+                watchers = [BankWatcher(bank, path) for path in question_bank_paths]
+            except Exception as e:
+                print(f"Cannot watch the question bank for edits ({e}); continuing without --watch.")
+                watchers = []
+        browser = None
+        if not args.full_list:
+            browser = QuestionBrowser(bank, args.page_size, refresh=lambda: refresh_banks(watchers),
+                                      show=lambda questions: print_questions(questions, bank, last_used))
         
-        print(f"\nSelected {len(selected_A1_questions)} questions for Q1, total marks: {total_marks_A1}")
-        if abs(total_marks_A1 - 25) > 5:
-            print(f"WARNING: Total marks for Q1 ({total_marks_A1}) is not close to 25.")
-            proceed = input("Do you want to continue anyway? (y/n): ")
-            if proceed.lower() != 'y':
-                return
-    except Exception as e:
-        print(f"Error processing question selection: {e}")
-        input("Press Enter to exit...")
-        return
-    
-    # Remove selected questions from the available pool for Q2
-    available_for_A2 = [q for i, q in enumerate(all_questions) if i not in selected_A1_idx]
-    
-    # Display remaining questions for Q2 selection
-    print("\nRemaining Questions for Q2:")
-    for idx, q in enumerate(available_for_A2, start=1):
-        print(f"{idx}. {q['question']} [{q['marks']} marks]")
-    
-    # Let the user choose questions for PART A (Q2)
-    print("\n" + "=" * 50)
-    print("PART A - Question 2 Selection")
-    print("=" * 50)
-    selected_A2 = input("Enter question numbers for Q2 (comma separated, total ~25 marks): ")
-    
-    # Convert input to indices (0-indexed in the available_for_A2 list)
-    try:
-        selected_A2_idx = [int(x.strip()) - 1 for x in selected_A2.split(',') if x.strip().isdigit()]
+        # Display questions with marks
+        show_remaining(bank, "Question Bank", watchers, browser, last_used)
         
-        # Check if indices are valid
-        invalid_indices = [i + 1 for i in selected_A2_idx if i < 0 or i >= len(available_for_A2)]
-        if invalid_indices:
-            print(f"Invalid question numbers: {', '.join(map(str, invalid_indices))}")
-            input("Press Enter to exit...")
+        # Let the user choose questions for PART A (Q1)
+        with profiler.stage("select", "Q1"):
+            selected_A1_questions = select_questions(bank, 1, "A", browser=browser)
+        if selected_A1_questions is None:
             return
-            
-        # Get selected questions for Part A - Q2
-        selected_A2_questions = [available_for_A2[i] for i in selected_A2_idx]
-        total_marks_A2 = sum(q["marks"] for q in selected_A2_questions)
         
-        print(f"\nSelected {len(selected_A2_questions)} questions for Q2, total marks: {total_marks_A2}")
-        if abs(total_marks_A2 - 25) > 5:
-            print(f"WARNING: Total marks for Q2 ({total_marks_A2}) is not close to 25.")
-            proceed = input("Do you want to continue anyway? (y/n): ")
-            if proceed.lower() != 'y':
-                return
-    except Exception as e:
-        print(f"Error processing question selection: {e}")
-        input("Press Enter to exit...")
-        return
-    
-    # Remove selected questions from the available pool for PART B
-    used_indices = selected_A1_idx + [selected_A1_idx[-1] + i + 1 for i in selected_A2_idx]
-    available_for_B = [q for i, q in enumerate(all_questions) if i not in used_indices]
-    
-    # Display remaining questions for PART B
-    print("\nRemaining Questions for PART B:")
-    for idx, q in enumerate(available_for_B, start=1):
-        print(f"{idx}. {q['question']} [{q['marks']} marks]")
-    
-    # Let the user choose questions for PART B (Q3)
-    print("\n" + "=" * 50)
-    print("PART B - Question 3 Selection")
-    print("=" * 50)
-    selected_B1 = input("Enter question numbers for Q3 (comma separated, total ~25 marks): ")
-    
-    # Convert input to indices (0-indexed in the available_for_B list)
-    try:
-        selected_B1_idx = [int(x.strip()) - 1 for x in selected_B1.split(',') if x.strip().isdigit()]
+        # Display remaining questions for Q2 selection
+        show_remaining(bank, "Remaining Questions for Q2", watchers, browser, last_used)
         
-        # Check if indices are valid
-        invalid_indices = [i + 1 for i in selected_B1_idx if i < 0 or i >= len(available_for_B)]
-        if invalid_indices:
-            print(f"Invalid question numbers: {', '.join(map(str, invalid_indices))}")
-            input("Press Enter to exit...")
+        # Let the user choose questions for PART A (Q2)
+        with profiler.stage("select", "Q2"):
+            selected_A2_questions = select_questions(bank, 2, "A", browser=browser)
+        if selected_A2_questions is None:
             return
-            
-        # Get selected questions for Part B - Q3
-        selected_B1_questions = [available_for_B[i] for i in selected_B1_idx]
-        total_marks_B1 = sum(q["marks"] for q in selected_B1_questions)
         
-        print(f"\nSelected {len(selected_B1_questions)} questions for Q3, total marks: {total_marks_B1}")
-        if abs(total_marks_B1 - 25) > 5:
-            print(f"WARNING: Total marks for Q3 ({total_marks_B1}) is not close to 25.")
-            proceed = input("Do you want to continue anyway? (y/n): ")
-            if proceed.lower() != 'y':
-                return
-    except Exception as e:
-        print(f"Error processing question selection: {e}")
-        input("Press Enter to exit...")
-        return
-    
-    # Remove selected questions from the available pool for Q4
-    available_for_B2 = [q for i, q in enumerate(available_for_B) if i not in selected_B1_idx]
-    
-    # Display remaining questions for Q4 selection
-    print("\nRemaining Questions for Q4:")
-    for idx, q in enumerate(available_for_B2, start=1):
-        print(f"{idx}. {q['question']} [{q['marks']} marks]")
-    
-    # Let the user choose questions for PART B (Q4)
-    print("\n" + "=" * 50)
-    print("PART B - Question 4 Selection")
-    print("=" * 50)
-    selected_B2 = input("Enter question numbers for Q4 (comma separated, total ~25 marks): ")
-    
-    # Convert input to indices (0-indexed in the available_for_B2 list)
-    try:
-        selected_B2_idx = [int(x.strip()) - 1 for x in selected_B2.split(',') if x.strip().isdigit()]
+        # Display remaining questions for PART B
+        show_remaining(bank, "Remaining Questions for PART B", watchers, browser, last_used)
         
-        # Check if indices are valid
-        invalid_indices = [i + 1 for i in selected_B2_idx if i < 0 or i >= len(available_for_B2)]
-        if invalid_indices:
-            print(f"Invalid question numbers: {', '.join(map(str, invalid_indices))}")
-            input("Press Enter to exit...")
+        # Let the user choose questions for PART B (Q3)
+        with profiler.stage("select", "Q3"):
+            selected_B1_questions = select_questions(bank, 3, "B", browser=browser)
+        if selected_B1_questions is None:
             return
-            
-        # Get selected questions for Part B - Q4
-        selected_B2_questions = [available_for_B2[i] for i in selected_B2_idx]
-        total_marks_B2 = sum(q["marks"] for q in selected_B2_questions)
         
-        print(f"\nSelected {len(selected_B2_questions)} questions for Q4, total marks: {total_marks_B2}")
-        if abs(total_marks_B2 - 25) > 5:
-            print(f"WARNING: Total marks for Q4 ({total_marks_B2}) is not close to 25.")
-            proceed = input("Do you want to continue anyway? (y/n): ")
-            if proceed.lower() != 'y':
-                return
-    except Exception as e:
-        print(f"Error processing question selection: {e}")
-        input("Press Enter to exit...")
-        return
+        # Display remaining questions for Q4 selection
+        show_remaining(bank, "Remaining Questions for Q4", watchers, browser, last_used)
+        
+        # Let the user choose questions for PART B (Q4)
+        with profiler.stage("select", "Q4"):
+            selected_B2_questions = select_questions(bank, 4, "B", browser=browser)
+        if selected_B2_questions is None:
+            return
+        papers = [[selected_A1_questions, selected_A2_questions,
+                   selected_B1_questions, selected_B2_questions]]
     
     # Get the template file
     template_path = select_file("Select a template file:")
@@ -286,127 +791,73 @@ def main():
         print("No template file selected. Exiting.")
         return
     
-    # Load the template DOCX file
+    # Load the template DOCX file and remove existing rows except the header row
     try:
-        template_doc = Document(template_path)
-        if not template_doc.tables:
-            print("Error: Template file does not contain a table.")
-            input("Press Enter to exit...")
-            return
-            
-        table = template_doc.tables[0]
+        with profiler.stage("load", template_path):
+            template = CompiledTemplate(template_path)
     except Exception as e:
         print(f"Error loading template: {e}")
         input("Press Enter to exit...")
         return
     
-    # Remove existing rows except the header row
-    try:
-        while len(table.rows) > 1:
-            table._tbl.remove(table.rows[1]._tr)
-    except Exception as e:
-        print(f"Error preparing template table: {e}")
-        input("Press Enter to exit...")
-        return
-    
-    # Function to add a merged header row to the table
-    def add_section_header(table, header_text):
-        row = table.add_row()
-        merged_cell = row.cells[0]
-        # Merge all cells in the row to create a section header
-        for cell in row.cells[1:]:
-            merged_cell = merged_cell.merge(cell)
-        merged_cell.text = header_text
-    
-    try:
-        # Add PART A section header
-        add_section_header(table, "PART A")
-        
-        # Add Question 1 with subparts
-        q1_label = "1"
-        for idx, q in enumerate(selected_A1_questions):
-            row_cells = table.add_row().cells
-            if idx == 0:
-                # First row of Q1
-                row_cells[0].text = q1_label
-            else:
-                # Subparts of Q1
-                row_cells[0].text = f"{q1_label}{chr(97+idx)}"
-            
-            row_cells[1].text = q["question"]
-            row_cells[2].text = str(q["marks"])
-            row_cells[3].text = q["co"]
-            row_cells[4].text = q["rbt"]
-        
-        # Add Question 2 with subparts
-        q2_label = "2"
-        for idx, q in enumerate(selected_A2_questions):
-            row_cells = table.add_row().cells
-            if idx == 0:
-                # First row of Q2
-                row_cells[0].text = q2_label
-            else:
-                # Subparts of Q2
-                row_cells[0].text = f"{q2_label}{chr(97+idx)}"
-            
-            row_cells[1].text = q["question"]
-            row_cells[2].text = str(q["marks"])
-            row_cells[3].text = q["co"]
-            row_cells[4].text = q["rbt"]
-        
-        # Add PART B section header
-        add_section_header(table, "PART B")
-        
-        # Add Question 3 with subparts
-        q3_label = "3"
-        for idx, q in enumerate(selected_B1_questions):
-            row_cells = table.add_row().cells
-            if idx == 0:
-                # First row of Q3
-                row_cells[0].text = q3_label
-            else:
-                # Subparts of Q3
-                row_cells[0].text = f"{q3_label}{chr(97+idx)}"
-            
-            row_cells[1].text = q["question"]
-            row_cells[2].text = str(q["marks"])
-            row_cells[3].text = q["co"]
-            row_cells[4].text = q["rbt"]
-        
-        # Add Question 4 with subparts
-        q4_label = "4"
-        for idx, q in enumerate(selected_B2_questions):
-            row_cells = table.add_row().cells
-            if idx == 0:
-                # First row of Q4
-                row_cells[0].text = q4_label
-            else:
-                # Subparts of Q4
-                row_cells[0].text = f"{q4_label}{chr(97+idx)}"
-            
-            row_cells[1].text = q["question"]
-            row_cells[2].text = str(q["marks"])
-            row_cells[3].text = q["co"]
-            row_cells[4].text = q["rbt"]
-        
-    except Exception as e:
-        print(f"Error creating question paper: {e}")
-        input("Press Enter to exit...")
-        return
-    
     # Get output filename
     output_filename = input("\nEnter the output filename (e.g., 'generated_question_paper.docx'): ")
     if not output_filename.endswith('.docx'):
         output_filename += '.docx'
+    if len(papers) > 1:
+        output_filenames = [variant_filename(output_filename, i) for i in range(len(papers))]
+    else:
+        output_filenames = [output_filename]
+    
+    # Read the chosen questions' paragraphs from their banks once, for every paper
+    formatted = None
+    if not args.plain_text:
+        # Imported here: transplant.py builds on this module
+        from transplant import FormattedQuestions
+        try:
+            with profiler.stage("render", "bank paragraphs"):
+                formatted = FormattedQuestions(q for blocks in papers for block in blocks for q in block)
+        except Exception as e:
+            print(f"Could not copy the questions' formatting from the bank ({e}); using plain text.")
     
-    # Save the generated question paper
-    try:
-        template_doc.save(output_filename)
-        print(f"\nQuestion paper saved as: {os.path.abspath(output_filename)}")
-    except Exception as e:
-        print(f"Error saving question paper: {e}")
-        input("Press Enter to exit...")
-        return
+    for output_filename, blocks in zip(output_filenames, papers):
+        paragraphs = formatted and formatted.paragraphs
+        try:
+            with profiler.stage("render", output_filename):
+                template_doc, table = template.new_paper()
+                fill_paper_table(table, blocks, template.renderer(table, paragraphs))
+                documents = [template_doc]
+                if args.companions:
+                    # Built from the same selection and template, not from the saved paper
+                    summary = PaperSummary(blocks, PAPER_LAYOUT)
+                    documents += [render_marking_scheme(template, summary, paragraphs),
+                                  render_summary(template, summary)]
+        except Exception as e:
+            print(f"Error creating question paper: {e}")
+            input("Press Enter to exit...")
+            return
+        
+        # Save the generated question paper, and its companions alongside it
+        outputs = [output_filename] + (list(companion_filenames(output_filename)) if args.companions else [])
+        try:
+            with profiler.stage("save", output_filename):
+                additions = formatted.package(q for block in blocks for q in block) if formatted else None
+                # The summary has no question paragraphs, so it needs no added parts
+                template.save_many(zip(documents, outputs, [additions, additions, None]))
+            print(f"\nQuestion paper saved as: {os.path.abspath(output_filename)}")
+            for companion in outputs[1:]:
+                print(f"Companion document saved as: {os.path.abspath(companion)}")
+        except Exception as e:
+            print(f"Error saving question paper: {e}")
+            input("Press Enter to exit...")
+            return
+        
+        # Remember the paper's questions so later papers can avoid them
+        if not args.no_history:
+            try:
+                record_usage(args.history, course, output_filename, blocks)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Could not record the paper in the usage history: {e}")
     
     print("\nQuestion paper generation complete!")
     input("Press Enter to exit...")
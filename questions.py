@@ -0,0 +1,259 @@
+"""
+Question model and an indexed question bank.
+
+Questions get a stable integer id (their position in the bank). The bank keeps
+indexes by marks, CO and RBT, and tracks which questions are still available with
+a bytearray bitset, so selecting questions never copies the remaining pool.
+
+Near-duplicate questions (see duplicates.py) can be grouped into clusters; taking
+any member of a cluster makes the whole cluster unavailable, so one paper never
+gets two versions of the same question.
+
+Questions can also be removed (when their paragraph is edited or deleted from the
+bank); a removed id is never reused and stays unavailable, so the ids of the other
+questions do not change.
+"""
+import bank_cache
+from duplicates import DEFAULT_THRESHOLD, duplicate_groups, find_duplicate_clusters
+
+class Question:
+    """
+    A single question with its metadata. source is the bank file it came from and
+    paragraph its 1-based paragraph number there, when known.
+    """
+    __slots__ = ("id", "question", "marks", "co", "rbt", "source", "paragraph")
+
+    def __init__(self, id, question, marks, co, rbt, source=None, paragraph=None):
+        self.id = id
+        self.question = question
+        self.marks = marks
+        self.co = co
+        self.rbt = rbt
+        self.source = source
+        self.paragraph = paragraph
+
+    def __repr__(self):
+        return f"Question({self.id}, {self.question!r}, marks={self.marks}, co={self.co!r}, rbt={self.rbt!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Question):
+            return NotImplemented
+        return (self.id, self.question, self.marks, self.co, self.rbt) == \
+            (other.id, other.question, other.marks, other.co, other.rbt)
+
+    __hash__ = None
+
+    def to_dict(self):
+        d = {"question": self.question, "marks": self.marks, "co": self.co, "rbt": self.rbt}
+        if self.source is not None:
+            d["source"] = self.source
+        if self.paragraph is not None:
+            d["paragraph"] = self.paragraph
+        return d
+
+
+# Availability bitset values
+_FREE, _TAKEN, _REMOVED = 0, 1, 2
+# reset() frees taken questions but keeps removed ones removed
+_RESET_TABLE = bytes.maketrans(bytes((_TAKEN,)), bytes((_FREE,)))
+
+
+def _add_to_index(index, key, qid):
+    ids = index.get(key)
+    if ids is None:
+        index[key] = [qid]
+    else:
+        ids.append(qid)
+
+
+class QuestionBank:
+    """
+    Questions indexed by marks, CO, RBT and source file, with availability tracking.
+    Question ids run from 0 to len(bank) - 1; index lists are kept in id order.
+    """
+
+    def __init__(self, questions=()):
+        self.questions = []
+        self.by_marks = {}
+        self.by_co = {}
+        self.by_rbt = {}
+        self.by_source = {}
+        self._used = bytearray()
+        self._used_count = 0
+        self._removed_count = 0
+        # Cluster representative (lowest id) of every question, and the members of
+        # every cluster with more than one question
+        self.clusters = []
+        self._cluster_members = {}
+        for q in questions:
+            self.add(q["question"], q["marks"], q["co"], q["rbt"], q.get("source"), q.get("paragraph"))
+
+    def add(self, question, marks, co, rbt, source=None, paragraph=None):
+        """Append a question and return it"""
+        return self.append(Question(len(self.questions), question, marks, co, rbt, source, paragraph))
+
+    def append(self, q):
+        """Append a Question (or subclass) whose id is len(bank) and return it"""
+        self.questions.append(q)
+        self._used.append(0)
+        self.clusters.append(q.id)
+        _add_to_index(self.by_marks, q.marks, q.id)
+        _add_to_index(self.by_co, q.co, q.id)
+        _add_to_index(self.by_rbt, q.rbt, q.id)
+        _add_to_index(self.by_source, q.source, q.id)
+        return q
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __iter__(self):
+        return iter(self.questions)
+
+    def __getitem__(self, qid):
+        return self.questions[qid]
+
+    def is_available(self, qid):
+        return 0 <= qid < len(self.questions) and not self._used[qid]
+
+    def take(self, qids):
+        """
+        Mark questions as used, along with their near-duplicates; raises ValueError
+        if any is unknown, already used, or a near-duplicate of another in qids
+        """
+        qids = list(qids)
+        unavailable = [qid for qid in qids if not self.is_available(qid)]
+        if unavailable or len(set(qids)) != len(qids):
+            raise ValueError(f"Questions not available: {unavailable or qids}")
+        if len({self.clusters[qid] for qid in qids}) != len(qids):
+            raise ValueError(f"Questions are near-duplicates of each other: {qids}")
+        for qid in qids:
+            for member in self.cluster_members(qid):
+                if self._used[member] == _FREE:
+                    self._used[member] = _TAKEN
+                    self._used_count += 1
+
+    def release(self, qids):
+        """Make previously taken questions (and their near-duplicates) available again"""
+        for qid in qids:
+            for member in self.cluster_members(qid):
+                if self._used[member] == _TAKEN:
+                    self._used[member] = _FREE
+                    self._used_count -= 1
+
+    def reset(self):
+        self._used = self._used.translate(_RESET_TABLE)
+        self._used_count = 0
+
+    def remove(self, qids):
+        """
+        Remove questions from the bank for good: they leave the indexes and their
+        near-duplicate clusters and are never available again. Other ids are unchanged.
+        """
+        for qid in qids:
+            if self._used[qid] == _REMOVED:
+                continue
+            if self._used[qid] == _TAKEN:
+                self._used_count -= 1
+            self._used[qid] = _REMOVED
+            self._removed_count += 1
+            q = self.questions[qid]
+            for index, key in ((self.by_marks, q.marks), (self.by_co, q.co),
+                               (self.by_rbt, q.rbt), (self.by_source, q.source)):
+                ids = index[key]
+                ids.remove(qid)
+                if not ids:
+                    del index[key]
+            self._leave_cluster(qid)
+
+    def is_removed(self, qid):
+        return self._used[qid] == _REMOVED
+
+    def _leave_cluster(self, qid):
+        root = self.clusters[qid]
+        members = self._cluster_members.pop(root, None)
+        self.clusters[qid] = qid
+        if members is None:
+            return
+        rest = [member for member in members if member != qid]
+        # The lowest remaining id represents what is left of the cluster
+        for member in rest:
+            self.clusters[member] = rest[0]
+        if len(rest) > 1:
+            self._cluster_members[rest[0]] = rest
+
+    def cluster_members(self, qid):
+        """Ids of the question's near-duplicate cluster, itself included"""
+        return self._cluster_members.get(self.clusters[qid], (qid,))
+
+    def mark_duplicates(self, threshold=DEFAULT_THRESHOLD, use_cache=False, cache_dir=None):
+        """
+        Find near-duplicate questions and cluster them; returns the clusters with
+        more than one member, as lists of ids. Call before taking any questions.
+        With use_cache, clusters found before for the same texts are reused (see bank_cache).
+        """
+        find = find_duplicate_clusters
+        if use_cache:
+            find = lambda texts, threshold: bank_cache.load_cached_clusters(texts, threshold, cache_dir)
+        if not self._removed_count:
+            return self.set_clusters(find([q.question for q in self.questions], threshold))
+        # Removed questions stay on their own
+        live = [q.id for q in self.questions if not self.is_removed(q.id)]
+        clusters = list(range(len(self.questions)))
+        roots = find([self.questions[qid].question for qid in live], threshold)
+        for qid, root in zip(live, roots):
+            clusters[qid] = live[root]
+        return self.set_clusters(clusters)
+
+    def set_clusters(self, clusters):
+        """
+        Use near-duplicate clusters found beforehand (e.g. stored with the bank): the
+        lowest id of its cluster for every question, as find_duplicate_clusters() returns.
+        Returns the clusters with more than one member, like mark_duplicates().
+        """
+        self.clusters = list(clusters)
+        groups = duplicate_groups(self.clusters)
+        self._cluster_members = {ids[0]: ids for ids in groups}
+        return groups
+
+    def without_duplicates(self):
+        """A new bank keeping only the first question of every near-duplicate cluster"""
+        return QuestionBank(q.to_dict() for q in self.questions
+                            if self.clusters[q.id] == q.id and not self.is_removed(q.id))
+
+    def available_count(self):
+        return len(self.questions) - self._used_count - self._removed_count
+
+    def _candidate_ids(self, marks, co, rbt):
+        """Ids matching the filters from the smallest matching index, or None for all"""
+        lists = []
+        if marks is not None:
+            lists.append(self.by_marks.get(marks, ()))
+        if co is not None:
+            lists.append(self.by_co.get(co, ()))
+        if rbt is not None:
+            lists.append(self.by_rbt.get(rbt, ()))
+        if not lists:
+            return None
+        lists.sort(key=len)
+        if len(lists) == 1:
+            return lists[0]
+        others = [set(ids) for ids in lists[1:]]
+        return [qid for qid in lists[0] if all(qid in s for s in others)]
+
+    def available(self, marks=None, co=None, rbt=None):
+        """Iterate available questions in id order, optionally filtered by marks, CO and RBT"""
+        used = self._used
+        questions = self.questions
+        candidates = self._candidate_ids(marks, co, rbt)
+        if candidates is None:
+            return (q for q in questions if not used[q.id])
+        return (questions[qid] for qid in candidates if not used[qid])
+
+    def available_distinct(self):
+        """Available questions with only the first available member of each near-duplicate cluster"""
+        if not self._cluster_members:
+            return self.available()
+        clusters = self.clusters
+        seen = set()
+        return (q for q in self.available()
+                if clusters[q.id] not in seen and not seen.add(clusters[q.id]))
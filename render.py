@@ -0,0 +1,202 @@
+"""
+Fast rendering of question rows into the paper table.
+
+python-docx's table.add_row() followed by cell.text re-walks the table grid on
+every .cells access. TableRenderer instead builds one question row and one merged
+section-header row through python-docx (so their XML is exactly what add_row,
+merge and cell.text produce), keeps them as skeletons, and deep-copies a skeleton
+for every new row, writing the text straight into its <w:t> elements.
+
+CompiledTemplate goes one step further for batches: it parses a template once,
+remembers where the paper table sits, and hands out deep copies of the cleared
+document tree instead of re-reading the zip and XML for every paper.
+
+Given prepared bank paragraphs (see transplant.py), the question cell gets a copy of
+the question's own runs instead of its plain text, keeping the cell's paragraph
+properties.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+from docx import Document
+from docx.document import Document as DocumentObject
+from docx.oxml.ns import qn
+from docx.table import Table
+
+from docx_writer import read_template_members, save_document
+
+W_T = qn("w:t")
+W_TC = qn("w:tc")
+W_P = qn("w:p")
+W_PPR = qn("w:pPr")
+XML_SPACE = qn("xml:space")
+
+# Placeholder written into skeleton cells so each one gets its own run and <w:t>
+_PLACEHOLDER = "x"
+
+
+def _set_run_text(t, text):
+    """Set the text of a skeleton <w:t>, producing the XML that Run.text = text would"""
+    if not text or "\t" in text or "\n" in text or "\r" in text:
+        # Empty text has no <w:t>, and tabs/breaks become their own run children;
+        # leave those cases to python-docx's run text setter
+        t.getparent().text = text
+        return
+    t.text = text
+    if len(text.strip()) < len(text):
+        t.set(XML_SPACE, "preserve")
+
+
+def _transplant(tr, column, paragraph):
+    """Replace the content of a row cell's paragraph with a copy of a prepared bank paragraph's"""
+    p = tr.findall(W_TC)[column].find(W_P)
+    for child in list(p):
+        if child.tag != W_PPR:
+            p.remove(child)
+    p.extend(list(deepcopy(paragraph)))
+
+
+class TableRenderer:
+    """
+    Append question and section-header rows to a python-docx table by cloning row XML.
+    paragraphs optionally maps question ids to prepared bank paragraphs for the question column.
+    """
+
+    QUESTION_COLUMN = 1
+
+    def __init__(self, table, skeleton_rows=None, paragraphs=None):
+        self._tbl = table._tbl
+        self.column_count = len(self._tbl.tblGrid.gridCol_lst)
+        self.paragraphs = paragraphs or {}
+        if skeleton_rows is not None:
+            # Rows already built for an identical table, e.g. by CompiledTemplate
+            self._question_row, self._header_row = skeleton_rows
+            return
+
+        row = table.add_row()
+        for cell in row.cells:
+            cell.text = _PLACEHOLDER
+        self._question_row = row._tr
+
+        header = table.add_row()
+        merged_cell = header.cells[0]
+        for cell in header.cells[1:]:
+            merged_cell = merged_cell.merge(cell)
+        merged_cell.text = _PLACEHOLDER
+        self._header_row = header._tr
+
+        self._tbl.remove(self._question_row)
+        self._tbl.remove(self._header_row)
+
+    @property
+    def skeleton_rows(self):
+        return self._question_row, self._header_row
+
+    def add_row(self, texts):
+        """Append a question row with one text per column"""
+        tr = deepcopy(self._question_row)
+        # Fill in document order; replacing a <w:t> would disturb the iteration
+        for t, text in zip(list(tr.iter(W_T)), texts):
+            _set_run_text(t, text)
+        self._tbl.append(tr)
+        return tr
+
+    def add_section_header(self, header_text):
+        """Append a row merged across all columns holding header_text"""
+        tr = deepcopy(self._header_row)
+        _set_run_text(next(tr.iter(W_T)), header_text)
+        self._tbl.append(tr)
+        return tr
+
+    def add_question_rows(self, number, questions):
+        """Add one question number with its subparts (1, 1b, 1c, ...)"""
+        label = str(number)
+        for idx, q in enumerate(questions):
+            tr = self.add_row((label if idx == 0 else f"{label}{chr(97+idx)}",
+                               q.question, str(q.marks), q.co, q.rbt))
+            paragraph = self.paragraphs.get(q.id)
+            if paragraph is not None:
+                _transplant(tr, self.QUESTION_COLUMN, paragraph)
+
+
+def clear_table(table):
+    """Remove every row of a python-docx table except the header row"""
+    tbl = table._tbl
+    for tr in tbl.tr_lst[1:]:
+        tbl.remove(tr)
+
+
+class CompiledTemplate:
+    """
+    A template parsed once and reusable for any number of papers.
+
+    new_paper() returns a document whose body is a fresh copy of the template with
+    its first table cleared down to the header row. The copies share the template's
+    package (styles, media, relationships ...), so a paper that adds relationships
+    through python-docx must be saved before the next new_paper() call on the same
+    CompiledTemplate. save() and save_many() write papers by copying the template's
+    other zip members verbatim.
+    """
+
+    def __init__(self, template_path):
+        self.path = template_path
+        document = Document(template_path)
+        if not document.tables:
+            raise ValueError("Template file does not contain a table.")
+        table = document.tables[0]
+        clear_table(table)
+
+        self._part = document.part
+        self._members = read_template_members(template_path)
+        self._relationships = {(rId, rel.reltype, rel.target_ref) for rId, rel in self._part.rels.items()}
+        body = document.element.body
+        # Where the paper table and its header row sit in the body
+        self.table_index = body.index(table._tbl)
+        rows = table._tbl.tr_lst
+        self.header_row_index = table._tbl.index(rows[0]) if rows else None
+        self._skeleton = deepcopy(document.element)
+        # Prebuild the row skeletons once, on a scratch copy of the table
+        self._skeleton_rows = TableRenderer(Table(deepcopy(table._tbl), document)).skeleton_rows
+
+    def new_paper(self):
+        """Return (document, table) for a new paper built on a copy of the cleared template"""
+        element = deepcopy(self._skeleton)
+        self._part._element = element
+        document = DocumentObject(element, self._part)
+        table = Table(element.body[self.table_index], document)
+        return document, table
+
+    def renderer(self, table, paragraphs=None):
+        """A TableRenderer for a table from new_paper(), reusing the prebuilt rows"""
+        return TableRenderer(table, self._skeleton_rows, paragraphs)
+
+    def save(self, document, output, additions=None):
+        """
+        Save a paper from new_paper() to output (a path or binary file object), adding
+        the parts in additions (PackageAdditions) if given
+        """
+        # The document.save() fallback writes the part's element, so point it at this paper
+        self._part._element = document.element
+        save_document(document, self._members, output, self._relationships, additions)
+
+    def save_many(self, papers):
+        """
+        Save several (document, output, additions) papers from new_paper(), e.g. a paper
+        and its companion documents. While the document part keeps the template's
+        relationships, save_document() only serializes each paper's own tree and copies
+        the template's members, so the papers are written on a thread pool (deflating
+        and writing release the GIL); otherwise they are saved one after another.
+        """
+        papers = list(papers)
+        current = {(rId, rel.reltype, rel.target_ref) for rId, rel in self._part.rels.items()}
+        workers = min(len(papers), os.cpu_count() or 1)
+        if workers < 2 or current != self._relationships:
+            for document, output, additions in papers:
+                self.save(document, output, additions)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(save_document, document, self._members, output, self._relationships, additions)
+                       for document, output, additions in papers]
+            for future in futures:
+                future.result()
@@ -0,0 +1,440 @@
+"""
+Automatic question selection with exact mark balancing.
+
+Each question block (Q1-Q4) is solved as a bounded subset-sum over "buckets" of
+interchangeable questions: questions with the same marks that satisfy the same
+required CO/RBT tags. Reachable sums are kept as Python int bitsets per
+(part count, covered-tags mask) state, so the work depends on the number of distinct
+buckets and the target, not on the size of the bank.
+
+Blocks are solved one after another and take their questions from the bank. If a
+later block cannot hit its target exactly, the blocks are retried in other orders
+and with shuffled tie-breaking until the time budget runs out, keeping the best
+paper found so far.
+
+Selection can be given penalties, e.g. the date each question was last used in a
+paper: among interchangeable questions the least penalized are picked first, and
+select_paper first tries to build the paper from unpenalized questions alone.
+"""
+import heapq
+import random
+import time
+
+class SelectionError(Exception):
+    """Raised when a block's constraints cannot be met by the available questions"""
+
+
+class BlockSpec:
+    """
+    Rules for one question block.
+
+    target: marks the block should add up to
+    required_cos / required_rbts: every listed CO / RBT level must appear in the block
+    allowed_cos / allowed_rbts: when given, only questions with these values are used
+    min_parts / max_parts: bounds on the number of subparts (a, b, c, ...)
+    """
+
+    def __init__(self, target=25, required_cos=(), required_rbts=(), allowed_cos=None,
+                 allowed_rbts=None, min_parts=1, max_parts=None):
+        self.target = target
+        self.required_cos = tuple(required_cos)
+        self.required_rbts = tuple(required_rbts)
+        self.allowed_cos = set(allowed_cos) if allowed_cos is not None else None
+        self.allowed_rbts = set(allowed_rbts) if allowed_rbts is not None else None
+        self.min_parts = min_parts
+        self.max_parts = max_parts
+
+    @classmethod
+    def from_dict(cls, rules):
+        return cls(**rules)
+
+    def allows(self, q):
+        return ((self.allowed_cos is None or q.co in self.allowed_cos) and
+                (self.allowed_rbts is None or q.rbt in self.allowed_rbts))
+
+
+def _required_bits(spec):
+    """Map each required (field, value) pair to a bit of the coverage mask"""
+    bits = {}
+    for co in spec.required_cos:
+        bits.setdefault(("co", co), 1 << len(bits))
+    for rbt in spec.required_rbts:
+        bits.setdefault(("rbt", rbt), 1 << len(bits))
+    return bits
+
+def _buckets(questions, spec, bits):
+    """Group usable questions by (marks, coverage bits)"""
+    buckets = {}
+    for q in questions:
+        if q.marks <= 0 or not spec.allows(q):
+            continue
+        mask = bits.get(("co", q.co), 0) | bits.get(("rbt", q.rbt), 0)
+        key = (q.marks, mask)
+        members = buckets.get(key)
+        if members is None:
+            buckets[key] = [q]
+        else:
+            members.append(q)
+    return buckets
+
+def solve_block(questions, spec, rng=None, penalties=None):
+    """
+    Pick questions for one block whose marks hit spec.target exactly, or as close
+    as possible, while covering the required COs/RBT levels.
+    penalties ({question id: number}, missing ids count as 0) decides which of
+    several interchangeable questions are used: the lowest first.
+    Returns the chosen questions; raises SelectionError if no valid block exists.
+    """
+    bits = _required_bits(spec)
+    full_mask = (1 << len(bits)) - 1
+    buckets = _buckets(questions, spec, bits)
+    if not buckets:
+        raise SelectionError("No questions match the block's constraints")
+
+    # Sums above the cap can never be the closest answer: an over-target block either
+    # has no droppable question (so at most one per required tag or min_parts of them)
+    # or is less than one question's marks over the target
+    max_marks = max(marks for marks, _ in buckets)
+    cap = max(spec.target + max_marks, max(len(bits), spec.min_parts) * max_marks)
+    sum_mask = (1 << (cap + 1)) - 1
+    # Part counts are only tracked when the spec bounds them
+    track_parts = spec.max_parts is not None or spec.min_parts > 1
+    if not track_parts:
+        max_parts = 0
+    elif spec.max_parts is not None:
+        max_parts = spec.max_parts
+    else:
+        max_parts = cap // min(marks for marks, _ in buckets)
+
+    # Sorted for determinism; members stay in bank order unless rng picks among them
+    bucket_list = sorted(buckets.items(), key=lambda item: item[0])
+
+    # states: {(parts, mask): bitset of reachable sums}; layers[i] is before bucket i
+    states = {(0, 0): 1}
+    layers = []
+    for (marks, mask), members in bucket_list:
+        layers.append(states)
+        limit = min(len(members), cap // marks)
+        if track_parts:
+            limit = min(limit, max_parts)
+        new_states = dict(states)
+        for (parts, covered), reach in states.items():
+            new_covered = covered | mask
+            for k in range(1, limit + 1):
+                new_parts = parts + k if track_parts else 0
+                if new_parts > max_parts:
+                    break
+                shifted = (reach << (k * marks)) & sum_mask
+                if not shifted:
+                    break
+                key = (new_parts, new_covered)
+                new_states[key] = new_states.get(key, 0) | shifted
+        states = new_states
+
+    # Choose the final state: full coverage, then closest to target, then fewer marks
+    best = None
+    for (parts, covered), reach in states.items():
+        if covered != full_mask or (track_parts and parts < spec.min_parts):
+            continue
+        for total in _set_bits(reach):
+            if total == 0:
+                continue
+            rank = (abs(total - spec.target), total > spec.target)
+            if best is None or rank < best[0]:
+                best = (rank, parts, total)
+    if best is None:
+        raise SelectionError("The available questions cannot cover the block's required CO/RBT levels")
+
+    _, parts, total = best
+    chosen = _reconstruct(bucket_list, layers, parts, full_mask, total, track_parts, rng, penalties)
+    if not track_parts and len(chosen) < spec.min_parts:
+        raise SelectionError(f"Could not find at least {spec.min_parts} parts for the block")
+    return chosen
+
+def _set_bits(value):
+    total = 0
+    while value:
+        if value & 1:
+            yield total
+        value >>= 1
+        total += 1
+
+def _covered_before(covered, mask):
+    """All masks c with c | mask == covered"""
+    base = covered & ~mask
+    sub = mask
+    while True:
+        yield base | sub
+        if not sub:
+            return
+        sub = (sub - 1) & mask
+
+def _pick_members(members, k, rng, penalties):
+    """k questions of a bucket: the first k, a random k with rng, the least penalized with penalties"""
+    if not penalties:
+        return rng.sample(members, k) if rng is not None else members[:k]
+    if rng is not None:
+        members = rng.sample(members, len(members))
+    # Stable, so equal penalties keep bank (or shuffled) order
+    return heapq.nsmallest(k, members, key=lambda q: penalties.get(q.id, 0))
+
+def _reconstruct(bucket_list, layers, parts, covered, total, track_parts, rng=None, penalties=None):
+    """Walk the DP layers backwards to recover which questions give the final state"""
+    chosen = []
+    for i in range(len(bucket_list) - 1, -1, -1):
+        (marks, mask), members = bucket_list[i]
+        before = layers[i]
+        most = min(len(members), total // marks)
+        if track_parts:
+            most = min(most, parts)
+        # Buckets are walked from the highest marks down, so trying the largest count
+        # first gives blocks of fewer, bigger questions rather than many 2-mark parts
+        for k in range(most, -1, -1):
+            prev_total = total - k * marks
+            prev_parts = parts - k if track_parts else 0
+            if k == 0:
+                candidates = (covered,)
+            elif covered & mask == mask:
+                # Any of the bucket's bits may already have been covered before it
+                candidates = _covered_before(covered, mask)
+            else:
+                continue
+            found = next((c for c in candidates
+                          if (before.get((prev_parts, c), 0) >> prev_total) & 1), None)
+            if found is not None:
+                if k:
+                    chosen.extend(_pick_members(members, k, rng, penalties))
+                total, parts, covered = prev_total, prev_parts, found
+                break
+    chosen.sort(key=lambda q: q.id)
+    return chosen
+
+def select_paper(bank, specs, time_budget=0.05, seed=None, penalties=None):
+    """
+    Pick disjoint question sets for every block spec from the bank's available questions.
+    Returns one list of questions per spec and takes them from the bank.
+    Retries other block orders within time_budget seconds when a block misses its
+    target, and keeps the paper with the smallest total deviation.
+    With penalties, a paper made only of unpenalized questions is used if every
+    block hits its target; otherwise penalized questions are used where needed.
+    """
+    # One question per near-duplicate cluster, so no paper can get two of them
+    questions = list(bank.available_distinct())
+    blocks = None
+    if penalties:
+        fresh = [q for q in questions if not penalties.get(q.id)]
+        try:
+            blocks = solve_paper(fresh, specs, time_budget, seed)
+        except SelectionError:
+            pass
+        if blocks is not None and not all(sum(q.marks for q in block) == spec.target
+                                          for block, spec in zip(blocks, specs)):
+            blocks = None
+    if blocks is None:
+        blocks = solve_paper(questions, specs, time_budget, seed, penalties)
+    for block in blocks:
+        bank.take(q.id for q in block)
+    return blocks
+
+def solve_paper(questions, specs, time_budget=0.05, seed=None, penalties=None):
+    """select_paper() over a list of questions, without taking anything from a bank"""
+    rng = random.Random(seed)
+    deadline = time.perf_counter() + time_budget
+    order = list(range(len(specs)))
+    best = None
+    error = None
+    attempt = 0
+    while True:
+        # Without a seed the first attempt keeps bank order, so results are stable
+        shuffle_rng = rng if seed is not None or attempt else None
+        try:
+            blocks = _select_in_order(questions, specs, order, shuffle_rng, penalties)
+        except SelectionError as e:
+            error = e
+            blocks = None
+        if blocks is not None:
+            deviation = sum(abs(sum(q.marks for q in block) - spec.target)
+                            for block, spec in zip(blocks, specs))
+            if best is None or deviation < best[0]:
+                best = (deviation, blocks)
+            if deviation == 0:
+                break
+        attempt += 1
+        if time.perf_counter() >= deadline:
+            break
+        rng.shuffle(order)
+
+    if best is None:
+        raise error
+    return best[1]
+
+def _select_in_order(questions, specs, order, rng, penalties=None):
+    """Solve blocks in the given order, each from the questions the others left"""
+    taken = set()
+    blocks = [None] * len(specs)
+    for i in order:
+        pool = [q for q in questions if q.id not in taken] if taken else questions
+        block = solve_block(pool, specs[i], rng, penalties)
+        taken.update(q.id for q in block)
+        blocks[i] = block
+    return blocks
+
+def select_variants(bank, specs, count, seed=None, max_overlap=0, time_budget=0.05, penalties=None):
+    """
+    Pick `count` equivalent papers (sets A, B, C, ...) in one pass.
+
+    The first variant is solved normally. Every other variant mirrors it slot by
+    slot: each question is replaced by an unused one with the same marks, CO and
+    RBT level, relaxing RBT and then CO only when the bank runs out and the spec
+    does not require that value. Marks per block therefore always match.
+    max_overlap is the most questions any two variants may share (0: none); the
+    members of a near-duplicate cluster count as one question.
+    With penalties, the least penalized matching question fills each slot.
+    Deterministic for a given seed. Returns one list of blocks per variant and takes
+    every used question from the bank.
+    """
+    rng = random.Random(seed)
+    available = list(bank.available())
+    reference = _reference_paper(list(bank.available_distinct()), specs, count, seed, time_budget, penalties)
+    cluster = bank.clusters
+
+    rng.shuffle(available)
+    if penalties:
+        available.sort(key=lambda q: penalties.get(q.id, 0))
+    pools = ({}, {}, {})
+    for q in available:
+        for level, key in enumerate(_slot_keys(q)):
+            pools[level].setdefault(key, []).append(q)
+    cursors = ({}, {}, {})
+    # users maps each used cluster to the variants using it
+    users = {}
+    used = []
+    overlaps = [[0] * count for _ in range(count)]
+
+    def use(q, variant):
+        key = cluster[q.id]
+        if key not in users:
+            used.append(q.id)
+        for other in users.setdefault(key, []):
+            overlaps[variant][other] += 1
+            overlaps[other][variant] += 1
+        users[key].append(variant)
+
+    protected = ({co for spec in specs for co in spec.required_cos},
+                 {rbt for spec in specs for rbt in spec.required_rbts})
+    variants = [reference]
+    for block in reference:
+        for q in block:
+            use(q, 0)
+
+    for variant in range(1, count):
+        in_variant = set()
+        blocks = []
+        for spec, ref_block in zip(specs, reference):
+            block = []
+            for ref in ref_block:
+                q = _pick_unused(pools, cursors, cluster, users, in_variant, ref, spec, protected)
+                if q is None and max_overlap:
+                    q = _pick_shared(pools, cluster, users, overlaps, in_variant, ref, spec,
+                                     variant, max_overlap)
+                if q is None:
+                    raise SelectionError(f"Not enough matching questions for {count} variants "
+                                         f"(ran out at set {variant + 1}, {ref.marks}-mark {ref.co}/{ref.rbt} question)")
+                use(q, variant)
+                in_variant.add(cluster[q.id])
+                block.append(q)
+            block.sort(key=lambda q: q.id)
+            blocks.append(block)
+        variants.append(blocks)
+
+    # Taking a question also takes its near-duplicates, which may have been used
+    # by other variants
+    for qid in used:
+        if bank.is_available(qid):
+            bank.take([qid])
+    return variants
+
+def _reference_paper(questions, specs, count, seed, time_budget, penalties=None):
+    """
+    Solve the first variant, preferring questions whose marks and CO are common
+    enough for every variant to get its own copy of each slot, and falling back to
+    the whole bank.
+    """
+    pool_sizes = {}
+    for q in questions:
+        key = (q.marks, q.co)
+        pool_sizes[key] = pool_sizes.get(key, 0) + 1
+
+    def fits(blocks):
+        slots = {}
+        for block in blocks:
+            for q in block:
+                slots[(q.marks, q.co)] = slots.get((q.marks, q.co), 0) + 1
+        return all(pool_sizes[key] >= n * count for key, n in slots.items())
+
+    # Raise the bar while a key is needed by several slots of the reference
+    for share in range(1, 4):
+        abundant = [q for q in questions if pool_sizes[(q.marks, q.co)] >= share * count]
+        try:
+            blocks = solve_paper(abundant, specs, time_budget, seed, penalties)
+        except SelectionError:
+            break
+        exact = all(sum(q.marks for q in block) == spec.target for block, spec in zip(blocks, specs))
+        if not exact:
+            break
+        if fits(blocks):
+            return blocks
+    return solve_paper(questions, specs, time_budget, seed, penalties)
+
+def _slot_keys(q):
+    """Keys from the strictest to the loosest profile match"""
+    return (q.marks, q.co, q.rbt), (q.marks, q.co), q.marks
+
+def _relaxable(level, ref, spec):
+    """Whether a slot may drop the reference's RBT (level 1) or CO and RBT (level 2)"""
+    if level >= 1 and ref.rbt in spec.required_rbts:
+        return False
+    if level >= 2 and ref.co in spec.required_cos:
+        return False
+    return True
+
+def _pick_unused(pools, cursors, cluster, users, in_variant, ref, spec, protected):
+    """The next never-used question matching ref's profile as closely as allowed"""
+    for level, key in enumerate(_slot_keys(ref)):
+        if not _relaxable(level, ref, spec):
+            break
+        pool = pools[level].get(key, ())
+        i = cursors[level].get(key, 0)
+        # Used questions are skipped for good, so the cursor only moves forward
+        while i < len(pool) and cluster[pool[i].id] in users:
+            i += 1
+        cursors[level][key] = i
+        fallback = None
+        for q in pool[i:]:
+            if cluster[q.id] in users or cluster[q.id] in in_variant or not spec.allows(q):
+                continue
+            if level and _takes_protected(q, ref, level, protected):
+                # Keep questions other blocks need for their required CO/RBT levels
+                fallback = fallback or q
+                continue
+            return q
+        if fallback is not None:
+            return fallback
+    return None
+
+def _takes_protected(q, ref, level, protected):
+    protected_cos, protected_rbts = protected
+    return (q.rbt != ref.rbt and q.rbt in protected_rbts or
+            level >= 2 and q.co != ref.co and q.co in protected_cos)
+
+def _pick_shared(pools, cluster, users, overlaps, in_variant, ref, spec, variant, max_overlap):
+    """A question already used by other variants that keeps every pairwise overlap in bounds"""
+    for level, key in enumerate(_slot_keys(ref)):
+        if not _relaxable(level, ref, spec):
+            break
+        for q in pools[level].get(key, ()):
+            if cluster[q.id] in in_variant or not spec.allows(q):
+                continue
+            if all(overlaps[variant][other] < max_overlap for other in users.get(cluster[q.id], ())):
+                return q
+    return None
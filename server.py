@@ -0,0 +1,456 @@
+"""
+Local HTTP service that generates question papers on request.
+
+    python server.py --banks banks/ --templates templates/ --port 8080
+
+Question banks and templates are loaded when the service starts and stay parsed in
+the memory of a fixed pool of worker processes, so a request only pays for
+selection, rendering and saving. The event loop itself only parses HTTP and hands
+jobs to the pool. At most --workers papers are rendered at once and at most
+--queue more wait for a worker; requests beyond that get 503 with Retry-After.
+
+Endpoints:
+    GET  /health          liveness check
+    GET  /banks           loaded banks (with question counts) and templates
+    GET  /metrics         request counts, queue depth and latency percentiles
+    POST /papers          generate a paper; the JSON body names the bank and template:
+                          {"bank": "cloud_computing", "template": "template", "seed": 7,
+                           "rules": {"target": 25}}
+                          Returns the .docx, or with "wait": false, 202 and a job URL;
+                          "plain_text": true skips copying the questions' formatting
+    GET  /jobs/<id>       state of a queued paper, or the .docx once it is ready
+
+Bank and template names are file names without ".docx". Everything runs locally
+with the standard library; nothing is sent anywhere.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from batch import block_specs
+from duplicates import DEFAULT_THRESHOLD
+from qgen import expand_bank_paths, fill_paper_table, load_question_bank
+from questions import QuestionBank
+from render import CompiledTemplate
+from selection import SelectionError, select_paper
+from transplant import FormattedQuestions
+
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+# Finished asynchronous jobs kept for collection before the oldest are dropped
+MAX_FINISHED_JOBS = 256
+# Latency samples kept per metric for the percentiles
+LATENCY_WINDOW = 2048
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 422: "Unprocessable Entity",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def docx_name(path):
+    """'banks/cloud_computing.docx' -> 'cloud_computing'"""
+    return os.path.basename(path)[:-len(".docx")]
+
+
+# Worker process state: every bank and template, parsed once when the worker starts
+_worker_banks = {}
+_worker_templates = {}
+# Bank paragraph indexes for copying question formatting, built on first use
+_worker_paragraphs = {}
+
+def _init_worker(bank_paths, template_paths, use_cache, duplicates, similarity):
+    for path in bank_paths:
+        questions = load_question_bank(path, use_cache=use_cache)
+        for q in questions:
+            q["source"] = path
+        bank = QuestionBank(questions)
+        if duplicates != "off":
+            bank.mark_duplicates(similarity, use_cache)
+            if duplicates == "collapse":
+                bank = bank.without_duplicates()
+        _worker_banks[docx_name(path)] = bank
+    for path in template_paths:
+        _worker_templates[docx_name(path)] = CompiledTemplate(path)
+
+def render_paper(job):
+    """Select and render one paper in a worker; returns a result dict instead of raising"""
+    start = time.perf_counter()
+    result = {"ok": False}
+    try:
+        bank = _worker_banks[job["bank"]]
+        template = _worker_templates[job["template"]]
+        bank.reset()
+        blocks = select_paper(bank, block_specs(job.get("rules", {})), seed=job.get("seed"))
+        formatted = None
+        if not job.get("plain_text"):
+            formatted = FormattedQuestions((q for block in blocks for q in block), _worker_paragraphs)
+        document, table = template.new_paper()
+        fill_paper_table(table, blocks, template.renderer(table, formatted and formatted.paragraphs))
+        output = BytesIO()
+        template.save(document, output, formatted and formatted.package(q for block in blocks for q in block))
+        result["ok"] = True
+        result["docx"] = output.getvalue()
+        result["totals"] = [sum(q.marks for q in block) for block in blocks]
+    except SelectionError as e:
+        result["status"] = 422
+        result["error"] = str(e)
+    except Exception as e:
+        result["status"] = 500
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["render_seconds"] = time.perf_counter() - start
+    return result
+
+
+# JSON types of the BlockSpec fields a request may give (see selection.BlockSpec)
+_INT_FIELDS = ("target", "min_parts", "max_parts")
+_LIST_FIELDS = ("required_cos", "required_rbts", "allowed_cos", "allowed_rbts")
+_NULLABLE_FIELDS = ("max_parts", "allowed_cos", "allowed_rbts")
+
+
+def _check_rules(rules):
+    """Raise ValueError unless the block fields in a job's rules have the types BlockSpec expects"""
+    if "blocks" in rules:
+        blocks = rules["blocks"]
+        if not isinstance(blocks, list) or not all(isinstance(block, dict) for block in blocks):
+            raise ValueError("\"blocks\" must be a list of JSON objects")
+    else:
+        blocks = [{"target": rules["target"]}] if "target" in rules else []
+    for number, block in enumerate(blocks, start=1):
+        where = f"block {number}: " if "blocks" in rules else ""
+        for name, value in block.items():
+            if value is None and name in _NULLABLE_FIELDS:
+                continue
+            if name in _INT_FIELDS:
+                if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                    raise ValueError(f"{where}\"{name}\" must be a whole number")
+            elif name in _LIST_FIELDS:
+                if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                    raise ValueError(f"{where}\"{name}\" must be a list of strings")
+            else:
+                raise ValueError(f"{where}unknown field \"{name}\"")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class LatencyStats:
+    """Counts and a sliding window of latencies, reported as percentiles in milliseconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, seconds):
+        self.count += 1
+        self.samples.append(seconds)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2) if ordered else None
+        return {"count": self.count, "p50_ms": percentile(0.5), "p90_ms": percentile(0.9),
+                "p99_ms": percentile(0.99), "max_ms": round(ordered[-1] * 1000, 2) if ordered else None}
+
+
+class PaperService:
+    """Routes requests, bounds the work handed to the worker pool and keeps the metrics"""
+
+    def __init__(self, executor, workers, queue_size, banks, templates):
+        self.executor = executor
+        self.workers = workers
+        self.queue_size = queue_size
+        self.banks = banks
+        self.templates = templates
+        self._slots = asyncio.Semaphore(workers)
+        self._waiting = 0
+        self._running = 0
+        self._jobs = OrderedDict()
+        self._job_ids = itertools.count(1)
+        self.started = time.time()
+        self.responses = {}
+        self.rejected = 0
+        self.latency = {}
+
+    def _record(self, name, seconds):
+        stats = self.latency.get(name)
+        if stats is None:
+            stats = self.latency[name] = LatencyStats()
+        stats.add(seconds)
+
+    async def _generate(self, job):
+        """Run a job on the pool once a worker is free; raises HTTPError(503) when the queue is full"""
+        if self._waiting >= self.queue_size and self._slots.locked():
+            self.rejected += 1
+            raise HTTPError(503, "All workers are busy and the queue is full; try again shortly",
+                            {"Retry-After": "1"})
+        queued = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._record("queue_wait", time.perf_counter() - queued)
+        self._running += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, render_paper, job)
+        finally:
+            self._running -= 1
+            self._slots.release()
+        self._record("render", result["render_seconds"])
+        return result
+
+    def _validate_job(self, body):
+        try:
+            job = json.loads(body or b"{}")
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON: {e}")
+        if not isinstance(job, dict):
+            raise HTTPError(400, "The request body must be a JSON object")
+        if job.get("bank") not in self.banks:
+            raise HTTPError(400, f"Unknown bank {job.get('bank')!r}; see GET /banks")
+        if len(self.templates) == 1:
+            job.setdefault("template", next(iter(self.templates)))
+        if job.get("template") not in self.templates:
+            raise HTTPError(400, f"Unknown template {job.get('template')!r}; see GET /banks")
+        if not isinstance(job.get("rules", {}), dict):
+            raise HTTPError(400, "\"rules\" must be a JSON object")
+        try:
+            _check_rules(job.get("rules", {}))
+            block_specs(job.get("rules", {}))
+        except (TypeError, ValueError, KeyError) as e:
+            raise HTTPError(400, f"Invalid rules: {e}")
+        seed = job.get("seed")
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            raise HTTPError(400, "\"seed\" must be an integer")
+        for option in ("wait", "plain_text"):
+            if not isinstance(job.get(option, False), bool):
+                raise HTTPError(400, f"\"{option}\" must be true or false")
+        return job
+
+    def _paper_response(self, job, result):
+        if not result["ok"]:
+            return result.get("status", 500), {"error": result["error"]}, {}
+        filename = f"{job['bank']}_paper.docx"
+        headers = {"Content-Disposition": f'attachment; filename="{filename}"',
+                   "X-Paper-Marks": "/".join(map(str, result["totals"]))}
+        return 200, (DOCX_TYPE, result["docx"]), headers
+
+    async def post_papers(self, body):
+        job = self._validate_job(body)
+        if job.get("wait", True):
+            result = await self._generate(job)
+            return self._paper_response(job, result)
+
+        # Asynchronous: answer now and keep the result until it is collected
+        if self._waiting >= self.queue_size and self._slots.locked():
+            self.rejected += 1
+            raise HTTPError(503, "All workers are busy and the queue is full; try again shortly",
+                            {"Retry-After": "1"})
+        job_id = str(next(self._job_ids))
+        task = asyncio.create_task(self._generate(job))
+        self._jobs[job_id] = (job, task)
+        while len(self._jobs) > MAX_FINISHED_JOBS:
+            oldest_id, (_, oldest) = next(iter(self._jobs.items()))
+            if not oldest.done():
+                break
+            del self._jobs[oldest_id]
+        return 202, {"job": job_id, "url": f"/jobs/{job_id}"}, {"Location": f"/jobs/{job_id}"}
+
+    def get_job(self, job_id):
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            raise HTTPError(404, f"No job {job_id}")
+        job, task = entry
+        if not task.done():
+            return 202, {"job": job_id, "state": "queued or rendering"}, {}
+        del self._jobs[job_id]
+        try:
+            result = task.result()
+        except HTTPError as e:
+            return e.status, {"error": str(e)}, e.headers
+        return self._paper_response(job, result)
+
+    def metrics(self):
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "workers": self.workers,
+            "rendering": self._running,
+            "queued": self._waiting,
+            "queue_limit": self.queue_size,
+            "rejected": self.rejected,
+            "pending_jobs": len(self._jobs),
+            "responses": {str(status): count for status, count in sorted(self.responses.items())},
+            "latency": {name: stats.summary() for name, stats in sorted(self.latency.items())},
+        }
+
+    async def route(self, method, path, body):
+        path = path.split("?", 1)[0]
+        if path == "/health":
+            return 200, {"status": "ok"}, {}
+        if path == "/banks":
+            return 200, {"banks": self.banks, "templates": sorted(self.templates)}, {}
+        if path == "/metrics":
+            return 200, self.metrics(), {}
+        if path == "/papers":
+            if method != "POST":
+                raise HTTPError(405, "Use POST /papers", {"Allow": "POST"})
+            return await self.post_papers(body)
+        if path.startswith("/jobs/"):
+            return self.get_job(path[len("/jobs/"):])
+        raise HTTPError(404, f"No such endpoint: {path}")
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        method, path = "-", "-"
+        # Requests that cannot be read are timed together, whatever they asked for
+        endpoint = "invalid"
+        try:
+            try:
+                method, path, body = await read_request(reader)
+                endpoint = f"{method} {path.split('?', 1)[0] if not path.startswith('/jobs/') else '/jobs'}"
+                status, payload, headers = await self.route(method, path, body)
+            except HTTPError as e:
+                status, payload, headers = e.status, {"error": str(e)}, e.headers
+            except Exception as e:
+                status, payload, headers = 500, {"error": f"{type(e).__name__}: {e}"}, {}
+            await write_response(writer, status, payload, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+        elapsed = time.perf_counter() - start
+        self.responses[status] = self.responses.get(status, 0) + 1
+        self._record(endpoint, elapsed)
+        print(f"{method} {path} {status} {elapsed * 1000:.1f} ms")
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request; returns (method, path, body)"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(413, "Request headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Malformed Content-Length header")
+    if length < 0:
+        raise HTTPError(400, "Malformed Content-Length header")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, body
+
+
+async def write_response(writer, status, payload, headers):
+    if isinstance(payload, tuple):
+        content_type, data = payload
+    else:
+        content_type, data = "application/json", json.dumps(payload, indent=2).encode("utf-8") + b"\n"
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}",
+            "Connection: close"]
+    head.extend(f"{name}: {value}" for name, value in headers.items())
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+    await writer.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve question paper generation over local HTTP.")
+    parser.add_argument("--banks", default=".", metavar="DIR_OR_GLOB",
+                        help="question banks to serve (default: every .docx in the current directory)")
+    parser.add_argument("--templates", default="template.docx", metavar="DIR_OR_GLOB",
+                        help="templates to serve (default: template.docx)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes rendering papers (default: number of CPU cores)")
+    parser.add_argument("--queue", type=int, default=32,
+                        help="papers that may wait for a worker before requests get 503 (default: 32)")
+    parser.add_argument("--duplicates", choices=("flag", "collapse", "off"), default="flag",
+                        help="near-duplicate handling, as in qgen.py (default: flag)")
+    parser.add_argument("--similarity", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"near-duplicate similarity threshold (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--no-cache", action="store_true", help="parse banks without the bank cache")
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    template_paths = expand_bank_paths(args.templates)
+    bank_paths = [p for p in expand_bank_paths(args.banks) if p not in template_paths]
+    if not bank_paths or not template_paths:
+        print("No question banks or templates found.")
+        return 2
+
+    # Parse everything once here (filling the bank cache) so errors show before serving
+    banks = {}
+    for path in bank_paths:
+        try:
+            banks[docx_name(path)] = len(load_question_bank(path, use_cache=not args.no_cache))
+        except Exception as e:
+            print(f"Skipping bank {path}: {e}")
+    templates = {}
+    for path in template_paths:
+        try:
+            CompiledTemplate(path)
+            templates[docx_name(path)] = path
+        except Exception as e:
+            print(f"Skipping template {path}: {e}")
+    bank_paths = [p for p in bank_paths if docx_name(p) in banks]
+    template_paths = list(templates.values())
+    if not banks or not templates:
+        print("No usable question banks or templates.")
+        return 2
+
+    workers = args.workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(bank_paths, template_paths, not args.no_cache,
+                                             args.duplicates, args.similarity))
+    # Start every worker now so the first requests do not pay for loading
+    await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(executor, os.getpid)
+                           for _ in range(workers)))
+    service = PaperService(executor, workers, args.queue, banks, templates)
+    server = await asyncio.start_server(service.handle, args.host, args.port, limit=MAX_HEADER_BYTES)
+    print(f"Serving {len(banks)} bank(s) and {len(templates)} template(s) on "
+          f"http://{args.host}:{args.port} with {workers} worker(s)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        return asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\nStopped.")
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Tests for the marking scheme and CO/RBT summary documents (run with pytest)."""
+import os
+from io import BytesIO
+
+import pytest
+from docx import Document
+
+from bench import synthetic_question_texts
+from companions import PaperSummary, render_marking_scheme, render_summary
+from qgen import PAPER_LAYOUT, parse_questions
+from questions import QuestionBank
+from render import CompiledTemplate
+from selection import BlockSpec, select_paper
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.docx")
+
+
+@pytest.fixture
+def summary():
+    bank = QuestionBank(parse_questions(synthetic_question_texts(200)))
+    return PaperSummary(select_paper(bank, [BlockSpec(25) for _ in range(4)], seed=1), PAPER_LAYOUT)
+
+
+def companion_tables(template, summary):
+    """Cell texts of every table in the saved marking scheme and summary"""
+    tables = []
+    for document in (render_marking_scheme(template, summary), render_summary(template, summary)):
+        output = BytesIO()
+        template.save(document, output)
+        tables.extend([[cell.text for cell in row.cells] for row in table.rows]
+                      for table in Document(output).tables)
+    return tables
+
+
+def test_every_column_is_written(summary):
+    scheme, per_question, co_table, rbt_table = companion_tables(CompiledTemplate(TEMPLATE), summary)
+    assert scheme[0] == ["Q.No", "QUESTION", "MARKS", "CO", "RBT"]
+    assert per_question[0] == ["Q.No", "PARTS", "MARKS", "CO", "RBT"]
+    for table, name, other, coverage in ((co_table, "CO", "RBT", summary.co_coverage()),
+                                         (rbt_table, "RBT", "CO", summary.rbt_coverage())):
+        assert table[0] == [name, "QUESTIONS", "MARKS", "% OF MARKS", other]
+        assert [row[0] for row in table[1:]] == [value for value, *_ in coverage]
+        assert all(row[3].endswith("%") and row[4] for row in table[1:])
+    assert sum(float(row[3][:-1]) for row in co_table[1:]) == pytest.approx(100, abs=0.5)
+
+
+def test_scheme_lists_every_question(summary):
+    scheme = companion_tables(CompiledTemplate(TEMPLATE), summary)[0]
+    labels = [row[0] for row in scheme if row[0] and row[1] != row[0]][1:]
+    assert labels == [label for label, *_ in summary.rows]
+    totals = [int(row[2]) for row in scheme if row[1].startswith("Total for Q")]
+    assert totals == summary.question_marks
@@ -0,0 +1,55 @@
+"""Tests for importing past papers into the usage history (run with pytest)."""
+import datetime
+import os
+
+from companions import PaperSummary, companion_filenames, render_marking_scheme, render_summary
+from history import UsageHistory, import_papers, read_paper
+from qgen import PAPER_LAYOUT, fill_paper_table, parse_questions
+from questions import QuestionBank
+from render import CompiledTemplate
+from selection import BlockSpec, select_paper
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.docx")
+
+
+def write_paper(directory):
+    """Write a paper and its companions to directory; returns (paper, scheme, summary) paths"""
+    texts = [f"Explain topic {i} of cloud computing (Marks: {5 + i % 2 * 5}) (CO: CO-{1 + i % 3}) "
+             f"(RBT: L{1 + i % 4})" for i in range(40)]
+    blocks = select_paper(QuestionBank(parse_questions(texts)), [BlockSpec(25) for _ in range(4)], seed=1)
+    template = CompiledTemplate(TEMPLATE)
+    document, table = template.new_paper()
+    fill_paper_table(table, blocks, template.renderer(table))
+    summary = PaperSummary(blocks, PAPER_LAYOUT)
+    paper = os.path.join(directory, "paper.docx")
+    outputs = [paper, *companion_filenames(paper)]
+    documents = [document, render_marking_scheme(template, summary), render_summary(template, summary)]
+    template.save_many((document, output, None) for document, output in zip(documents, outputs))
+    return outputs
+
+
+def test_scheme_totals_are_not_questions(tmp_path):
+    paper, scheme, _ = write_paper(str(tmp_path))
+    paper_rows = read_paper(paper)
+    scheme_rows = read_paper(scheme)
+    assert scheme_rows == paper_rows
+    assert all(number and co and rbt for number, _, _, co, rbt in scheme_rows)
+    assert not any(question.startswith("Total") for _, question, _, _, _ in scheme_rows)
+
+
+def test_import_skips_companions(tmp_path):
+    paper, scheme, summary = write_paper(str(tmp_path))
+    with UsageHistory(str(tmp_path / "history.sqlite3")) as history:
+        imported = list(import_papers(history, [paper, scheme, summary], "cloud", datetime.date(2026, 1, 5)))
+        assert [count for _, count, _ in imported] == [len(read_paper(paper)), None, None]
+        assert history.recorded_on(scheme) is None
+
+
+def test_import_date_overrides_recorded_date(tmp_path):
+    paper, _, _ = write_paper(str(tmp_path))
+    with UsageHistory(str(tmp_path / "history.sqlite3")) as history:
+        list(import_papers(history, [paper], "cloud", datetime.date(2026, 1, 5)))
+        list(import_papers(history, [paper], "cloud"))
+        assert history.recorded_on(paper) == datetime.date(2026, 1, 5)
+        list(import_papers(history, [paper], "cloud", datetime.date(2026, 3, 1)))
+        assert history.recorded_on(paper) == datetime.date(2026, 3, 1)
@@ -0,0 +1,368 @@
+"""
+Carry questions from the bank into the paper with their formatting.
+
+The question cell normally gets the question's plain text, which loses bold,
+subscripts, equations and inline images. FormattedQuestions instead copies each
+selected question's paragraph XML from its bank:
+
+- BankParagraphs finds the body paragraphs of a bank's document.xml with the byte
+  scanner from watch.py, and parses only the selected paragraphs, in one lxml call
+  per bank. Nothing is wrapped in python-docx objects.
+- The (Marks: ..) (CO: ..) (RBT: ..) tags are cut out of the <w:t> texts, even when
+  a tag is split across runs, exactly as extract_question_info removes them from
+  the text. A paragraph whose remaining text does not match the question (e.g. the
+  bank changed since it was loaded) is left out and the cell keeps the plain text.
+- Paragraph properties, comments, footnote references and bookmarks are dropped,
+  since they refer to styles, numbering and parts of the bank.
+- Relationship ids (images, hyperlinks, embedded objects) are remapped in bulk.
+  Each bank part is copied once per render, together with the parts it refers to,
+  under a new name. The paper gets the new relationships and content types when
+  it is saved (see docx_writer.PackageAdditions).
+"""
+import posixpath
+import zipfile
+
+from lxml import etree
+
+from docx_writer import PackageAdditions
+from qgen import (QUESTION_TAG_PATTERN, W_HYPERLINK, W_NS, W_R, W_T, W_TYPE, _RUN_CHILD_TEXT,
+                  _main_document_part)
+from watch import _PARSER, _Document, _file_state
+
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+CT_NS = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+WP_DOC_PR = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}docPr"
+W_PPR = W_NS + "pPr"
+W_BR = W_NS + "br"
+W_RPR = W_NS + "rPr"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+# Paragraph content that points into parts of the bank the paper does not get
+_DROPPED = {W_NS + name for name in (
+    "commentRangeStart", "commentRangeEnd", "commentReference", "footnoteReference",
+    "endnoteReference", "bookmarkStart", "bookmarkEnd", "proofErr", "permStart", "permEnd")}
+# Ids of copied drawings start here, above those of the template's own drawings
+_FIRST_DRAWING_ID = 100000
+
+
+def _tag_spans(text):
+    """Spans of the tags extract_question_info removes: the first of each kind and identical repeats"""
+    found = {}
+    spans = []
+    for match in QUESTION_TAG_PATTERN.finditer(text):
+        if found.setdefault(match.lastgroup, match.group(0)) == match.group(0):
+            spans.append(match.span())
+    return spans
+
+
+def _text_pieces(paragraph):
+    """(element, text) of every run child with text, in the order _paragraph_text reads them"""
+    pieces = []
+    for child in paragraph:
+        if child.tag == W_R:
+            runs = (child,)
+        elif child.tag == W_HYPERLINK:
+            runs = [run for run in child if run.tag == W_R]
+        else:
+            continue
+        for run in runs:
+            for element in run:
+                if element.tag == W_T:
+                    text = element.text or ""
+                elif element.tag == W_BR:
+                    text = "\n" if element.get(W_TYPE, "textWrapping") == "textWrapping" else ""
+                else:
+                    text = _RUN_CHILD_TEXT.get(element.tag, "")
+                if text:
+                    pieces.append((element, text))
+    return pieces
+
+
+def strip_tags(paragraph, question):
+    """
+    Remove the metadata tags and surrounding whitespace from a <w:p>'s runs, in place.
+    Returns False, leaving the paragraph unchanged, if its text would not be question.
+    """
+    pieces = _text_pieces(paragraph)
+    text = "".join(piece for _, piece in pieces)
+    keep = bytearray(b"\x01") * len(text)
+    for start, end in _tag_spans(text):
+        keep[start:end] = bytes(end - start)
+    kept = [i for i in range(len(text)) if keep[i]]
+    # The question text is stripped after the tags are cut out
+    remaining = "".join(text[i] for i in kept)
+    lead = len(remaining) - len(remaining.lstrip())
+    trail = len(remaining) - len(remaining.rstrip())
+    for i in kept[:lead] + kept[len(kept) - trail:]:
+        keep[i] = 0
+    if "".join(text[i] for i in range(len(text)) if keep[i]) != question:
+        return False
+    if all(keep):
+        return True
+    offset = 0
+    for element, piece in pieces:
+        end = offset + len(piece)
+        if not all(keep[offset:end]):
+            new_text = "".join(c for c, k in zip(piece, keep[offset:end]) if k)
+            if not new_text:
+                run = element.getparent()
+                run.remove(element)
+                # A run left with nothing but its properties goes too
+                if all(child.tag == W_RPR for child in run):
+                    run.getparent().remove(run)
+            else:
+                element.text = new_text
+                if new_text != new_text.strip():
+                    element.set(XML_SPACE, "preserve")
+        offset = end
+    return True
+
+
+class BankParagraphs:
+    """A bank's body paragraphs by number, parsed only when asked for"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = _file_state(path)
+        with zipfile.ZipFile(path) as docx_zip:
+            self.part_name = _main_document_part(docx_zip)
+            document = _Document(docx_zip.read(self.part_name))
+            self.rels = self._read_rels(docx_zip, self.part_name)
+            self.content_types = etree.fromstring(docx_zip.read("[Content_Types].xml"))
+        self._document = document
+        # Spans of the body-level paragraphs; paragraph number n is at n - 1
+        self.spans = [(start, end) for start, end, is_paragraph
+                      in document.element_spans()
+                      if is_paragraph]
+
+    @staticmethod
+    def _read_rels(docx_zip, part_name):
+        """{Id: (type, target, external)} of a part's relationships"""
+        directory, name = posixpath.split(part_name)
+        try:
+            rels = etree.fromstring(docx_zip.read(posixpath.join(directory, "_rels", name + ".rels")))
+        except KeyError:
+            return {}
+        return {rel.get("Id"): (rel.get("Type"), rel.get("Target"), rel.get("TargetMode") == "External")
+                for rel in rels.iter(PKG_RELS_NS + "Relationship")}
+
+    def changed(self):
+        try:
+            return _file_state(self.path) != self.state
+        except OSError:
+            return True
+
+    def paragraphs(self, numbers):
+        """{number: <w:p> element} for the given paragraph numbers, parsed in one call"""
+        numbers = sorted({n for n in numbers if 0 < n <= len(self.spans)})
+        if not numbers:
+            return {}
+        document = self._document
+        xml = document.xml
+        wrapped = document.wrap(xml[start:end] for start, end in (self.spans[n - 1] for n in numbers))
+        elements = list(etree.fromstring(wrapped, _PARSER)[0])
+        if len(elements) != len(numbers):
+            raise ValueError("paragraphs do not match their spans")
+        return dict(zip(numbers, elements))
+
+    def content_type(self, part_name):
+        """(content type, is an Override) of a part of the bank"""
+        for override in self.content_types.iter(CT_NS + "Override"):
+            if override.get("PartName") == "/" + part_name:
+                return override.get("ContentType"), True
+        extension = part_name.rpartition(".")[2].lower()
+        for default in self.content_types.iter(CT_NS + "Default"):
+            if default.get("Extension").lower() == extension:
+                return default.get("ContentType"), False
+        return "application/octet-stream", False
+
+
+class FormattedQuestions:
+    """
+    Bank paragraphs of the given questions, prepared for the paper's question cells.
+
+    paragraphs maps question ids to prepared <w:p> elements (without paragraph
+    properties), for TableRenderer; package(questions) gives the parts and
+    relationships a paper with those questions needs. banks is an optional
+    {path: BankParagraphs} cache, so a long-running worker scans each bank once.
+    """
+
+    def __init__(self, questions, banks=None):
+        self.paragraphs = {}
+        self.banks = banks if banks is not None else {}
+        # New relationship id -> (type, target, external) and the parts it brings
+        self._relationships = {}
+        self._rel_parts = {}
+        # Copied part -> it and the parts it refers to
+        self._copied_with = {}
+        # Relationship ids each question uses
+        self._question_rels = {}
+        self._parts = {}
+        self._defaults = {}
+        self._overrides = {}
+        self._drawing_id = _FIRST_DRAWING_ID
+
+        by_source = {}
+        for q in questions:
+            if q.source is not None and q.paragraph is not None:
+                by_source.setdefault(q.source, []).append(q)
+        for index, (source, source_questions) in enumerate(by_source.items()):
+            try:
+                bank = self._bank(source)
+                elements = bank.paragraphs(q.paragraph for q in source_questions)
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile, etree.XMLSyntaxError) as e:
+                # Unreadable bank: its questions keep their plain text
+                print(f"Could not read {source} to copy question formatting ({e}); "
+                      f"its {len(source_questions)} question(s) are written as plain text.")
+                continue
+            copier = _PartCopier(self, bank, f"qgen{index + 1}_")
+            try:
+                for q in source_questions:
+                    paragraph = elements.get(q.paragraph)
+                    if paragraph is None or not strip_tags(paragraph, q.question):
+                        continue
+                    self._question_rels[q.id] = self._prepare(paragraph, copier)
+                    self.paragraphs[q.id] = paragraph
+            finally:
+                copier.close()
+
+    def _bank(self, path):
+        bank = self.banks.get(path)
+        if bank is None or bank.changed():
+            bank = self.banks[path] = BankParagraphs(path)
+        return bank
+
+    def _prepare(self, paragraph, copier):
+        """Drop bank-only content, renumber drawings and remap relationship ids; returns the new ids"""
+        properties = paragraph.find(W_PPR)
+        if properties is not None:
+            paragraph.remove(properties)
+        dropped = [element for element in paragraph.iter(*_DROPPED)]
+        for element in dropped:
+            element.getparent().remove(element)
+        for doc_pr in paragraph.iter(WP_DOC_PR):
+            doc_pr.set("id", str(self._drawing_id))
+            self._drawing_id += 1
+        used = set()
+        for element in paragraph.iter():
+            for name, value in element.attrib.items():
+                if name.startswith("{" + R_NS + "}"):
+                    new_id = copier.relationship(value)
+                    if new_id is not None:
+                        element.set(name, new_id)
+                        used.add(new_id)
+        return used
+
+    def package(self, questions):
+        """PackageAdditions for a paper holding these questions"""
+        additions = PackageAdditions()
+        rel_ids = set()
+        for q in questions:
+            rel_ids.update(self._question_rels.get(q.id, ()))
+        parts = set()
+        for rel_id in sorted(rel_ids):
+            additions.relationships.append((rel_id,) + self._relationships[rel_id])
+            parts.update(self._rel_parts[rel_id])
+        for name in sorted(parts):
+            additions.parts[name] = self._parts[name]
+            if name in self._overrides:
+                additions.overrides["/" + name] = self._overrides[name]
+            elif name in self._defaults:
+                extension, content_type = self._defaults[name]
+                additions.defaults.setdefault(extension, content_type)
+        return additions
+
+
+class _PartCopier:
+    """Copies the parts one bank's paragraphs refer to, each once, under prefixed names"""
+
+    def __init__(self, formatted, bank, prefix):
+        self.formatted = formatted
+        self.bank = bank
+        self.prefix = prefix
+        self.new_ids = {}
+        self.new_names = {}
+        self._zip = None
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+    def relationship(self, rel_id):
+        """New id for a relationship of the bank's document part, or None if it has none"""
+        if rel_id in self.new_ids:
+            return self.new_ids[rel_id]
+        rel = self.bank.rels.get(rel_id)
+        if rel is None:
+            return None
+        rel_type, target, external = rel
+        formatted = self.formatted
+        new_id = f"rIdQ{len(formatted._relationships) + 1}"
+        parts = []
+        if not external:
+            directory = posixpath.dirname(self.bank.part_name)
+            target = self._copy(_resolve(directory, target), parts)
+            if target is None:
+                self.new_ids[rel_id] = None
+                return None
+        formatted._relationships[new_id] = (rel_type, target, external)
+        formatted._rel_parts[new_id] = parts
+        self.new_ids[rel_id] = new_id
+        return new_id
+
+    def _read(self, name):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.bank.path)
+        try:
+            return self._zip.read(name)
+        except KeyError:
+            return None
+
+    def _copy(self, name, parts):
+        """Copy a bank part (and what its own relationships point to); returns its new name"""
+        if name in self.new_names:
+            new_name = self.new_names[name]
+            if new_name is not None:
+                # A part still being copied (relationships in a cycle) brings just itself
+                parts.extend(self.formatted._copied_with.get(new_name, (new_name,)))
+            return new_name
+        data = self._read(name)
+        if data is None:
+            self.new_names[name] = None
+            return None
+        formatted = self.formatted
+        directory, base = posixpath.split(name)
+        new_name = posixpath.join(directory, self.prefix + base)
+        self.new_names[name] = new_name
+        copied = [new_name]
+        formatted._parts[new_name] = data
+        content_type, is_override = self.bank.content_type(name)
+        if is_override:
+            formatted._overrides[new_name] = content_type
+        else:
+            formatted._defaults[new_name] = (base.rpartition(".")[2].lower(), content_type)
+
+        rels_data = self._read(posixpath.join(directory, "_rels", base + ".rels"))
+        if rels_data is not None:
+            rels = etree.fromstring(rels_data)
+            for rel in rels.iter(PKG_RELS_NS + "Relationship"):
+                if rel.get("TargetMode") == "External":
+                    continue
+                target = self._copy(_resolve(directory, rel.get("Target")), copied)
+                if target is not None:
+                    rel.set("Target", posixpath.relpath(target, directory))
+            rels_name = posixpath.join(directory, "_rels", self.prefix + base + ".rels")
+            # .rels parts are covered by the package's own "rels" default content type
+            formatted._parts[rels_name] = etree.tostring(rels, xml_declaration=True,
+                                                         encoding="UTF-8", standalone=True)
+            copied.append(rels_name)
+        formatted._copied_with[new_name] = copied
+        parts.extend(copied)
+        return new_name
+
+
+def _resolve(directory, target):
+    """Zip member name of a relationship target, relative to directory unless absolute"""
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(directory, target))
@@ -0,0 +1,328 @@
+"""
+Keep a loaded question bank in step with edits to its .docx file.
+
+    python watch.py bank.docx          # print what changes every time the bank is saved
+
+BankWatcher keeps the previous version of the bank's document.xml together with the
+byte span, text and question id of every body-level paragraph (and table). When the
+file's size or mtime changes, refresh() decompresses document.xml again and
+compares it with the previous version to find the bytes that changed. Only the
+paragraphs overlapping those bytes are parsed (lxml on just that slice) and go
+through extract_question_info; paragraphs before the change are untouched and
+those after it only have their offsets and numbers shifted. Within the changed
+span, paragraphs that only moved keep their question. Questions whose paragraph
+changed or disappeared are removed from the bank and the new versions are added,
+so every unchanged question keeps its id and any selection holding it stays valid.
+
+Decompressing and comparing the XML runs at C speed; the Python work is
+proportional to the edit. If the slice cannot be parsed on its own the whole
+document is re-read instead. Added questions are not checked for near-duplicates
+until the bank is next loaded.
+"""
+import os
+import re
+import sys
+import time
+import zipfile
+from bisect import bisect_left, bisect_right
+
+from lxml import etree
+
+from qgen import W_P, _main_document_part, _paragraph_text, extract_question_info, load_question_bank
+from questions import QuestionBank
+
+W_NS = W_P[1:W_P.index("}")]
+W_TBL = W_P[:-1] + "tbl"
+W_SDT = W_P[:-1] + "sdt"
+_BODY_ELEMENTS = (W_P, W_TBL, W_SDT)
+# The root element's start tag, after the XML declaration and any comments
+_ROOT_START = re.compile(rb"<([^?!\s>/]+)[^>]*>")
+_PARSER = etree.XMLParser(resolve_entities=False, huge_tree=True)
+# Body elements parsed at a time when the whole document is read
+_CHUNK = 5000
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _read_document_xml(path):
+    with zipfile.ZipFile(path) as docx_zip:
+        return docx_zip.read(_main_document_part(docx_zip))
+
+
+def _common_prefix(a, b):
+    """Length of the common prefix of two byte strings, by bisection on slice comparisons"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class _Document:
+    """
+    document.xml with the spans and texts of its body-level elements. Tags are found
+    with the prefix the root element binds to WordprocessingML, which need not be w:
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        root = _ROOT_START.search(xml)
+        if root is None:
+            raise ValueError("no root element in document.xml")
+        self.root_tag = root.group(0)
+        # The prefix WordprocessingML is bound to, usually "w:" but not always
+        # ("" when it is the default namespace)
+        try:
+            nsmap = etree.fromstring(self.root_tag + b"</" + root.group(1) + b">", _PARSER).nsmap
+        except etree.XMLSyntaxError as e:
+            raise ValueError(f"unreadable root element in document.xml ({e})")
+        prefix = next((p for p, uri in nsmap.items() if uri == W_NS), False)
+        if prefix is False:
+            raise ValueError("document.xml is not a WordprocessingML document")
+        prefix = (prefix + ":").encode("ascii") if prefix else b""
+        self.element_tag = re.compile(rb"<(/?)" + re.escape(prefix) + rb"(p|tbl|sdt)[\s/>]")
+        self.body_open = b"<" + prefix + b"body>"
+        self.body_close = b"</" + prefix + b"body></" + root.group(1) + b">"
+        body = re.compile(rb"<" + re.escape(prefix) + rb"body\b[^>]*>").search(xml, root.end())
+        if body is None:
+            raise ValueError("no body in document.xml")
+        self.body_start = body.end()
+        self.body_end = xml.rindex(b"</" + prefix + b"body>")
+
+    def element_spans(self, start=None, end=None):
+        """
+        (start, end, is_paragraph) byte spans of the top-level p/tbl/sdt elements
+        between start and end (by default, of the whole body)
+        """
+        xml = self.xml
+        start = self.body_start if start is None else start
+        end = self.body_end if end is None else end
+        spans = []
+        depth = 0
+        element_start = is_paragraph = None
+        for m in self.element_tag.finditer(xml, start, end):
+            if m.group(1):
+                depth -= 1
+                if depth < 0:
+                    raise ValueError("unbalanced body elements")
+                if depth == 0:
+                    spans.append((element_start, m.end(), is_paragraph))
+                continue
+            tag_end = xml.index(b">", m.start())
+            if depth == 0:
+                element_start, is_paragraph = m.start(), m.group(2) == b"p"
+            if xml[tag_end - 1] == 0x2F:  # "/>": an empty element
+                if depth == 0:
+                    spans.append((element_start, tag_end + 1, is_paragraph))
+            else:
+                depth += 1
+        if depth:
+            raise ValueError("unbalanced body elements")
+        return spans
+
+    def wrap(self, parts):
+        """Byte strings of body elements put inside the root and body tags, ready to parse"""
+        return b"".join([self.root_tag, self.body_open, *parts, self.body_close])
+
+    def parse(self, spans):
+        """Texts of the elements at spans (None for tables and content controls)"""
+        if not spans:
+            return []
+        body = etree.fromstring(self.wrap([self.xml[spans[0][0]:spans[-1][1]]]), _PARSER)[0]
+        elements = [child for child in body if child.tag in _BODY_ELEMENTS]
+        if len(elements) != len(spans) or any((e.tag == W_P) != p for e, (_, _, p) in zip(elements, spans)):
+            raise ValueError("body elements do not match their spans")
+        return [_paragraph_text(e).strip() if e.tag == W_P else None for e in elements]
+
+
+class BankWatcher:
+    """Applies the edits saved to one bank file to the questions it contributed to a QuestionBank"""
+
+    def __init__(self, bank, path):
+        self.bank = bank
+        self.path = path
+        self._state = _file_state(path)
+        document = _Document(_read_document_xml(path))
+        spans = document.element_spans()
+        texts = []
+        for i in range(0, len(spans), _CHUNK):
+            texts.extend(document.parse(spans[i:i + _CHUNK]))
+        self._document = document
+        self.starts = [start for start, _, _ in spans]
+        self.ends = [end for _, end, _ in spans]
+        self.texts = texts
+        # Paragraphs up to and including each element, i.e. the paragraph number of paragraphs
+        self.numbers = []
+        count = 0
+        for _, _, is_paragraph in spans:
+            count += is_paragraph
+            self.numbers.append(count)
+        qid_at = {bank[qid].paragraph: qid for qid in bank.by_source.get(path, ())}
+        # Question id of every element, None for those that are not questions in the bank
+        self.qids = [qid_at.get(number) if text else None for number, text in zip(self.numbers, texts)]
+
+    def changed(self):
+        """True if the file's size or mtime differs from the last version read"""
+        try:
+            return _file_state(self.path) != self._state
+        except OSError:
+            return False
+
+    def refresh(self):
+        """
+        Re-read the bank if the file changed and update the bank in place. Returns a dict
+        with the "added" and "removed" question ids, the number of "reparsed" paragraphs
+        and the "seconds" taken, or None if nothing changed or the file could not be read
+        (e.g. while Word is still writing it; the next refresh tries again).
+        """
+        if not self.changed():
+            return None
+        start = time.perf_counter()
+        try:
+            state = _file_state(self.path)
+            document = _Document(_read_document_xml(self.path))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        if document.xml == self._document.xml:
+            # Saved without changes
+            self._state = state
+            return None
+        try:
+            first, last, spans, texts = self._changed_elements(document)
+        except (ValueError, etree.XMLSyntaxError):
+            # The changed bytes could not be parsed on their own: compare every element
+            try:
+                spans = document.element_spans()
+                texts = []
+                for i in range(0, len(spans), _CHUNK):
+                    texts.extend(document.parse(spans[i:i + _CHUNK]))
+            except (ValueError, etree.XMLSyntaxError):
+                return None
+            first, last = 0, len(self.starts)
+        self._state = state
+        change = self._apply(document, first, last, spans, texts)
+        change["seconds"] = time.perf_counter() - start
+        return change
+
+    def _changed_elements(self, document):
+        """
+        Compare document with the previous version. Returns (first, last, spans, texts):
+        the old elements first..last-1 are replaced by the new elements at spans.
+        """
+        old, new = self._document.xml, document.xml
+        prefix = _common_prefix(old, new)
+        suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+        if prefix < self._document.body_start or len(old) - suffix > self._document.body_end:
+            raise ValueError("the change is outside the body")
+        # Old elements overlapping the changed bytes; the window runs from the end of the
+        # element before them to the start of the one after, which are unchanged
+        first = bisect_right(self.ends, prefix)
+        last = bisect_left(self.starts, len(old) - suffix)
+        window_start = self.ends[first - 1] if first else self._document.body_start
+        window_end = self.starts[last] if last < len(self.starts) else self._document.body_end
+        shift = len(new) - len(old)
+        spans = document.element_spans(window_start, window_end + shift)
+        return first, last, spans, document.parse(spans)
+
+    def _apply(self, document, first, last, spans, texts):
+        """Replace the old elements first..last-1 with the new spans and texts and update the bank"""
+        bank = self.bank
+        questions = bank.questions
+
+        # Old paragraphs in the changed span, by text, so that moved ones are reused
+        reusable = {}
+        for i in range(first, last):
+            if self.texts[i]:
+                reusable.setdefault(self.texts[i], []).append(self.qids[i])
+
+        count = self.numbers[first - 1] if first else 0
+        numbers, qids = [], []
+        added = []
+        reparsed = 0
+        for (_, _, is_paragraph), text in zip(spans, texts):
+            count += is_paragraph
+            numbers.append(count)
+            qid = None
+            candidates = reusable.get(text) if text else None
+            if candidates:
+                qid = candidates.pop(0)
+            elif text:
+                reparsed += 1
+                q = extract_question_info(text)
+                if q["marks"] > 0:
+                    qid = bank.add(q["question"], q["marks"], q["co"], q["rbt"], self.path, count).id
+                    added.append(qid)
+            if qid is not None:
+                questions[qid].paragraph = count
+            qids.append(qid)
+        removed = [qid for ids in reusable.values() for qid in ids if qid is not None]
+        bank.remove(removed)
+
+        # Elements after the change keep their text; their offsets and numbers shift
+        shift = len(document.xml) - len(self._document.xml)
+        paragraph_shift = count - (self.numbers[last - 1] if last else 0)
+        tail_starts, tail_ends, tail_numbers = self.starts[last:], self.ends[last:], self.numbers[last:]
+        if shift:
+            tail_starts = [start + shift for start in tail_starts]
+            tail_ends = [end + shift for end in tail_ends]
+        if paragraph_shift:
+            tail_numbers = [number + paragraph_shift for number in tail_numbers]
+            for qid in self.qids[last:]:
+                if qid is not None:
+                    questions[qid].paragraph += paragraph_shift
+
+        self.starts[first:] = [start for start, _, _ in spans] + tail_starts
+        self.ends[first:] = [end for _, end, _ in spans] + tail_ends
+        self.numbers[first:] = numbers + tail_numbers
+        self.texts[first:last] = texts
+        self.qids[first:last] = qids
+        self._document = document
+        return {"added": added, "removed": removed, "reparsed": reparsed}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("Usage: python watch.py BANK.docx")
+        return 2
+    path = argv[0]
+    questions = load_question_bank(path)
+    for q in questions:
+        q["source"] = path
+    bank = QuestionBank(questions)
+    watcher = BankWatcher(bank, path)
+    print(f"Watching {path} ({bank.available_count()} questions). Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(0.5)
+            change = watcher.refresh()
+            if change:
+                print(f"{len(change['added'])} question(s) added, {len(change['removed'])} removed, "
+                      f"{change['reparsed']} paragraph(s) re-parsed in {change['seconds'] * 1000:.0f} ms; "
+                      f"{bank.available_count()} questions now.")
+                for qid in change["added"]:
+                    q = bank[qid]
+                    print(f"  + {qid + 1}. {q.question} [{q.marks} marks] (paragraph {q.paragraph})")
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())